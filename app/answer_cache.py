@@ -0,0 +1,157 @@
+# answer_cache.py
+"""
+Response cache in front of the chat graph.
+
+Answers are keyed on (normalized query, enable_llm, retrieval scope, KB
+version); the scope identifies collection / metadata filters. When
+ANSWER_CACHE_SIMILARITY is set, a miss on the exact key falls back to an
+embedding-similarity lookup so near-identical questions share an answer.
+
+The KB version is the mtime of a stamp file that ingestion touches after
+writing to `docs`, so the API process notices ingestion runs from the CLI
+and drops every cached answer.
+
+Environment variables:
+- ANSWER_CACHE_ENABLED: "1" (default) or "0"
+- ANSWER_CACHE_TTL_SECONDS: entry lifetime (default 3600)
+- ANSWER_CACHE_MAX_ENTRIES: LRU capacity (default 512)
+- ANSWER_CACHE_SIMILARITY: cosine similarity for near-duplicate hits,
+  e.g. 0.95 (default 0 = exact matches only)
+- KB_VERSION_PATH: stamp file bumped by ingestion (default .kb_version)
+"""
+import math
+import operator
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "1") == "1"
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", "3600"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "512"))
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0"))
+KB_VERSION_PATH = os.getenv("KB_VERSION_PATH", ".kb_version")
+
+_WS_RE = re.compile(r"\s+")
+
+
+def normalize_query(query: str) -> str:
+    """Lowercase, collapse whitespace and drop trailing punctuation."""
+    return _WS_RE.sub(" ", query.strip().lower()).rstrip("?!. ")
+
+
+# --- KB version ---
+def get_kb_version() -> float:
+    try:
+        return os.stat(KB_VERSION_PATH).st_mtime
+    except FileNotFoundError:
+        return 0.0
+
+
+def bump_kb_version():
+    """Called after ingestion changes `docs`; invalidates cached answers."""
+    with open(KB_VERSION_PATH, "a"):
+        pass
+    now = time.time()
+    # Guarantee a new mtime even on filesystems with coarse timestamps
+    os.utime(KB_VERSION_PATH, (now, max(now, get_kb_version() + 1e-3)))
+    answer_cache.clear()
+
+
+def _unit(vec):
+    norm = math.sqrt(sum(v * v for v in vec))
+    return [v / norm for v in vec] if norm else list(vec)
+
+
+class AnswerCache:
+    """Thread-safe TTL + LRU cache of {"reply", "source"} dicts."""
+
+    def __init__(self, max_entries: int = ANSWER_CACHE_MAX_ENTRIES, ttl: float = ANSWER_CACHE_TTL_SECONDS,
+                 similarity: float = ANSWER_CACHE_SIMILARITY):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity = similarity
+        self._entries = OrderedDict()  # key -> (expires_at, result, unit embedding or None)
+        self._lock = threading.Lock()
+        self._kb_version = get_kb_version()
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    def _check_version(self):
+        version = get_kb_version()
+        if version != self._kb_version:
+            self._entries.clear()
+            self._kb_version = version
+
+    def _embed(self, query: str):
+        from app.embeddings import embed_text, QUERY_TASK
+        # Same task type as retrieval, so the embedding cache serves retrieve() too
+        return _unit(embed_text(query, task_type=QUERY_TASK))
+
+    def get(self, query: str, enable_llm: bool, scope: str = None) -> Optional[dict]:
+        key = (normalize_query(query), bool(enable_llm), scope)
+        now = time.time()
+        with self._lock:
+            self._check_version()
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return dict(entry[1])
+                del self._entries[key]
+            if self.similarity <= 0:
+                self.misses += 1
+                return None
+            candidates = [(k, e) for k, e in self._entries.items() if k[1:] == key[1:] and e[2] is not None]
+
+        # Embed outside the lock; this may hit the network on a cold embedding cache
+        query_vec = self._embed(query) if candidates else None
+        best_key, best_result, best_sim = None, None, self.similarity
+        for k, (expires_at, result, vec) in candidates:
+            if expires_at <= now:
+                continue
+            sim = sum(map(operator.mul, query_vec, vec))
+            if sim >= best_sim:
+                best_key, best_result, best_sim = k, result, sim
+
+        with self._lock:
+            if best_key is not None and best_key in self._entries:
+                self._entries.move_to_end(best_key)
+                self.hits += 1
+                self.semantic_hits += 1
+                return dict(best_result)
+            self.misses += 1
+        return None
+
+    def put(self, query: str, enable_llm: bool, result: dict, scope: str = None):
+        key = (normalize_query(query), bool(enable_llm), scope)
+        vec = self._embed(query) if self.similarity > 0 else None
+        value = {"reply": result["reply"], "source": result["source"]}
+        with self._lock:
+            self._check_version()
+            self._entries[key] = (time.time() + self.ttl, value, vec)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._kb_version = get_kb_version()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+            }
+
+
+answer_cache = AnswerCache()
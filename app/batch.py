@@ -0,0 +1,160 @@
+# batch.py
+"""
+Bulk question answering (POST /chat/batch and this module's CLI), e.g. for
+regression runs over thousands of questions.
+
+Questions are processed in blocks of BATCH_SEARCH_SIZE: each block is embedded
+in batched provider calls and searched in one multi-query SQL round-trip (or
+one NumPy matrix top-k), then routed like /chat. Answers are generated on a
+pool of BATCH_CONCURRENCY workers (Gemini calls still go through the shared
+LLMClient limits) while the next block is retrieved, and results are yielded
+as they complete, followed by a summary.
+
+Batch questions are answered independently: no conversation history, no
+answer cache (so evaluation runs see fresh answers) and no /routes/stats
+samples. With persist=True every question and answer is saved to one session.
+
+Environment variables:
+- BATCH_CONCURRENCY: default answer workers per batch (default 8)
+- BATCH_MAX_QUESTIONS: largest batch accepted by /chat/batch (default 10000)
+
+Usage:
+    python -m app.batch questions.txt --enable-llm --concurrency 8 --no-persist --output answers.ndjson
+    python -m app.batch regression.jsonl --collection billing     # {"question": ...} per line
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+from app.graph_logic import (
+    apply_retrieval, evaluate_node, extractive_node, initial_state, kb_only_node, llm_augmented_node, save_message,
+)
+from app.retrieve import retrieve_many, BATCH_SEARCH_SIZE
+
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+BATCH_MAX_QUESTIONS = int(os.getenv("BATCH_MAX_QUESTIONS", "10000"))
+
+NODES = {"extractive": extractive_node, "kb_only": kb_only_node, "llm_augmented": llm_augmented_node}
+
+
+def answer(index: int, state) -> dict:
+    start = time.perf_counter()
+    result = {"index": index, "question": state["query"]}
+    try:
+        state = NODES[evaluate_node(state)](state)
+        result.update(reply=state["reply"], source=state["source"], route=state["route"])
+    except Exception as e:
+        result.update(reply=None, source=None, route="error", error=str(e))
+    result["best_distance"] = state.get("best_distance")
+    result["latency_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    return result
+
+
+def run_batch(questions, enable_llm: bool = False, session_id: str = None, persist: bool = True,
+              collections=None, filters=None, concurrency: int = BATCH_CONCURRENCY, top_k: int = 3):
+    """
+    Yield one result dict per question in completion order
+    ({"index", "question", "reply", "source", "route", "best_distance", "latency_ms"}),
+    then {"summary": {...}}
+    """
+    start = time.perf_counter()
+    session_id = session_id or str(uuid.uuid4())
+    routes = Counter()
+    # Keep retrieval at most a couple of blocks ahead of generation
+    max_pending = max(concurrency, BATCH_SEARCH_SIZE) * 2
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="batch") as pool:
+        pending = set()
+
+        def completed(block: bool):
+            nonlocal pending
+            if not pending:
+                return
+            done, pending = wait(pending, timeout=None if block else 0, return_when=FIRST_COMPLETED)
+            for future in done:
+                result = future.result()
+                routes[result["route"]] += 1
+                yield result
+
+        for offset in range(0, len(questions), BATCH_SEARCH_SIZE):
+            block = questions[offset:offset + BATCH_SEARCH_SIZE]
+            try:
+                docs_per_question = retrieve_many(block, top_k, collections, filters)
+            except Exception as e:
+                # One failed search round-trip fails its block, not the whole run
+                for i, question in enumerate(block, start=offset):
+                    routes["error"] += 1
+                    yield {"index": i, "question": question, "reply": None, "source": None, "route": "error",
+                           "error": str(e)}
+                continue
+            for i, (question, docs) in enumerate(zip(block, docs_per_question), start=offset):
+                if persist:
+                    save_message(session_id, "user", question)
+                state = initial_state(session_id, question, enable_llm, collections, filters, persist)
+                pending.add(pool.submit(answer, i, apply_retrieval(state, docs)))
+            yield from completed(block=False)
+            while len(pending) > max_pending:
+                yield from completed(block=True)
+        while pending:
+            yield from completed(block=True)
+
+    elapsed = time.perf_counter() - start
+    yield {"summary": {
+        "session_id": session_id if persist else None,
+        "questions": len(questions),
+        "routes": dict(routes),
+        "seconds": round(elapsed, 3),
+        "questions_per_sec": round(len(questions) / elapsed, 2) if elapsed else None,
+    }}
+
+
+def read_questions(path: str):
+    """One question per line, or JSON lines with a "question" field"""
+    questions = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            questions.append(json.loads(line)["question"] if line.startswith("{") else line)
+    return questions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Answer a file of questions in bulk (NDJSON output)")
+    parser.add_argument("path", help="text file (one question per line) or JSONL with a question field")
+    parser.add_argument("--enable-llm", action="store_true")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY)
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--collection", action="append", dest="collections", help="repeatable")
+    parser.add_argument("--filters", type=json.loads, help='metadata filters as JSON, e.g. \'{"lang": "en"}\'')
+    parser.add_argument("--no-persist", dest="persist", action="store_false", help="don't save to messages")
+    parser.add_argument("--session-id")
+    parser.add_argument("--output", help="write NDJSON here instead of stdout")
+    args = parser.parse_args()
+
+    questions = read_questions(args.path)
+    out = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    try:
+        for result in run_batch(questions, args.enable_llm, args.session_id, args.persist, args.collections,
+                                args.filters, args.concurrency, args.top_k):
+            if "summary" in result:
+                print(json.dumps(result["summary"]), file=sys.stderr)
+            else:
+                out.write(json.dumps(result) + "\n")
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    if args.persist:
+        from app.persistence import message_writer
+        message_writer.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+# context.py
+"""
+Token-budgeted context assembly for the prompts built in graph_logic.
+
+Retrieved docs are split into sentences, near-duplicate sentences (e.g. the
+overlap ingestion carries between neighbouring chunks) are dropped, and when
+everything does not fit in CONTEXT_TOKEN_BUDGET the sentences sharing the
+most terms with the query are kept, in their original order under each
+doc's title. Prompt size, and with it LLM latency, is then bounded by the
+budget rather than by document length. Tokens are whitespace words, as in
+the ingestion chunker.
+
+Environment variables:
+- CONTEXT_TOKEN_BUDGET: max tokens of retrieved context per prompt (default 600)
+- CONTEXT_DEDUP_THRESHOLD: word-set Jaccard above which a sentence counts as
+  a duplicate (default 0.8)
+"""
+import os
+import re
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "600"))
+CONTEXT_DEDUP_THRESHOLD = float(os.getenv("CONTEXT_DEDUP_THRESHOLD", "0.8"))
+
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+|\n+")
+_WORD_RE = re.compile(r"\w+")
+_STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "does", "for", "from", "how",
+    "i", "in", "is", "it", "of", "on", "or", "that", "the", "this", "to", "was", "what", "when",
+    "where", "which", "who", "why", "with", "you", "your",
+}
+
+
+def count_tokens(text: str) -> int:
+    return len(text.split())
+
+
+def _words(text: str) -> set:
+    # Crude plural folding so "refunds" matches "refund"
+    return {w[:-1] if len(w) > 3 and w.endswith("s") else w for w in _WORD_RE.findall(text.lower())}
+
+
+def _terms(text: str) -> set:
+    return _words(text) - _STOPWORDS
+
+
+def split_sentences(text: str):
+    return [s.strip() for s in _SENTENCE_RE.split(text) if s.strip()]
+
+
+def _is_duplicate(words: set, seen) -> bool:
+    for other in seen:
+        union = len(words | other)
+        if union and len(words & other) / union >= CONTEXT_DEDUP_THRESHOLD:
+            return True
+    return False
+
+
+def _candidates(docs):
+    """(doc_index, position, sentence, words) with near-duplicates removed across all docs"""
+    seen = []
+    candidates = []
+    for d, doc in enumerate(docs):
+        for p, sentence in enumerate(split_sentences(doc["content"])):
+            words = _words(sentence)
+            if not words or _is_duplicate(words, seen):
+                continue
+            seen.append(words)
+            candidates.append((d, p, sentence, words))
+    return candidates
+
+
+def assemble_context(docs, query: str, budget: int = CONTEXT_TOKEN_BUDGET):
+    """
+    Returns (context, token_count). Docs are assumed best-first; with a
+    budget <= 0 the full deduplicated text is used.
+    """
+    candidates = _candidates(docs)
+    total = sum(count_tokens(c[2]) for c in candidates)
+
+    if budget > 0 and total > budget:
+        query_terms = _terms(query)
+
+        def score(c):
+            d, p, sentence, words = c
+            overlap = len(query_terms & words)
+            # Ties go to higher-ranked docs, then earlier sentences
+            return (overlap / (1 + d), -d, -p)
+
+        chosen, used = [], 0
+        for c in sorted(candidates, key=score, reverse=True):
+            tokens = count_tokens(c[2])
+            if used + tokens > budget:
+                continue
+            chosen.append(c)
+            used += tokens
+        candidates = sorted(chosen, key=lambda c: (c[0], c[1]))
+
+    sections = []
+    for d, doc in enumerate(docs):
+        sentences = [c[2] for c in candidates if c[0] == d]
+        if sentences:
+            sections.append(f"Title: {doc['title']}\n" + "\n".join(sentences))
+    context = "\n\n---\n\n".join(sections)
+    return context, count_tokens(context)
+
+
+def extract_answer(doc, query: str, max_sentences: int = 3):
+    """
+    Best window of up to `max_sentences` consecutive sentences of `doc` for
+    the query (most distinct query terms, then shortest), or None when no
+    sentence shares a term with the query.
+    """
+    sentences = split_sentences(doc["content"])
+    words = [_words(s) for s in sentences]
+    query_terms = _terms(query)
+    best, best_key = None, None
+    for start in range(len(sentences)):
+        covered = set()
+        for end in range(start, min(start + max_sentences, len(sentences))):
+            covered |= query_terms & words[end]
+            key = (len(covered), -(end - start))
+            if covered and (best_key is None or key > best_key):
+                best, best_key = (start, end), key
+    if best is None:
+        return None
+    return " ".join(sentences[best[0]:best[1] + 1])
@@ -1,9 +1,19 @@
 """
 Simple database configuration for FastAPI + SQLAlchemy.
+
+One pooled engine serves the ORM sessions (REST routes, save_message) and the
+raw psycopg2 connections used by retrieval and ingestion (`get_conn`).
+
+Environment variables:
+- DB_POOL_SIZE: persistent connections kept in the pool (default 5)
+- DB_MAX_OVERFLOW: extra connections allowed under burst (default 10)
+- DB_POOL_TIMEOUT: seconds to wait for a free connection (default 30)
+- DB_POOL_RECYCLE: seconds before a connection is replaced (default 1800)
+- DB_STATEMENT_TIMEOUT_MS: server-side statement timeout (default 30000, 0 disables)
 """
 
 import os
-from contextlib import contextmanager
+from contextlib import contextmanager, asynccontextmanager
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
 from dotenv import load_dotenv
@@ -15,8 +25,32 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
     raise ValueError("DATABASE_URL not found in .env file")
 
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "30000"))
+
+POOL_OPTIONS = dict(
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_recycle=DB_POOL_RECYCLE,
+    pool_pre_ping=True,
+)
+
+# Server-side statement timeout (Postgres only; sqlite:/// is used as an offline stand-in by benchmarks)
+CONNECT_ARGS = (
+    {"options": f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"} if DATABASE_URL.startswith("postgres") else {}
+)
+
 # Create the database engine
-engine = create_engine(DATABASE_URL, echo=False)
+engine = create_engine(
+    DATABASE_URL,
+    echo=False,
+    connect_args=CONNECT_ARGS,
+    **POOL_OPTIONS,
+)
 
 # Create a SessionLocal class for DB sessions
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
@@ -41,6 +75,32 @@ def get_db():
         db.close()
 
 
+def get_conn():
+    """
+    Borrow a raw psycopg2 connection from the engine pool.
+    close() returns it to the pool instead of tearing down the TCP connection.
+    """
+    return engine.raw_connection()
+
+
+def pool_stats() -> dict:
+    """Pool utilisation for the sync engine (and the async engine once created)."""
+    stats = {"sync": _pool_stats(engine.pool)}
+    if _async_engine is not None:
+        stats["async"] = _pool_stats(_async_engine.pool)
+    return stats
+
+
+def _pool_stats(pool) -> dict:
+    return {
+        "size": pool.size(),
+        "checked_in": pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        "overflow": pool.overflow(),
+        "max_overflow": DB_MAX_OVERFLOW,
+    }
+
+
 @contextmanager
 def get_db_context():
     """
@@ -54,3 +114,53 @@ def get_db_context():
         raise
     finally:
         db.close()
+
+
+# ---------- Async engine (CHAT_ASYNC mode) ----------
+# Created lazily so the sync code path does not require asyncpg.
+_async_engine = None
+_AsyncSessionLocal = None
+
+
+def get_async_database_url(url: str = DATABASE_URL) -> str:
+    """postgresql://... -> postgresql+asyncpg://..."""
+    scheme, sep, rest = url.partition("://")
+    return f"postgresql+asyncpg{sep}{rest}" if scheme in ("postgres", "postgresql", "postgresql+psycopg2") else url
+
+
+def get_async_engine():
+    global _async_engine, _AsyncSessionLocal
+    if _async_engine is None:
+        from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+        _async_engine = create_async_engine(
+            get_async_database_url(),
+            echo=False,
+            connect_args={"server_settings": {"statement_timeout": str(DB_STATEMENT_TIMEOUT_MS)}},
+            **POOL_OPTIONS,
+        )
+        _AsyncSessionLocal = async_sessionmaker(bind=_async_engine, autoflush=False, expire_on_commit=False)
+    return _async_engine
+
+
+@asynccontextmanager
+async def get_async_db_context():
+    """
+    Async context manager for database sessions.
+    """
+    get_async_engine()
+    db = _AsyncSessionLocal()
+    try:
+        yield db
+    except Exception as e:
+        await db.rollback()
+        raise
+    finally:
+        await db.close()
+
+
+async def dispose_engines():
+    """Close the pooled connections of both engines (on shutdown)"""
+    engine.dispose()
+    if _async_engine is not None:
+        await _async_engine.dispose()
@@ -0,0 +1,276 @@
+# embeddings.py
+"""
+Embedding providers shared by retrieval and ingestion.
+
+Every embedding goes through `embed_text` / `embed_texts`, which consult a
+content-hash keyed SQLite cache before calling the configured provider, so
+repeated queries and re-ingestion of unchanged documents never re-embed.
+
+Environment variables:
+- EMBEDDING_PROVIDER: "gemini" (default) or "hashing" (offline, deterministic)
+- EMBEDDING_DIM: vector size, must match docs.embedding (default 768)
+- EMBEDDING_CACHE_PATH: SQLite file for the cache (default .embedding_cache.sqlite3,
+  set to an empty string to disable caching)
+- EMBEDDING_CACHE_MAX_ENTRIES: LRU capacity of the cache (default 50000)
+"""
+import hashlib
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from array import array
+from typing import List, Optional, Sequence
+
+from dotenv import load_dotenv
+
+from app.singleflight import SingleFlight
+
+load_dotenv()
+
+EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", "gemini").lower()
+EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM", "768"))
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", ".embedding_cache.sqlite3")
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "50000"))
+
+# task_type values understood by Gemini
+QUERY_TASK = "retrieval_query"
+DOCUMENT_TASK = "retrieval_document"
+
+
+# --- Providers ---
+class EmbeddingProvider:
+    """Base class: turns texts into fixed-size float vectors."""
+
+    name = "base"
+    dim = EMBEDDING_DIM
+
+    def embed(self, texts: Sequence[str], task_type: str) -> List[List[float]]:
+        raise NotImplementedError
+
+
+class GeminiEmbeddingProvider(EmbeddingProvider):
+    """Google text-embedding-004 (768 dims)."""
+
+    name = "gemini"
+
+    def __init__(self, model: str = "models/text-embedding-004"):
+        import google.generativeai as genai
+
+        api_key = os.getenv("GOOGLE_GENERATIVE_AI_API_KEY") or os.getenv("GOOGLE_API_KEY")
+        if not api_key:
+            raise RuntimeError("GOOGLE_GENERATIVE_AI_API_KEY or GOOGLE_API_KEY not set in .env")
+        genai.configure(api_key=api_key)
+        self._genai = genai
+        self.model = model
+        self.name = f"gemini:{model}"
+
+    def embed(self, texts, task_type):
+        texts = list(texts)
+        if len(texts) == 1:
+            result = self._genai.embed_content(model=self.model, content=texts[0], task_type=task_type)
+            return [result["embedding"]]
+        # embed_content accepts a list and returns one embedding per item
+        result = self._genai.embed_content(model=self.model, content=texts, task_type=task_type)
+        return list(result["embedding"])
+
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+class HashingEmbeddingProvider(EmbeddingProvider):
+    """
+    Deterministic hashing-vectorizer stand-in for offline runs and tests.
+    Unigrams and bigrams are hashed into `dim` signed buckets and L2-normalised,
+    so texts sharing words land close together without any network call.
+    """
+
+    name = "hashing"
+
+    def __init__(self, dim: int = EMBEDDING_DIM):
+        self.dim = dim
+        self.name = f"hashing:{dim}"
+
+    def _embed_one(self, text: str) -> List[float]:
+        vec = [0.0] * self.dim
+        tokens = _TOKEN_RE.findall(text.lower())
+        features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+        for feature in features:
+            digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], "little") % self.dim
+            sign = 1.0 if digest[4] & 1 else -1.0
+            vec[bucket] += sign
+        norm = math.sqrt(sum(v * v for v in vec))
+        if norm:
+            vec = [v / norm for v in vec]
+        return vec
+
+    def embed(self, texts, task_type):
+        return [self._embed_one(t) for t in texts]
+
+
+# --- Cache ---
+class EmbeddingCache:
+    """
+    Persistent embedding cache keyed by sha256(provider, task_type, text).
+    Vectors are stored as float32 blobs; the least recently used rows are
+    evicted once the table grows past `max_entries`.
+    """
+
+    def __init__(self, path: str, max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(provider_name: str, task_type: str, text: str) -> str:
+        h = hashlib.sha256()
+        for part in (provider_name, task_type, text):
+            h.update(part.encode("utf-8"))
+            h.update(b"\x00")
+        return h.hexdigest()
+
+    def get_many(self, keys: Sequence[str]) -> dict:
+        if not keys:
+            return {}
+        found = {}
+        with self._lock:
+            # SQLite limits bound parameters, so look keys up in slices
+            for i in range(0, len(keys), 500):
+                chunk = list(keys[i:i + 500])
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", chunk
+                ).fetchall()
+                for key, blob in rows:
+                    vec = array("f")
+                    vec.frombytes(blob)
+                    found[key] = vec.tolist()
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                    [(now, k) for k in found],
+                )
+                self._conn.commit()
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, items: dict):
+        if not items:
+            return
+        now = time.time()
+        rows = [(k, array("f", v).tobytes(), now) for k, v in items.items()]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)", rows
+            )
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+            overflow = count - self.max_entries
+            if overflow > 0:
+                self._conn.execute(
+                    """DELETE FROM embeddings WHERE key IN (
+                        SELECT key FROM embeddings ORDER BY last_used ASC LIMIT ?
+                    )""",
+                    (overflow,),
+                )
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        return {"entries": count, "max_entries": self.max_entries, "hits": self.hits, "misses": self.misses}
+
+
+# --- Module-level accessors ---
+_provider: Optional[EmbeddingProvider] = None
+_cache: Optional[EmbeddingCache] = None
+_cache_disabled = not EMBEDDING_CACHE_PATH
+_init_lock = threading.Lock()
+_UNSET = object()
+
+
+def get_provider() -> EmbeddingProvider:
+    global _provider
+    if _provider is None:
+        with _init_lock:
+            if _provider is None:
+                if EMBEDDING_PROVIDER == "hashing":
+                    _provider = HashingEmbeddingProvider()
+                elif EMBEDDING_PROVIDER == "gemini":
+                    _provider = GeminiEmbeddingProvider()
+                else:
+                    raise ValueError(f"Unknown EMBEDDING_PROVIDER: {EMBEDDING_PROVIDER}")
+    return _provider
+
+
+def get_cache() -> Optional[EmbeddingCache]:
+    global _cache
+    if _cache is None and not _cache_disabled:
+        with _init_lock:
+            if _cache is None and not _cache_disabled:
+                _cache = EmbeddingCache(EMBEDDING_CACHE_PATH)
+    return _cache
+
+
+def set_provider(provider: EmbeddingProvider, cache=_UNSET):
+    """
+    Swap the provider, e.g. for offline runs. `cache` left out keeps the current
+    cache (keys include the provider name); an EmbeddingCache replaces it; None
+    disables caching until set_provider is called with a cache again.
+    """
+    global _provider, _cache, _cache_disabled
+    with _init_lock:
+        _provider = provider
+        if cache is not _UNSET:
+            _cache = cache
+            _cache_disabled = cache is None
+
+
+def embed_texts(texts: Sequence[str], task_type: str = DOCUMENT_TASK) -> List[List[float]]:
+    """Embed many texts, calling the provider only for cache misses."""
+    texts = list(texts)
+    provider = get_provider()
+    cache = get_cache()
+    if cache is None:
+        return provider.embed(texts, task_type)
+
+    keys = [EmbeddingCache.make_key(provider.name, task_type, t) for t in texts]
+    cached = cache.get_many(keys)
+
+    # Embed each distinct missing text once
+    missing = {}
+    for key, text in zip(keys, texts):
+        if key not in cached and key not in missing:
+            missing[key] = text
+    if missing:
+        vectors = provider.embed(list(missing.values()), task_type)
+        # Round-trip through float32 so hits and misses return identical vectors
+        fresh = {k: array("f", v).tolist() for k, v in zip(missing.keys(), vectors)}
+        cache.put_many(fresh)
+        cached.update(fresh)
+    return [cached[k] for k in keys]
+
+
+_embedding_flight = SingleFlight("embedding")
+
+
+def embed_text(text: str, task_type: str = QUERY_TASK) -> List[float]:
+    # Concurrent identical queries share one cache lookup / provider call
+    key = (get_provider().name, task_type, text)
+    return _embedding_flight.do(key, lambda: embed_texts([text], task_type)[0])
@@ -1,94 +1,226 @@
 # graph_logic.py
-from langgraph.graph import StateGraph, END, START
 from typing import TypedDict, Optional
-from app.retrieve import retrieve
-from app.db import get_db_context
-from app.models import Session, Message
-import google.generativeai as genai
+from app.retrieve import retrieve, aretrieve, retrieval_scope, RETRIEVAL_MODE
+from app.answer_cache import answer_cache, ANSWER_CACHE_ENABLED
+from app.vector_index import DISTANCE_THRESHOLD
+from app.persistence import message_writer, awrite_messages
+from app.memory import conversation_memory, MEMORY_ENABLED
+from app.context import assemble_context, count_tokens, extract_answer
+from app.metrics import route_metrics, timed, observe_stage, instrument, request_context, request_id_var
+from app.llm_client import LLMClient
+import asyncio
 import os
-from datetime import datetime
-from app.db import get_conn
+import threading
+import time
 
 
-# Load your Gemini API key from env
-GOOGLE_GEN_AI_API_KEY = os.getenv("GOOGLE_GENERATIVE_AI_API_KEY") or os.getenv("GOOGLE_API_KEY")
-if not GOOGLE_GEN_AI_API_KEY:
-    raise ValueError("Missing GOOGLE_GENERATIVE_AI_API_KEY or GOOGLE_API_KEY in environment variables.")
+# Gemini Flash for speed (you can also use gemini-1.5-pro for more reasoning)
+GEMINI_MODEL = "gemini-2.5-flash"
+# GEMINI_API_ENDPOINT points the REST transport elsewhere, e.g. at benchmarks/fake_llm_server.py
+GEMINI_API_ENDPOINT = os.getenv("GEMINI_API_ENDPOINT")
 
-# Configure the Gemini client
-genai.configure(api_key=GOOGLE_GEN_AI_API_KEY)
 
-# Use Gemini Flash for speed (you can also use gemini-1.5-pro for more reasoning)
-MODEL = genai.GenerativeModel("gemini-2.5-flash")
+def create_model():
+    """Configure the Gemini SDK and build the model; called once, on first use or at startup"""
+    # Deferred: the SDK takes a noticeable share of import time (see benchmarks/bench_import_time.py)
+    import google.generativeai as genai
+
+    api_key = os.getenv("GOOGLE_GENERATIVE_AI_API_KEY") or os.getenv("GOOGLE_API_KEY")
+    if not api_key:
+        raise ValueError("Missing GOOGLE_GENERATIVE_AI_API_KEY or GOOGLE_API_KEY in environment variables.")
+    if GEMINI_API_ENDPOINT:
+        genai.configure(api_key=api_key, transport="rest", client_options={"api_endpoint": GEMINI_API_ENDPOINT})
+    else:
+        genai.configure(api_key=api_key)
+    return genai.GenerativeModel(GEMINI_MODEL)
+
+
+# Timeouts, retries, rate limiting, hedging and circuit breaking for every Gemini call
+llm = LLMClient(model_factory=create_model)
 
 # --- Define chat state ---
 class ChatState(TypedDict):
+    request_id: str
     session_id: str
     query: str
+    history: str
+    retrieval_query: str
+    collections: Optional[list]
+    filters: Optional[dict]
     context: str
+    context_tokens: int
+    prompt_tokens: int
+    docs: list
     best_distance: Optional[float]
+    distance_gap: Optional[float]
+    lexical_match: bool
     reply: str
     source: str
+    route: str
     enable_llm: bool
+    persist: bool
 
 
 # --- Save chat messages in DB ---
 def save_message(session_id, role, content, source=None):
-    """Save message using SQLAlchemy, ensuring session exists"""
-    with get_db_context() as db:
-        try:
-            # Get or create session
-            session = db.query(Session).filter(Session.id == session_id).first()
-            
-            if not session:
-                # Create new session
-                session = Session(id=session_id)
-                db.add(session)
-            else:
-                # Update lastActive
-                session.lastActive = datetime.utcnow()
-            
-            # Create message
-            message = Message(
-                session_id=session_id,
-                role=role,
-                content=content,
-                source=source
-            )
-            db.add(message)
-            db.commit()
-            
-            print(f"✓ Saved {role} message for session {session_id[:8]}...")
-            return str(message.id)
-        except Exception as e:
-            db.rollback()
-            print(f"Error saving message: {str(e)}")
-            raise e
+    """Save message through the write-behind writer (PERSIST_MODE=sync writes immediately)"""
+    with timed("persistence"):
+        message_id = message_writer.save(session_id, role, content, source)
+    if MEMORY_ENABLED:
+        conversation_memory.append(session_id, role, content)
+    if message_writer.mode == "sync":
+        print(f"✓ Saved {role} message for session {session_id[:8]}...")
+    return message_id
+
+
+async def asave_message(session_id, role, content, source=None):
+    """Async save_message: enqueue, or in sync mode write over the async engine"""
+    if message_writer.mode == "sync":
+        record = message_writer.make_record(session_id, role, content, source)
+        with timed("persistence"):
+            await awrite_messages([record])
+        if MEMORY_ENABLED:
+            conversation_memory.append(session_id, role, content)
+        print(f"✓ Saved {role} message for session {session_id[:8]}...")
+        return record["id"]
+    return save_message(session_id, role, content, source)
+
+
+def save_reply(state: ChatState, reply: str):
+    """Persist the assistant reply unless the request opted out (batch evaluation runs)"""
+    if state.get("persist", True):
+        save_message(state["session_id"], "assistant", reply, source=state["source"])
+
+
+async def asave_reply(state: ChatState, reply: str):
+    if state.get("persist", True):
+        await asave_message(state["session_id"], "assistant", reply, source=state["source"])
+
+
+# --- Prompt helpers (shared by the sync and async nodes) ---
+def history_section(history: str) -> str:
+    return f"CONVERSATION HISTORY (for resolving references only):\n{history}\n\n" if history else ""
+
+
+def build_kb_prompt(context: str, query: str, history: str = "") -> str:
+    return f"""You are an assistant that must answer strictly based on the provided CONTEXT.
+        Do NOT add any information that is not explicitly stated there.
+        If the context doesn’t answer the question, reply: "I don't know based on internal docs."
+
+        {history_section(history)}CONTEXT:
+        {context}
+
+        QUESTION:
+        {query}
+        """
+
+
+def build_llm_prompt(context: str, query: str, history: str = "") -> str:
+    if context:
+        return f"""You are a helpful assistant for internal teams.
+Use the CONTEXT below to answer the QUESTION accurately and naturally.
+If the context does not contain enough information, say:
+"I don't know based on internal docs." Then, provide a short helpful general answer.
+
+{history_section(history)}CONTEXT:
+{context}
+
+QUESTION:
+{query}
+"""
+    # No KB context found — pure general LLM mode
+    return f"""You are a helpful assistant.
+Answer the following question conversationally:
+
+{history_section(history)}QUESTION:
+{query}
+"""
+
+
+def extract_text(response) -> Optional[str]:
+    """Pull the reply text out of a Gemini response, or None if the format is unexpected"""
+    if hasattr(response, "text") and response.text:
+        return response.text.strip()
+    if hasattr(response, "candidates") and response.candidates:
+        return response.candidates[0].content.parts[0].text.strip()
+    return None
+
+
+# Hybrid retrieval: a full-text hit on every query term (exact names, codes, SKUs) is trusted like a close vector match
+HYBRID_TRUST_LEXICAL = os.getenv("HYBRID_TRUST_LEXICAL", "1") == "1"
+
+# Extractive fast path: a clear, close top hit is answered with its best passage and no LLM call
+EXTRACTIVE_ENABLED = os.getenv("EXTRACTIVE_ENABLED", "1") == "1"
+EXTRACTIVE_DISTANCE = float(os.getenv("EXTRACTIVE_DISTANCE", str(DISTANCE_THRESHOLD - 0.15)))
+# Required distance gap between the top two hits; a small gap means the answer may span several docs
+EXTRACTIVE_MIN_GAP = float(os.getenv("EXTRACTIVE_MIN_GAP", "0.05"))
+EXTRACTIVE_MAX_SENTENCES = int(os.getenv("EXTRACTIVE_MAX_SENTENCES", "3"))
+
+
+def apply_retrieval(state: ChatState, docs):
+    # Budgeted, deduplicated and focused on the (standalone) query
+    state["context"], state["context_tokens"] = assemble_context(docs, state.get("retrieval_query") or state["query"])
+    distances = sorted(d["distance"] for d in docs)
+    state["docs"] = docs
+    state["best_distance"] = distances[0] if distances else None
+    state["distance_gap"] = distances[1] - distances[0] if len(distances) > 1 else None
+    state["lexical_match"] = any(d.get("all_terms") for d in docs)
+    return state
 
 
 # --- Graph nodes ---
+def history_node(state: ChatState):
+    """Bounded recent turns + rolling summary, and a standalone query for retrieval"""
+    if not MEMORY_ENABLED or state.get("retrieval_query"):
+        # Disabled, or already loaded by the handler for the answer-cache check
+        return state
+    summary, turns = conversation_memory.history(state["session_id"], state["query"])
+    state["history"] = conversation_memory.format_history(summary, turns)
+    state["retrieval_query"] = conversation_memory.condense(state["query"], turns)
+    return state
+
+
+def is_follow_up(state: ChatState) -> bool:
+    """Follow-ups depend on earlier turns, so their answers must not be cached"""
+    return bool(state.get("retrieval_query")) and state["retrieval_query"] != state["query"]
+
+
 def retrieve_node(state: ChatState):
-    docs = retrieve(state["query"], top_k=3)
-    context = "\n\n---\n\n".join(
-        [f"Title: {d['title']}\n{d['content']}" for d in docs]
+    docs = retrieve(state.get("retrieval_query") or state["query"], top_k=3,
+                    collections=state.get("collections"), filters=state.get("filters"))
+    return apply_retrieval(state, docs)
+
+
+def is_extractive(state: ChatState) -> bool:
+    best, gap = state.get("best_distance"), state.get("distance_gap")
+    return (
+        EXTRACTIVE_ENABLED
+        and best is not None
+        and best < EXTRACTIVE_DISTANCE
+        and (gap is None or gap >= EXTRACTIVE_MIN_GAP)
     )
-    state["context"] = context
-    state["best_distance"] = min([d["distance"] for d in docs]) if docs else None
-    return state
 
 
 def evaluate_node(state: ChatState) -> str:
     """Routing function - returns string, not dict!"""
+    # A single confident match needs no LLM at all
+    if is_extractive(state):
+        return "extractive"
+
     # If toggle is OFF, always use KB only
     if not state.get("enable_llm", False):
         return "kb_only"
-    
+
     # If toggle is ON, use automatic routing based on distance
     # Decide if we trust the KB or need LLM help
-    if state["best_distance"] is not None and state["best_distance"] < 0.35:
-        return "kb_only"
-    else:
-        return "llm_augmented"
+    return "kb_only" if kb_match_trusted(state) else "llm_augmented"
+
+
+def kb_match_trusted(state: ChatState) -> bool:
+    """The KB match is close enough (or lexically exact in hybrid mode) to answer without the LLM"""
+    if state["best_distance"] is not None and state["best_distance"] < DISTANCE_THRESHOLD:
+        return True
+    return RETRIEVAL_MODE == "hybrid" and HYBRID_TRUST_LEXICAL and bool(state.get("lexical_match"))
 
 
 # def kb_only_node(state: ChatState):
@@ -101,116 +233,385 @@ def evaluate_node(state: ChatState) -> str:
 #     save_message(state["session_id"], "assistant", reply, source=state["source"])
 #     return state
 
+def llm_failure(state: ChatState, error: Exception, message: str):
+    """
+    (reply, is_fallback) after Gemini failed: an extractive KB answer if the
+    match is one evaluate_node would trust, else the error. A poor match is
+    why llm_augmented asked the LLM; quoting it as a KB answer would mislead.
+    """
+    fallback = extractive_answer(state) if state.get("docs") and kb_match_trusted(state) else None
+    if fallback is None:
+        return f"{message}: {str(error)}", False
+    print(f"Gemini unavailable ({type(error).__name__}), answering extractively")
+    return fallback, True
+
+
 def kb_only_node(state: ChatState):
     """Respond strictly using the retrieved KB context."""
+    route = "kb_only"
     if not state["context"]:
         reply = "I couldn't find an answer in internal docs."
     else:
         # Instead of dumping all context, generate a concise response *only from KB text*
-        prompt = f"""You are an assistant that must answer strictly based on the provided CONTEXT.
-        Do NOT add any information that is not explicitly stated there.
-        If the context doesn’t answer the question, reply: "I don't know based on internal docs."
-
-        CONTEXT:
-        {state['context']}
-
-        QUESTION:
-        {state['query']}
-        """
+        prompt = build_kb_prompt(state["context"], state["query"], state.get("history", ""))
+        state["prompt_tokens"] = count_tokens(prompt)
 
         try:
-            response = MODEL.generate_content(prompt)
-            if hasattr(response, "text") and response.text:
-                reply = response.text.strip()
-            elif hasattr(response, "candidates") and response.candidates:
-                reply = response.candidates[0].content.parts[0].text.strip()
-            else:
-                reply = "⚠️ Unexpected response format from Gemini."
+            with timed("generation"):
+                response = llm.generate(prompt)
+            reply = extract_text(response) or "⚠️ Unexpected response format from Gemini."
         except Exception as e:
-            reply = f"⚠️ Gemini API error during KB-only response: {str(e)}"
+            reply, degraded = llm_failure(state, e, "⚠️ Gemini API error during KB-only response")
+            if degraded:
+                route = "fallback"
 
     # Mark as KB-only
     state["reply"] = reply
     state["source"] = "KB"
-    save_message(state["session_id"], "assistant", reply, source=state["source"])
+    state["route"] = route
+    save_reply(state, reply)
     return state
 
 
 
+def extractive_answer(state: ChatState) -> Optional[str]:
+    top = min(state["docs"], key=lambda d: d["distance"])
+    return extract_answer(top, state.get("retrieval_query") or state["query"], EXTRACTIVE_MAX_SENTENCES)
+
+
+def extractive_node(state: ChatState):
+    """Answer with the best-matching passage of the top doc, without calling Gemini."""
+    reply = extractive_answer(state)
+    if reply is None:
+        # No sentence shares a term with the question; let Gemini read the context instead
+        return kb_only_node(state)
+    state["reply"] = reply
+    state["source"] = "KB"
+    state["route"] = "extractive"
+    save_reply(state, reply)
+    return state
+
+
 def llm_augmented_node(state: ChatState):
     """Generate an answer using KB + LLM fallback."""
     context = state.get("context", "").strip()
     query = state.get("query", "").strip()
 
     # Build prompt differently depending on whether KB exists
-    if context:
-        prompt = f"""You are a helpful assistant for internal teams.
-Use the CONTEXT below to answer the QUESTION accurately and naturally.
-If the context does not contain enough information, say:
-"I don't know based on internal docs." Then, provide a short helpful general answer.
+    prompt = build_llm_prompt(context, query, state.get("history", ""))
+    state["prompt_tokens"] = count_tokens(prompt)
 
-CONTEXT:
-{context}
+    route = "llm_augmented"
+    try:
+        with timed("generation"):
+            response = llm.generate(prompt)
+        answer = extract_text(response) or "⚠️ Gemini API returned an unexpected response format."
+    except Exception as e:
+        answer, degraded = llm_failure(state, e, "⚠️ Gemini API error")
+        if degraded:
+            route = "fallback"
 
-QUESTION:
-{query}
-"""
+    # Decide the source label
+    state["reply"] = answer
+    state["source"] = "KB" if route == "fallback" else "KB+LLM" if context else "LLM"
+    state["route"] = route
+    save_reply(state, answer)
+    return state
+
+
+# --- Async graph nodes (used with ainvoke) ---
+async def ahistory_node(state: ChatState):
+    # A cold session reads its last turns from the DB; keep that off the loop
+    return await asyncio.to_thread(history_node, state)
+
+
+async def aretrieve_node(state: ChatState):
+    docs = await aretrieve(state.get("retrieval_query") or state["query"], top_k=3,
+                           collections=state.get("collections"), filters=state.get("filters"))
+    return apply_retrieval(state, docs)
+
+
+async def akb_only_node(state: ChatState):
+    """Async kb_only_node: non-blocking Gemini call and DB write."""
+    route = "kb_only"
+    if not state["context"]:
+        reply = "I couldn't find an answer in internal docs."
     else:
-        # No KB context found — pure general LLM mode
-        prompt = f"""You are a helpful assistant.
-Answer the following question conversationally:
+        prompt = build_kb_prompt(state["context"], state["query"], state.get("history", ""))
+        state["prompt_tokens"] = count_tokens(prompt)
+        try:
+            with timed("generation"):
+                response = await llm.agenerate(prompt)
+            reply = extract_text(response) or "⚠️ Unexpected response format from Gemini."
+        except Exception as e:
+            reply, degraded = llm_failure(state, e, "⚠️ Gemini API error during KB-only response")
+            if degraded:
+                route = "fallback"
+
+    state["reply"] = reply
+    state["source"] = "KB"
+    state["route"] = route
+    await asave_reply(state, reply)
+    return state
+
+
+async def aextractive_node(state: ChatState):
+    reply = extractive_answer(state)
+    if reply is None:
+        return await akb_only_node(state)
+    state["reply"] = reply
+    state["source"] = "KB"
+    state["route"] = "extractive"
+    await asave_reply(state, reply)
+    return state
 
-QUESTION:
-{query}
-"""
 
+async def allm_augmented_node(state: ChatState):
+    """Async llm_augmented_node: non-blocking Gemini call and DB write."""
+    context = state.get("context", "").strip()
+    query = state.get("query", "").strip()
+    prompt = build_llm_prompt(context, query, state.get("history", ""))
+    state["prompt_tokens"] = count_tokens(prompt)
+
+    route = "llm_augmented"
     try:
-        response = MODEL.generate_content(prompt)
-        if hasattr(response, 'text') and response.text:
-            answer = response.text.strip()
-        elif hasattr(response, 'candidates') and response.candidates:
-            answer = response.candidates[0].content.parts[0].text.strip()
-        else:
-            answer = "⚠️ Gemini API returned an unexpected response format."
+        with timed("generation"):
+            response = await llm.agenerate(prompt)
+        answer = extract_text(response) or "⚠️ Gemini API returned an unexpected response format."
     except Exception as e:
-        answer = f"⚠️ Gemini API error: {str(e)}"
+        answer, degraded = llm_failure(state, e, "⚠️ Gemini API error")
+        if degraded:
+            route = "fallback"
 
-    # Decide the source label
     state["reply"] = answer
-    state["source"] = "KB+LLM" if context else "LLM"
-    save_message(state["session_id"], "assistant", answer, source=state["source"])
+    state["source"] = "KB" if route == "fallback" else "KB+LLM" if context else "LLM"
+    state["route"] = route
+    await asave_reply(state, answer)
     return state
 
 
 # --- Build the StateGraph ---
-graph = StateGraph(ChatState)
-graph.add_node("retrieve", retrieve_node)
-graph.add_node("kb_only", kb_only_node)
-graph.add_node("llm_augmented", llm_augmented_node)
+def build_graph(history_fn, retrieve_fn, extractive_fn, kb_only_fn, llm_augmented_fn):
+    # Deferred: importing langgraph (and langchain_core) dominates module import time
+    from langgraph.graph import StateGraph, END, START
+
+    graph = StateGraph(ChatState)
+    # Every node (and the router) reports its latency as a stage
+    graph.add_node("history", instrument("history", history_fn))
+    graph.add_node("retrieve", instrument("retrieve", retrieve_fn))
+    graph.add_node("extractive", instrument("extractive", extractive_fn))
+    graph.add_node("kb_only", instrument("kb_only", kb_only_fn))
+    graph.add_node("llm_augmented", instrument("llm_augmented", llm_augmented_fn))
+
+    graph.add_edge(START, "history")
+    graph.add_edge("history", "retrieve")
+    graph.add_conditional_edges(
+        "retrieve",
+        instrument("evaluate", evaluate_node),
+        {"extractive": "extractive", "kb_only": "kb_only", "llm_augmented": "llm_augmented"}
+    )
+    graph.add_edge("extractive", END)
+    graph.add_edge("kb_only", END)
+    graph.add_edge("llm_augmented", END)
+    return graph.compile()
+
+
+# Compiled once, at startup (app.lifecycle) or on the first request
+_graphs = {}
+_graphs_lock = threading.Lock()
 
-graph.add_edge(START, "retrieve")
-graph.add_conditional_edges(
-    "retrieve", 
-    evaluate_node, 
-    {"kb_only": "kb_only", "llm_augmented": "llm_augmented"}
-)
-graph.add_edge("kb_only", END)
-graph.add_edge("llm_augmented", END)
 
-chatbot_graph = graph.compile()
+def _get_graph(name, *nodes):
+    graph = _graphs.get(name)
+    if graph is None:
+        with _graphs_lock:
+            graph = _graphs.get(name)
+            if graph is None:
+                graph = _graphs[name] = build_graph(*nodes)
+    return graph
+
+
+def get_chatbot_graph():
+    return _get_graph("sync", history_node, retrieve_node, extractive_node, kb_only_node, llm_augmented_node)
+
+
+def get_async_chatbot_graph():
+    return _get_graph("async", ahistory_node, aretrieve_node, aextractive_node, akb_only_node, allm_augmented_node)
 
 
 # --- Chat handler ---
-def handle_chat(session_id: str, message: str, enable_llm: bool = False):
-    save_message(session_id, "user", message)
-    initial_state = {
+def initial_state(session_id: str, message: str, enable_llm: bool, collections=None, filters=None,
+                  persist: bool = True) -> ChatState:
+    return {
+        "request_id": request_id_var.get() or "",
         "session_id": session_id,
         "query": message,
+        "history": "",
+        "retrieval_query": "",
+        "collections": collections or None,
+        "filters": filters or None,
         "context": "",
+        "context_tokens": 0,
+        "prompt_tokens": 0,
+        "docs": [],
         "best_distance": None,
+        "distance_gap": None,
+        "lexical_match": False,
         "enable_llm": enable_llm,
+        "persist": persist,
         "reply": "",
         "source": "",
+        "route": "",
     }
-    result = chatbot_graph.invoke(initial_state)
-    return {"reply": result["reply"], "source": result["source"]}
+
+
+def handle_chat(session_id: str, message: str, enable_llm: bool = False, request_id: str = None,
+                collections=None, filters=None):
+    """collections / filters restrict retrieval (see retrieve()); answers are cached per scope"""
+    with request_context(request_id):
+        return _handle_chat(session_id, message, enable_llm, collections, filters)
+
+
+def _handle_chat(session_id, message, enable_llm, collections, filters):
+    start = time.perf_counter()
+    save_message(session_id, "user", message)
+    state = history_node(initial_state(session_id, message, enable_llm, collections, filters))
+    cacheable = ANSWER_CACHE_ENABLED and not is_follow_up(state)
+    scope = retrieval_scope(collections, filters)
+
+    # Hot questions are served from the answer cache without retrieval or an LLM call
+    if cacheable:
+        cached = answer_cache.get(message, enable_llm, scope)
+        if cached is not None:
+            save_message(session_id, "assistant", cached["reply"], source=cached["source"])
+            route_metrics.record("cache", time.perf_counter() - start)
+            return cached
+
+    result = get_chatbot_graph().invoke(state)
+    reply = {"reply": result["reply"], "source": result["source"]}
+    route_metrics.record(result["route"], time.perf_counter() - start)
+    # Don't cache Gemini error replies or degraded fallbacks
+    if cacheable and result["route"] != "fallback" and not reply["reply"].startswith("⚠️"):
+        answer_cache.put(message, enable_llm, reply, scope)
+    return reply
+
+
+async def ahandle_chat(session_id: str, message: str, enable_llm: bool = False, request_id: str = None,
+                      collections=None, filters=None):
+    """Async handle_chat: the event loop is never blocked on DB or Gemini I/O."""
+    with request_context(request_id):
+        return await _ahandle_chat(session_id, message, enable_llm, collections, filters)
+
+
+async def _ahandle_chat(session_id, message, enable_llm, collections, filters):
+    start = time.perf_counter()
+    await asave_message(session_id, "user", message)
+    state = await ahistory_node(initial_state(session_id, message, enable_llm, collections, filters))
+    cacheable = ANSWER_CACHE_ENABLED and not is_follow_up(state)
+    scope = retrieval_scope(collections, filters)
+
+    if cacheable:
+        # The semantic lookup may embed the query, so keep it off the loop
+        cached = await asyncio.to_thread(answer_cache.get, message, enable_llm, scope)
+        if cached is not None:
+            await asave_message(session_id, "assistant", cached["reply"], source=cached["source"])
+            route_metrics.record("cache", time.perf_counter() - start)
+            return cached
+
+    result = await get_async_chatbot_graph().ainvoke(state)
+    reply = {"reply": result["reply"], "source": result["source"]}
+    route_metrics.record(result["route"], time.perf_counter() - start)
+    if cacheable and result["route"] != "fallback" and not reply["reply"].startswith("⚠️"):
+        await asyncio.to_thread(answer_cache.put, message, enable_llm, reply, scope)
+    return reply
+
+
+# --- Streaming chat handler ---
+async def astream_chat(session_id: str, message: str, enable_llm: bool = False, use_async: bool = False,
+                       request_id: str = None, collections=None, filters=None):
+    """
+    Async generator behind /chat/stream. Yields event dicts:
+    {"event": "source", ...} once evaluate_node has routed, then {"event": "token", ...}
+    per Gemini chunk, then {"event": "done", ...}. The assistant message is persisted
+    once, after the last chunk.
+    """
+    with request_context(request_id):
+        async for event in _astream_chat(session_id, message, enable_llm, use_async, collections, filters):
+            yield event
+
+
+async def _astream_chat(session_id, message, enable_llm, use_async, collections, filters):
+    async def _save(role, content, source=None):
+        if use_async:
+            return await asave_message(session_id, role, content, source=source)
+        return await asyncio.to_thread(save_message, session_id, role, content, source)
+
+    start = time.perf_counter()
+    await _save("user", message)
+    with timed("history"):
+        state = await ahistory_node(initial_state(session_id, message, enable_llm, collections, filters))
+    cacheable = ANSWER_CACHE_ENABLED and not is_follow_up(state)
+    scope = retrieval_scope(collections, filters)
+
+    if cacheable:
+        cached = await asyncio.to_thread(answer_cache.get, message, enable_llm, scope)
+        if cached is not None:
+            yield {"event": "source", "source": cached["source"]}
+            yield {"event": "token", "text": cached["reply"]}
+            await _save("assistant", cached["reply"], cached["source"])
+            route_metrics.record("cache", time.perf_counter() - start)
+            yield {"event": "done", "source": cached["source"]}
+            return
+
+    with timed("retrieve"):
+        if use_async:
+            state = await aretrieve_node(state)
+        else:
+            state = await asyncio.to_thread(retrieve_node, state)
+
+    with timed("evaluate"):
+        route = evaluate_node(state)
+    context = state["context"].strip()
+    extracted = extractive_answer(state) if route == "extractive" else None
+    if route == "extractive" and extracted is None:
+        route = "kb_only"
+    if route in ("extractive", "kb_only"):
+        source = "KB"
+        prompt = build_kb_prompt(state["context"], state["query"], state["history"]) if state["context"] else None
+    else:
+        source = "KB+LLM" if context else "LLM"
+        prompt = build_llm_prompt(context, state["query"].strip(), state["history"])
+    yield {"event": "source", "source": source}
+
+    parts = []
+    if extracted is not None or prompt is None:
+        parts.append(extracted or "I couldn't find an answer in internal docs.")
+        yield {"event": "token", "text": parts[0]}
+    else:
+        generation_start = time.perf_counter()
+        try:
+            async for chunk in llm.astream(prompt):
+                text = getattr(chunk, "text", "")
+                if text:
+                    if not parts:
+                        observe_stage("first_token", time.perf_counter() - generation_start)
+                    parts.append(text)
+                    yield {"event": "token", "text": text}
+        except Exception as e:
+            if parts:
+                parts.append(f"\n\n⚠️ Gemini API error: {str(e)}")
+            else:
+                # Nothing streamed yet: answer extractively if the KB allows it
+                text, degraded = llm_failure(state, e, "⚠️ Gemini API error")
+                parts.append(text)
+                if degraded:
+                    route, source = "fallback", "KB"
+            yield {"event": "token", "text": parts[-1]}
+        observe_stage("generation", time.perf_counter() - generation_start)
+
+    reply = "".join(parts).strip()
+    await _save("assistant", reply, source)
+    route_metrics.record(route, time.perf_counter() - start)
+    if cacheable and route != "fallback" and reply and "⚠️" not in reply:
+        await asyncio.to_thread(answer_cache.put, message, enable_llm, {"reply": reply, "source": source}, scope)
+    yield {"event": "done", "source": source}
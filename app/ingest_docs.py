@@ -1,49 +1,388 @@
 # ingest_docs.py
+"""
+Bulk ingestion pipeline for the `docs` table.
+
+Files are streamed line by line and split into overlapping, token-bounded
+chunks; chunks are embedded in batches with bounded concurrency and written
+with execute_values in large transactions.
+
+Re-ingestion is incremental: the `ingest_manifest` table records each source's
+content hash, chunk hashes, mtime and size, so unchanged files are skipped,
+only new/changed chunks are embedded and rows of deleted sources are removed.
+
+Each source belongs to one collection (metadata.collection, default
+"default"), which retrieval can filter on; moving a source to another
+collection rewrites its rows.
+
+Usage:
+    python -m app.ingest_docs                      # ingest data/imaginary_product_faq.txt
+    python -m app.ingest_docs docs/ --batch-size 64 --concurrency 4
+    python -m app.ingest_docs billing_docs/ --collection billing
+"""
+import argparse
+import hashlib
 import os
 import sys
-from dotenv import load_dotenv
-import google.generativeai as genai
-from psycopg2.extras import Json
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from psycopg2.extras import Json, execute_values
 
 # Add project root to sys.path
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
-from app.db import get_conn
+from app.database import get_conn
+from app.embeddings import embed_text as _embed, embed_texts, DOCUMENT_TASK
+from app.answer_cache import bump_kb_version
+from app.vector_index import DEFAULT_COLLECTION, EMBEDDING_TYPE, vector_literal
 
-load_dotenv()
-GOOGLE_GEN_AI_API_KEY = os.getenv("GOOGLE_GENERATIVE_AI_API_KEY") or os.getenv("GOOGLE_API_KEY")
-if not GOOGLE_GEN_AI_API_KEY:
-    raise RuntimeError("GOOGLE_GENERATIVE_AI_API_KEY or GOOGLE_API_KEY not set in .env")
+CHUNK_TOKENS = int(os.getenv("INGEST_CHUNK_TOKENS", "300"))
+CHUNK_OVERLAP = int(os.getenv("INGEST_CHUNK_OVERLAP", "50"))
+EMBED_BATCH_SIZE = int(os.getenv("INGEST_EMBED_BATCH_SIZE", "32"))
+EMBED_CONCURRENCY = int(os.getenv("INGEST_EMBED_CONCURRENCY", "4"))
+COMMIT_EVERY = int(os.getenv("INGEST_COMMIT_EVERY", "1000"))
+INGEST_EXTENSIONS = (".txt", ".md", ".markdown", ".rst")
+
+DEFAULT_FILE = os.path.join(os.path.dirname(__file__), "..", "data", "imaginary_product_faq.txt")
 
-genai.configure(api_key=GOOGLE_GEN_AI_API_KEY)
 
 def embed_text(text: str):
-    """Generate embedding using Google's text-embedding-004 model for documents"""
-    result = genai.embed_content(
-        model="models/text-embedding-004",
-        content=text,
-        task_type="retrieval_document"  # Use "retrieval_document" for documents
+    """Embed a document with the configured provider (cached on disk)"""
+    return _embed(text, task_type=DOCUMENT_TASK)
+
+
+# --- Chunking ---
+def chunk_lines(lines, max_tokens: int = CHUNK_TOKENS, overlap: int = CHUNK_OVERLAP):
+    """
+    Yield chunks of at most `max_tokens` tokens from an iterable of lines.
+    Line breaks are kept; consecutive chunks share up to `overlap` tokens of
+    trailing lines. Lines longer than `max_tokens` are split on words.
+    """
+    window = deque()  # (line, tokens)
+    window_tokens = 0
+
+    def pieces():
+        for line in lines:
+            line = line.rstrip("\n")
+            words = line.split()
+            if len(words) <= max_tokens:
+                yield line, len(words)
+            else:
+                for i in range(0, len(words), max_tokens):
+                    part = words[i:i + max_tokens]
+                    yield " ".join(part), len(part)
+
+    emitted = True
+    for line, tokens in pieces():
+        if window_tokens + tokens > max_tokens and window:
+            yield "\n".join(l for l, _ in window).strip()
+            emitted = True
+            # Keep trailing lines as overlap, leaving room for the incoming line
+            budget = min(overlap, max_tokens - tokens)
+            carry, carry_tokens = deque(), 0
+            while window and carry_tokens + window[-1][1] <= budget:
+                item = window.pop()
+                carry.appendleft(item)
+                carry_tokens += item[1]
+            window, window_tokens = carry, carry_tokens
+        window.append((line, tokens))
+        window_tokens += tokens
+        if tokens:
+            emitted = False
+
+    if window and not emitted:
+        yield "\n".join(l for l, _ in window).strip()
+
+
+def iter_files(paths):
+    """Expand files and directory trees into ingestible file paths"""
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.lower().endswith(INGEST_EXTENSIONS):
+                        yield os.path.join(root, name)
+        else:
+            yield path
+
+
+def _hashing_lines(f, hasher):
+    for line in f:
+        hasher.update(line.encode("utf-8"))
+        yield line
+
+
+def chunk_hash(text: str) -> str:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+# --- Manifest ---
+MANIFEST_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS ingest_manifest (
+    source TEXT PRIMARY KEY,
+    content_hash TEXT NOT NULL,
+    chunking TEXT NOT NULL,
+    chunk_hashes JSONB NOT NULL,
+    mtime DOUBLE PRECISION,
+    size BIGINT,
+    ingested_at TIMESTAMP DEFAULT now()
+);
+ALTER TABLE ingest_manifest ADD COLUMN IF NOT EXISTS collection TEXT NOT NULL DEFAULT '{DEFAULT_COLLECTION}';
+CREATE INDEX IF NOT EXISTS docs_source_idx ON docs ((metadata->>'source'));
+"""
+
+
+def load_manifest(conn) -> dict:
+    """source -> {"content_hash", "chunking", "chunk_hashes", "mtime", "size", "collection"}"""
+    with conn.cursor() as cur:
+        cur.execute(MANIFEST_SCHEMA)
+        cur.execute("SELECT source, content_hash, chunking, chunk_hashes, mtime, size, collection FROM ingest_manifest")
+        rows = cur.fetchall()
+    conn.commit()
+    return {
+        r[0]: {"content_hash": r[1], "chunking": r[2], "chunk_hashes": r[3], "mtime": r[4], "size": r[5],
+               "collection": r[6]}
+        for r in rows
+    }
+
+
+# --- Planning ---
+def plan_file(path, title, manifest, max_tokens, overlap, force=False, collection=DEFAULT_COLLECTION):
+    """
+    Compare a file against its manifest entry and return a plan:
+    {"source", "records" (new chunks to embed), "delete_hashes", "delete_all", "changed", "manifest"}
+    or None when the file is unchanged.
+    """
+    source = os.path.abspath(path)
+    st = os.stat(path)
+    entry = manifest.get(source)
+    if entry and entry.get("collection", DEFAULT_COLLECTION) != collection:
+        # Moved to another collection: every row is rewritten
+        force = True
+    chunking = f"{max_tokens}/{overlap}"
+    if (not force and entry and entry["chunking"] == chunking
+            and entry["mtime"] == st.st_mtime and entry["size"] == st.st_size):
+        return None
+
+    hasher = hashlib.sha256()
+    chunks = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for i, chunk in enumerate(chunk_lines(_hashing_lines(f, hasher), max_tokens, overlap)):
+            if chunk:
+                # Identical chunks within a file are stored once
+                chunks.setdefault(chunk_hash(chunk), (i, chunk))
+    content_hash = hasher.hexdigest()
+
+    new_manifest = {
+        "source": source, "content_hash": content_hash, "chunking": chunking,
+        "chunk_hashes": list(chunks), "mtime": st.st_mtime, "size": st.st_size, "collection": collection,
+    }
+    plan = {"source": source, "records": [], "delete_hashes": [], "delete_all": False,
+            "changed": False, "manifest": new_manifest}
+    if not force and entry and entry["chunking"] == chunking and entry["content_hash"] == content_hash:
+        # Touched but not changed: only refresh mtime/size
+        return plan
+
+    old_hashes = set(entry["chunk_hashes"]) if entry and not force else set()
+    # Sources without a manifest entry may have rows from older ingestion runs
+    plan["changed"] = True
+    plan["delete_all"] = entry is None or force
+    plan["delete_hashes"] = sorted(old_hashes - set(chunks))
+    plan["records"] = [
+        {"title": title, "content": chunk,
+         "metadata": {"source": source, "chunk": i, "chunk_hash": h, "collection": collection}}
+        for h, (i, chunk) in chunks.items() if h not in old_hashes
+    ]
+    return plan
+
+
+def removed_sources(paths, manifest, seen):
+    """Manifest sources under the scanned directories that no longer exist"""
+    roots = [os.path.join(os.path.abspath(p), "") for p in paths if os.path.isdir(p)]
+    return [s for s in manifest if s not in seen and any(s.startswith(r) for r in roots)]
+
+
+# --- Embedding ---
+def _group_plans(plans, batch_size):
+    """Group plans so each embedding job carries at least `batch_size` chunks"""
+    group, count = [], 0
+    for plan in plans:
+        group.append(plan)
+        count += len(plan["records"])
+        if count >= batch_size:
+            yield group
+            group, count = [], 0
+    if group:
+        yield group
+
+
+def _embed_group(group, batch_size):
+    records = [r for plan in group for r in plan["records"]]
+    for i in range(0, len(records), batch_size):
+        batch = records[i:i + batch_size]
+        for record, embedding in zip(batch, embed_texts([r["content"] for r in batch], DOCUMENT_TASK)):
+            record["embedding"] = embedding
+    return group
+
+
+def embed_plans(plans, batch_size=EMBED_BATCH_SIZE, concurrency=EMBED_CONCURRENCY):
+    """
+    Embed plan records in batches on a thread pool, keeping at most `concurrency`
+    jobs in flight so memory stays bounded. Yields plans in input order.
+    """
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        in_flight = deque()
+        for group in _group_plans(plans, batch_size):
+            in_flight.append(pool.submit(_embed_group, group, batch_size))
+            if len(in_flight) >= concurrency:
+                yield from in_flight.popleft().result()
+        while in_flight:
+            yield from in_flight.popleft().result()
+
+
+# --- Writing ---
+def _source_aliases(source):
+    # Rows written before the manifest existed used the path as given on the CLI
+    return [source, os.path.relpath(source)]
+
+
+def apply_plan(cur, plan) -> dict:
+    """Delete stale rows, insert new chunks and upsert the manifest entry for one source"""
+    source = plan["source"]
+    deleted = 0
+    if plan["delete_all"]:
+        cur.execute("DELETE FROM docs WHERE metadata->>'source' = ANY(%s)", (_source_aliases(source),))
+        deleted += cur.rowcount
+    elif plan["delete_hashes"]:
+        cur.execute(
+            "DELETE FROM docs WHERE metadata->>'source' = %s AND metadata->>'chunk_hash' = ANY(%s)",
+            (source, plan["delete_hashes"]),
+        )
+        deleted += cur.rowcount
+    if plan["records"]:
+        execute_values(
+            cur,
+            "INSERT INTO docs (title, content, metadata, embedding) VALUES %s",
+            [(r["title"], r["content"], Json(r["metadata"]), vector_literal(r["embedding"])) for r in plan["records"]],
+            template=f"(%s, %s, %s, %s::{EMBEDDING_TYPE})",
+            page_size=1000,
+        )
+    m = plan["manifest"]
+    cur.execute(
+        """INSERT INTO ingest_manifest (source, content_hash, chunking, chunk_hashes, mtime, size, collection, ingested_at)
+           VALUES (%s, %s, %s, %s, %s, %s, %s, now())
+           ON CONFLICT (source) DO UPDATE SET
+               content_hash = EXCLUDED.content_hash, chunking = EXCLUDED.chunking,
+               chunk_hashes = EXCLUDED.chunk_hashes, mtime = EXCLUDED.mtime,
+               size = EXCLUDED.size, collection = EXCLUDED.collection, ingested_at = now()""",
+        (source, m["content_hash"], m["chunking"], Json(m["chunk_hashes"]), m["mtime"], m["size"], m["collection"]),
     )
-    return result["embedding"]
+    return {"inserted": len(plan["records"]), "deleted": deleted}
+
+
+def remove_source(cur, source) -> int:
+    cur.execute("DELETE FROM docs WHERE metadata->>'source' = ANY(%s)", (_source_aliases(source),))
+    deleted = cur.rowcount
+    cur.execute("DELETE FROM ingest_manifest WHERE source = %s", (source,))
+    return deleted
+
+
+def ingest_paths(paths, titles=None, max_tokens=CHUNK_TOKENS, overlap=CHUNK_OVERLAP,
+                 batch_size=EMBED_BATCH_SIZE, concurrency=EMBED_CONCURRENCY, commit_every=COMMIT_EVERY,
+                 force=False, collection=DEFAULT_COLLECTION):
+    """
+    Incrementally sync files/directories into `docs` and return throughput stats.
+    Unchanged files are skipped, only new/changed chunks are embedded and rows of
+    sources removed from scanned directories are deleted.
+    """
+    start = time.perf_counter()
+    titles = {os.path.abspath(p): t for p, t in (titles or {}).items()}
+    stats = {"docs": 0, "skipped": 0, "changed": 0, "removed": 0, "chunks": 0, "chunks_deleted": 0}
+    seen = set()
+    # dirty: doc changes since the last commit; committed: some doc changes are live
+    dirty = committed = False
 
-def ingest_file(path: str, title: str = None):
-    title = title or os.path.basename(path)
-    content = open(path, "r", encoding="utf-8").read()
-    embedding = embed_text(content)
     conn = get_conn()
     try:
+        manifest = load_manifest(conn)
+
+        def plans():
+            for path in iter_files(paths):
+                stats["docs"] += 1
+                source = os.path.abspath(path)
+                seen.add(source)
+                plan = plan_file(path, titles.get(source) or os.path.basename(path), manifest,
+                                 max_tokens, overlap, force, collection)
+                if plan is None:
+                    stats["skipped"] += 1
+                    continue
+                yield plan
+
+        pending = 0
         with conn.cursor() as cur:
-            cur.execute(
-                "INSERT INTO docs (title, content, metadata, embedding) VALUES (%s, %s, %s, %s)",
-                (title, content, Json({"source": path}), embedding)
-            )
+            for plan in embed_plans(plans(), batch_size, concurrency):
+                result = apply_plan(cur, plan)
+                stats["changed" if plan["changed"] else "skipped"] += 1
+                stats["chunks"] += result["inserted"]
+                stats["chunks_deleted"] += result["deleted"]
+                dirty = dirty or plan["changed"]
+                pending += result["inserted"] + 1
+                if pending >= commit_every:
+                    conn.commit()
+                    committed, dirty, pending = committed or dirty, False, 0
+            for source in removed_sources(paths, manifest, seen):
+                stats["chunks_deleted"] += remove_source(cur, source)
+                stats["removed"] += 1
+                dirty = True
         conn.commit()
+        committed = committed or dirty
     except Exception as e:
         conn.rollback()
         raise e
     finally:
         conn.close()
+        # Also after a failure: batches committed before it are already live
+        if committed:
+            bump_kb_version()
+    elapsed = time.perf_counter() - start
+
+    stats.update({
+        "seconds": round(elapsed, 3),
+        "docs_per_sec": round(stats["docs"] / elapsed, 2) if elapsed else None,
+        "chunks_per_sec": round(stats["chunks"] / elapsed, 2) if elapsed else None,
+    })
+    print(f"Scanned {stats['docs']} docs ({stats['skipped']} unchanged, {stats['changed']} changed, "
+          f"{stats['removed']} removed); embedded {stats['chunks']} chunks, deleted {stats['chunks_deleted']} "
+          f"in {stats['seconds']}s ({stats['docs_per_sec']} docs/s, {stats['chunks_per_sec']} chunks/s)")
+    return stats
+
+
+def ingest_file(path: str, title: str = None):
+    title = title or os.path.basename(path)
+    ingest_paths([path], titles={path: title})
     print("Ingested:", title)
 
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest documents into the docs table")
+    parser.add_argument("paths", nargs="*", help="files or directories (default: the sample FAQ)")
+    parser.add_argument("--chunk-tokens", type=int, default=CHUNK_TOKENS)
+    parser.add_argument("--overlap", type=int, default=CHUNK_OVERLAP)
+    parser.add_argument("--batch-size", type=int, default=EMBED_BATCH_SIZE)
+    parser.add_argument("--concurrency", type=int, default=EMBED_CONCURRENCY)
+    parser.add_argument("--commit-every", type=int, default=COMMIT_EVERY)
+    parser.add_argument("--force", action="store_true", help="re-chunk and re-embed every file")
+    parser.add_argument("--collection", default=DEFAULT_COLLECTION, help="collection the files belong to")
+    args = parser.parse_args()
+
+    if not args.paths:
+        # default file path; adjust as needed
+        ingest_file(DEFAULT_FILE, "Product FAQ")
+        return
+    ingest_paths(args.paths, max_tokens=args.chunk_tokens, overlap=args.overlap,
+                 batch_size=args.batch_size, concurrency=args.concurrency, commit_every=args.commit_every,
+                 force=args.force, collection=args.collection)
+
+
 if __name__ == "__main__":
-    # default file path; adjust as needed
-    ingest_file(os.path.join(os.path.dirname(__file__), "..", "data", "imaginary_product_faq.txt"), "Product FAQ")
+    main()
@@ -0,0 +1,135 @@
+# lifecycle.py
+"""
+Application startup and shutdown, run by the FastAPI lifespan in main.py.
+
+Importing app.main does no network or database work (and does not import
+langgraph or the Gemini SDK). startup() then:
+- creates missing tables and indexes (DB_CREATE_TABLES=1, the default; turn
+  it off when the schema is managed by migrations)
+- on Postgres, creates the upcoming messages partitions (app/message_partitions.py)
+- builds the Gemini model and compiles the sync and async chat graphs
+- with WARMUP_ENABLED=1, also opens a pooled DB connection, loads the
+  embedding provider and cache with one query embedding, and loads the NumPy
+  index when RETRIEVAL_ENGINE=numpy, so the first request pays none of it
+
+GET /health/live answers as soon as the process serves requests;
+GET /health/ready answers 200 only once startup has finished and the
+database is reachable. Startup step durations are reported by both.
+"""
+import os
+import time
+
+from sqlalchemy import text
+
+from app.database import DATABASE_URL, engine, dispose_engines
+from app.persistence import message_writer
+
+DB_CREATE_TABLES = os.getenv("DB_CREATE_TABLES", "1") == "1"
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "0") == "1"
+
+
+class AppState:
+    def __init__(self):
+        self.ready = False
+        self.steps = {}  # step -> seconds
+        self.warmup_errors = {}
+
+    def run_step(self, name: str, fn, required: bool = True):
+        """Time one startup step; a failed optional (warm-up) step is logged, not raised"""
+        start = time.perf_counter()
+        try:
+            fn()
+        except Exception as e:
+            if required:
+                raise
+            self.warmup_errors[name] = str(e)
+            print(f"Warm-up step {name} failed: {str(e)}")
+        finally:
+            self.steps[name] = time.perf_counter() - start
+
+    def stats(self) -> dict:
+        return {
+            "ready": self.ready,
+            "steps_ms": {name: round(seconds * 1000, 1) for name, seconds in self.steps.items()},
+            "warmup_errors": self.warmup_errors,
+        }
+
+
+app_state = AppState()
+
+
+def check_database():
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+
+
+# --- Startup steps ---
+def create_tables():
+    """Create tables (in production, use Alembic migrations instead)"""
+    from app.models import Base
+
+    Base.metadata.create_all(bind=engine)
+    # create_all only indexes new tables; add missing indexes to existing ones
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+
+
+def create_message_partitions():
+    if DATABASE_URL.startswith("postgres"):
+        from app.message_partitions import ensure_partitions
+
+        ensure_partitions()
+
+
+def build_llm():
+    from app.graph_logic import llm
+
+    llm.model  # first access configures the SDK and builds the model
+
+
+def compile_graphs():
+    from app.graph_logic import get_chatbot_graph, get_async_chatbot_graph
+
+    get_chatbot_graph()
+    get_async_chatbot_graph()
+
+
+def warm_embeddings():
+    from app.embeddings import embed_text
+
+    embed_text("warm up")
+
+
+def warm_numpy_index():
+    from app.retrieve import RETRIEVAL_ENGINE
+
+    if RETRIEVAL_ENGINE == "numpy":
+        from app.numpy_index import get_numpy_index
+
+        get_numpy_index()
+
+
+def startup():
+    """Blocking startup work; run in a worker thread by the lifespan"""
+    start = time.perf_counter()
+    if DB_CREATE_TABLES:
+        app_state.run_step("create_tables", create_tables)
+    # Not fatal: the DEFAULT partition takes new messages until the next run
+    app_state.run_step("message_partitions", create_message_partitions, required=False)
+    app_state.run_step("llm", build_llm)
+    app_state.run_step("graphs", compile_graphs)
+    if WARMUP_ENABLED:
+        app_state.run_step("database", check_database, required=False)
+        app_state.run_step("embeddings", warm_embeddings, required=False)
+        app_state.run_step("numpy_index", warm_numpy_index, required=False)
+    app_state.ready = True
+    breakdown = ", ".join(f"{name}={seconds * 1000:.0f}ms" for name, seconds in app_state.steps.items())
+    print(f"✓ Startup finished in {(time.perf_counter() - start) * 1000:.0f}ms ({breakdown})")
+
+
+async def shutdown():
+    app_state.ready = False
+    # Drain the write-behind message queue before the worker exits
+    message_writer.flush()
+    await dispose_engines()
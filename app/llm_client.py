@@ -0,0 +1,392 @@
+# llm_client.py
+"""
+Resilient wrapper around the Gemini model shared by all graph nodes.
+
+Every call goes through the same policy:
+- a circuit breaker: after LLM_BREAKER_FAILURES consecutive failures calls
+  fail fast with CircuitOpenError for LLM_BREAKER_RESET_SECONDS, then one
+  trial call is let through (callers fall back to extractive KB answers)
+- a concurrency cap (LLM_MAX_CONCURRENCY) and an optional token-bucket rate
+  limit (LLM_RATE_PER_SECOND)
+- a per-attempt deadline (LLM_TIMEOUT_SECONDS)
+- jittered exponential retry on retryable errors (429, 5xx, timeouts), up to
+  LLM_MAX_RETRIES and within LLM_TOTAL_DEADLINE_SECONDS overall
+- optional hedging (LLM_HEDGE=1): if an attempt is still running after the
+  observed p95 latency (LLM_HEDGE_DELAY_MS until enough samples), a second
+  identical request is sent and the first response wins
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from google.api_core import exceptions as google_exceptions
+
+from app.singleflight import SingleFlight
+
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "30"))
+LLM_TOTAL_DEADLINE_SECONDS = float(os.getenv("LLM_TOTAL_DEADLINE_SECONDS", "60"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_RETRY_BASE_SECONDS = float(os.getenv("LLM_RETRY_BASE_SECONDS", "0.5"))
+LLM_RETRY_MAX_SECONDS = 8.0
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+LLM_RATE_PER_SECOND = float(os.getenv("LLM_RATE_PER_SECOND", "0"))
+LLM_HEDGE = os.getenv("LLM_HEDGE", "0") == "1"
+LLM_HEDGE_DELAY_MS = float(os.getenv("LLM_HEDGE_DELAY_MS", "2000"))
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_RESET_SECONDS = float(os.getenv("LLM_BREAKER_RESET_SECONDS", "30"))
+
+# p95 is only trusted once this many latencies have been observed
+HEDGE_MIN_SAMPLES = 20
+
+RETRYABLE_ERRORS = (
+    google_exceptions.TooManyRequests,
+    google_exceptions.ResourceExhausted,
+    google_exceptions.InternalServerError,
+    google_exceptions.BadGateway,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.GatewayTimeout,
+    google_exceptions.DeadlineExceeded,
+    TimeoutError,
+    asyncio.TimeoutError,
+    ConnectionError,
+)
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised without calling the model while the circuit breaker is open"""
+
+
+class TokenBucket:
+    """Thread-safe token bucket; reserve() returns how long the caller must wait"""
+
+    def __init__(self, rate: float, burst: float = None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class CircuitBreaker:
+    def __init__(self, failures: int = LLM_BREAKER_FAILURES, reset_seconds: float = LLM_BREAKER_RESET_SECONDS):
+        self.failures = failures
+        self.reset_seconds = reset_seconds
+        self.consecutive = 0
+        self.opened_at = None
+        self.trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if time.monotonic() - self.opened_at >= self.reset_seconds else "open"
+
+    def before_call(self):
+        with self._lock:
+            state = self.state
+            if state == "open" or (state == "half_open" and self.trial_running):
+                raise CircuitOpenError("Gemini circuit breaker is open")
+            if state == "half_open":
+                self.trial_running = True
+
+    def release(self):
+        """Call abandoned without an outcome (cancelled): let another trial through"""
+        with self._lock:
+            self.trial_running = False
+
+    def record(self, ok: bool):
+        with self._lock:
+            self.trial_running = False
+            if ok:
+                self.consecutive = 0
+                self.opened_at = None
+            else:
+                self.consecutive += 1
+                if self.consecutive >= self.failures or self.opened_at is not None:
+                    # A failed half-open trial re-opens the breaker for another period
+                    self.opened_at = time.monotonic()
+
+
+class LLMClient:
+    def __init__(self, model=None, timeout: float = LLM_TIMEOUT_SECONDS, max_retries: int = LLM_MAX_RETRIES,
+                 total_deadline: float = LLM_TOTAL_DEADLINE_SECONDS, max_concurrency: int = LLM_MAX_CONCURRENCY,
+                 rate_per_second: float = LLM_RATE_PER_SECOND, hedge: bool = LLM_HEDGE,
+                 hedge_delay_ms: float = LLM_HEDGE_DELAY_MS, breaker: CircuitBreaker = None, model_factory=None):
+        # Either a model, or a factory called on first use (keeps SDK setup out of import time)
+        self._model = model
+        self._model_factory = model_factory
+        self._model_lock = threading.Lock()
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.total_deadline = total_deadline
+        self.max_concurrency = max_concurrency
+        self.bucket = TokenBucket(rate_per_second) if rate_per_second > 0 else None
+        self.hedge = hedge
+        self.hedge_delay_ms = hedge_delay_ms
+        self.breaker = breaker or CircuitBreaker()
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+        self._async_semaphores = {}  # event loop -> asyncio.Semaphore
+        self._hedge_pool = ThreadPoolExecutor(max_workers=max_concurrency * 2, thread_name_prefix="llm-hedge")
+        self._latencies = deque(maxlen=500)
+        # Concurrent requests with an identical prompt share one Gemini call
+        self._flight = SingleFlight("generation")
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.retries = 0
+        self.hedges = 0
+        self.failures = 0
+        self.short_circuited = 0
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    self._model = self._model_factory()
+        return self._model
+
+    @model.setter
+    def model(self, model):
+        self._model = model
+
+    @property
+    def model_ready(self) -> bool:
+        return self._model is not None
+
+    # --- Policy helpers ---
+    def _backoff(self, attempt: int) -> float:
+        # Full jitter: uniform over [0, min(cap, base * 2^attempt)]
+        return random.uniform(0, min(LLM_RETRY_MAX_SECONDS, LLM_RETRY_BASE_SECONDS * 2 ** attempt))
+
+    def _hedge_delay(self) -> float:
+        with self._lock:
+            latencies = sorted(self._latencies)
+        if len(latencies) >= HEDGE_MIN_SAMPLES:
+            return latencies[int(len(latencies) * 0.95) - 1]
+        return self.hedge_delay_ms / 1000.0
+
+    def _observe(self, seconds: float):
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def _request_options(self) -> dict:
+        # Retries are ours; the SDK only enforces the per-attempt deadline
+        return {"timeout": self.timeout}
+
+    def _async_semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        semaphore = self._async_semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._async_semaphores.setdefault(loop, asyncio.Semaphore(self.max_concurrency))
+        return semaphore
+
+    def _check_breaker(self):
+        try:
+            self.breaker.before_call()
+        except CircuitOpenError:
+            self.short_circuited += 1
+            raise
+
+    # --- Sync ---
+    def _attempt(self, prompt, **kwargs):
+        if self.bucket:
+            time.sleep(self.bucket.reserve())
+        with self._semaphore:
+            start = time.perf_counter()
+            response = self.model.generate_content(prompt, request_options=self._request_options(), **kwargs)
+            self._observe(time.perf_counter() - start)
+            return response
+
+    def _hedged_attempt(self, prompt, **kwargs):
+        first = self._hedge_pool.submit(self._attempt, prompt, **kwargs)
+        done, _ = wait([first], timeout=self._hedge_delay())
+        if done:
+            return first.result()
+        self.hedges += 1
+        second = self._hedge_pool.submit(self._attempt, prompt, **kwargs)
+        pending = {first, second}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    @staticmethod
+    def _flight_key(prompt, kwargs):
+        return prompt, repr(sorted(kwargs.items()))
+
+    def generate(self, prompt, **kwargs):
+        """generate_content with the deadline, retry, rate limit, hedging and breaker policy"""
+        return self._flight.do(self._flight_key(prompt, kwargs), self._generate, prompt, **kwargs)
+
+    def _generate(self, prompt, **kwargs):
+        self._check_breaker()
+        self.calls += 1
+        started = time.monotonic()
+        attempt = 0
+        while True:
+            try:
+                response = self._hedged_attempt(prompt, **kwargs) if self.hedge else self._attempt(prompt, **kwargs)
+                self.breaker.record(True)
+                return response
+            except RETRYABLE_ERRORS:
+                delay = self._backoff(attempt)
+                if attempt >= self.max_retries or time.monotonic() - started + delay >= self.total_deadline:
+                    self.failures += 1
+                    self.breaker.record(False)
+                    raise
+                attempt += 1
+                self.retries += 1
+                time.sleep(delay)
+            except Exception:
+                # Non-retryable (bad request, safety block, ...): not a health signal for the breaker
+                self.failures += 1
+                self.breaker.record(True)
+                raise
+            except BaseException:
+                self.breaker.release()
+                raise
+
+    # --- Async ---
+    async def _aattempt(self, prompt, **kwargs):
+        if self.bucket:
+            await asyncio.sleep(self.bucket.reserve())
+        async with self._async_semaphore():
+            start = time.perf_counter()
+            response = await asyncio.wait_for(
+                self.model.generate_content_async(prompt, request_options=self._request_options(), **kwargs),
+                self.timeout,
+            )
+            self._observe(time.perf_counter() - start)
+            return response
+
+    async def _ahedged_attempt(self, prompt, **kwargs):
+        first = asyncio.ensure_future(self._aattempt(prompt, **kwargs))
+        done, _ = await asyncio.wait({first}, timeout=self._hedge_delay())
+        if done:
+            return first.result()
+        self.hedges += 1
+        second = asyncio.ensure_future(self._aattempt(prompt, **kwargs))
+        pending = {first, second}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def agenerate(self, prompt, **kwargs):
+        """Async generate() over generate_content_async"""
+        return await self._flight.ado(self._flight_key(prompt, kwargs), self._agenerate, prompt, **kwargs)
+
+    async def _agenerate(self, prompt, **kwargs):
+        self._check_breaker()
+        self.calls += 1
+        started = time.monotonic()
+        attempt = 0
+        while True:
+            try:
+                if self.hedge:
+                    response = await self._ahedged_attempt(prompt, **kwargs)
+                else:
+                    response = await self._aattempt(prompt, **kwargs)
+                self.breaker.record(True)
+                return response
+            except RETRYABLE_ERRORS:
+                delay = self._backoff(attempt)
+                if attempt >= self.max_retries or time.monotonic() - started + delay >= self.total_deadline:
+                    self.failures += 1
+                    self.breaker.record(False)
+                    raise
+                attempt += 1
+                self.retries += 1
+                await asyncio.sleep(delay)
+            except Exception:
+                self.failures += 1
+                self.breaker.record(True)
+                raise
+            except BaseException:
+                # Cancelled, or the stream consumer went away
+                self.breaker.release()
+                raise
+
+    async def astream(self, prompt):
+        """
+        Streaming generation. Retries only happen before the first chunk;
+        each chunk must arrive within the per-attempt deadline.
+        """
+        self._check_breaker()
+        self.calls += 1
+        started = time.monotonic()
+        attempt = 0
+        while True:
+            yielded = False
+            try:
+                if self.bucket:
+                    await asyncio.sleep(self.bucket.reserve())
+                async with self._async_semaphore():
+                    response = await asyncio.wait_for(
+                        self.model.generate_content_async(prompt, stream=True, request_options=self._request_options()),
+                        self.timeout,
+                    )
+                    chunks = response.__aiter__()
+                    while True:
+                        try:
+                            chunk = await asyncio.wait_for(chunks.__anext__(), self.timeout)
+                        except StopAsyncIteration:
+                            break
+                        yielded = True
+                        yield chunk
+                self.breaker.record(True)
+                return
+            except RETRYABLE_ERRORS:
+                delay = self._backoff(attempt)
+                if yielded or attempt >= self.max_retries or time.monotonic() - started + delay >= self.total_deadline:
+                    self.failures += 1
+                    self.breaker.record(False)
+                    raise
+                attempt += 1
+                self.retries += 1
+                await asyncio.sleep(delay)
+            except Exception:
+                self.failures += 1
+                self.breaker.record(True)
+                raise
+            except BaseException:
+                # Cancelled, or the stream consumer went away
+                self.breaker.release()
+                raise
+
+    def stats(self) -> dict:
+        return {
+            "model_loaded": self.model_ready,
+            "breaker": self.breaker.state,
+            "calls": self.calls,
+            "retries": self.retries,
+            "hedges": self.hedges,
+            "failures": self.failures,
+            "short_circuited": self.short_circuited,
+            "hedge_delay_ms": round(self._hedge_delay() * 1000, 1),
+        }
@@ -1,27 +1,61 @@
 # main.py
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
-from typing import List
+from fastapi.responses import StreamingResponse
+from sqlalchemy import delete, func, select, tuple_
+from sqlalchemy.orm import Session, selectinload
+from typing import List, Union
+from contextlib import asynccontextmanager
 from datetime import datetime
+import csv
+import io
+import json
+import os
 import uuid
 
-from app.graph_logic import handle_chat
-from app.database import get_db, engine  # Changed from app.db
-from app.models import Base, Session as SessionModel, Message as MessageModel
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
+
+from app.graph_logic import handle_chat, ahandle_chat, astream_chat, llm
+from app.batch import run_batch, BATCH_CONCURRENCY, BATCH_MAX_QUESTIONS
+from app.answer_cache import answer_cache
+from app.persistence import message_writer
+from app.memory import conversation_memory
+from app.metrics import route_metrics, request_id_var, request_id_from_header
+from app.singleflight import singleflight_stats
+from app.lifecycle import app_state, startup, shutdown, check_database
+from app.database import get_db, get_db_context, pool_stats
+from app.models import Session as SessionModel, Message as MessageModel, in_session_window
+from app.pagination import encode_cursor, decode_cursor
 
 from app.schemas import (
     ChatRequest,
+    BatchChatRequest,
     ChatResponse,
     SessionResponse,
+    SessionSummaryResponse,
+    LastMessageSummary,
     SessionCreateRequest,
     MessageResponse,
 )
 
-# Create tables (in production, use Alembic migrations instead)
-Base.metadata.create_all(bind=engine)
+# CHAT_ASYNC=1 runs /chat on the async graph, DB engine and Gemini client
+CHAT_ASYNC = os.getenv("CHAT_ASYNC", "0") == "1"
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+SESSIONS_PAGE_SIZE = int(os.getenv("SESSIONS_PAGE_SIZE", "50"))
+SESSIONS_MAX_PAGE_SIZE = 200
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Tables, Gemini model and compiled graphs at startup (optional warm-up); flush and dispose at shutdown"""
+    await run_in_threadpool(startup)
+    yield
+    await shutdown()
 
-app = FastAPI()
+
+app = FastAPI(lifespan=lifespan)
 
 # Configure CORS
 app.add_middleware(
@@ -35,18 +69,39 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Request-ID"],
 )
 
+
+@app.middleware("http")
+async def bind_request_id(request: Request, call_next):
+    """Propagate X-Request-ID (or a new id if missing or malformed) into the chat graph state, logs and the response"""
+    request_id = request_id_from_header(request.headers.get("X-Request-ID"))
+    token = request_id_var.set(request_id)
+    try:
+        response = await call_next(request)
+    finally:
+        request_id_var.reset(token)
+    response.headers["X-Request-ID"] = request_id
+    return response
+
+
 # ---------- Routes ----------
 
 @app.post("/chat", response_model=ChatResponse)
-def chat(req: ChatRequest):
+async def chat(req: ChatRequest):
     """Main chat endpoint"""
     if not req.message:
         raise HTTPException(status_code=400, detail="Message is required")
     
     session_id = req.session_id or str(uuid.uuid4())
-    result = handle_chat(session_id, req.message, enable_llm=req.enable_llm) 
+    if CHAT_ASYNC:
+        result = await ahandle_chat(session_id, req.message, enable_llm=req.enable_llm,
+                                    collections=req.collections, filters=req.filters)
+    else:
+        # Sync pipeline pins a threadpool worker for the whole request
+        result = await run_in_threadpool(handle_chat, session_id, req.message, enable_llm=req.enable_llm,
+                                         collections=req.collections, filters=req.filters)
     
     return ChatResponse(
         reply=result["reply"],
@@ -54,58 +109,205 @@ def chat(req: ChatRequest):
         session_id=session_id
     )
 
+@app.post("/chat/stream")
+async def chat_stream(req: ChatRequest):
+    """Chat endpoint streaming the reply as Server-Sent Events"""
+    if not req.message:
+        raise HTTPException(status_code=400, detail="Message is required")
+
+    session_id = req.session_id or str(uuid.uuid4())
+
+    async def event_stream():
+        yield f"event: session\ndata: {json.dumps({'session_id': session_id})}\n\n"
+        async for event in astream_chat(session_id, req.message, enable_llm=req.enable_llm, use_async=CHAT_ASYNC,
+                                        collections=req.collections, filters=req.filters):
+            name = event.pop("event")
+            yield f"event: {name}\ndata: {json.dumps(event)}\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.post("/chat/batch")
+def chat_batch(req: BatchChatRequest):
+    """
+    Answer many questions with batched embedding and search. Streams one NDJSON line
+    per answer as it completes (with its index), then a {"summary": ...} line.
+    """
+    if not req.questions:
+        raise HTTPException(status_code=400, detail="questions is required")
+    if len(req.questions) > BATCH_MAX_QUESTIONS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_QUESTIONS} questions per batch")
+    concurrency = max(1, min(req.concurrency or BATCH_CONCURRENCY, BATCH_CONCURRENCY))
+    results = run_batch(req.questions, req.enable_llm, req.session_id, req.persist,
+                        req.collections, req.filters, concurrency)
+    return StreamingResponse((json.dumps(r) + "\n" for r in results), media_type="application/x-ndjson")
+
 @app.get("/health")
 def health():
-    """Simple health check"""
-    from sqlalchemy import text
+    """Detailed health: database, pools, persistence, LLM client and coalescing stats"""
+    try:
+        check_database()
+        return {
+            "status": "ok",
+            "database": "connected",
+            "startup": app_state.stats(),
+            "pool": pool_stats(),
+            "persistence": message_writer.stats(),
+            "llm": llm.stats(),
+            "singleflight": singleflight_stats(),
+        }
+    except Exception as e:
+        return {"status": "error", "database": "disconnected", "error": str(e), "pool": pool_stats()}
+
+@app.get("/health/live")
+def liveness():
+    """Liveness: the process serves requests; no dependency checks"""
+    return {"status": "ok"}
+
+@app.get("/health/ready")
+def readiness(response: Response):
+    """Readiness: startup finished and the database is reachable (503 otherwise)"""
+    if not app_state.ready:
+        response.status_code = 503
+        return {"status": "starting", "startup": app_state.stats()}
     try:
-        with engine.connect() as conn:
-            conn.execute(text("SELECT 1"))
-        return {"status": "ok", "database": "connected"}
+        check_database()
     except Exception as e:
+        response.status_code = 503
         return {"status": "error", "database": "disconnected", "error": str(e)}
+    return {"status": "ok", "startup": app_state.stats()}
+
+@app.get("/cache/stats")
+def cache_stats():
+    """Answer cache hit/miss counters"""
+    return answer_cache.stats()
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus metrics: chat latency per route and per pipeline stage"""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+@app.get("/routes/stats")
+def routes_stats():
+    """Request counts and latency percentiles per answer route"""
+    return route_metrics.stats()
 
 # Session endpoints
-@app.get("/sessions", response_model=List[SessionResponse])
-def get_all_sessions(db: Session = Depends(get_db)):
-    """Get all sessions with their messages"""
+@app.get("/sessions", response_model=Union[List[SessionResponse], List[SessionSummaryResponse]])
+def get_all_sessions(
+    response: Response,
+    limit: int = Query(SESSIONS_PAGE_SIZE, ge=1, le=SESSIONS_MAX_PAGE_SIZE),
+    cursor: str = None,
+    summary: bool = False,
+    db: Session = Depends(get_db),
+):
+    """
+    Get sessions newest first, one page at a time.
+    Pass the X-Next-Cursor response header back as `cursor` for the next page.
+    With summary=true, returns message counts and last-message metadata instead of messages.
+    """
     try:
-        # Use snake_case: created_at
-        sessions = db.query(SessionModel).order_by(SessionModel.created_at.desc()).all()
-        
-        result = []
-        for session in sessions:
-            # Messages are loaded via relationship
-            session_messages = [
-                MessageResponse(
-                    id=str(msg.id),
-                    sessionId=str(msg.session_id),  # Map to camelCase for API
-                    role=msg.role,
-                    content=msg.content,
-                    source=msg.source,
-                    createdAt=msg.created_at  # Map to camelCase
-                )
-                for msg in sorted(session.messages, key=lambda m: m.created_at)
-            ]
-            
-            result.append(SessionResponse(
+        after = decode_cursor(cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    try:
+        query = db.query(SessionModel)
+        if after:
+            # Keyset pagination: served from ix_sessions_created_at_id, no OFFSET scan
+            query = query.filter(tuple_(SessionModel.created_at, SessionModel.id) < tuple_(*after))
+        if not summary:
+            # One extra query for all messages of the page instead of one per session
+            query = query.options(selectinload(SessionModel.messages))
+        sessions = query.order_by(SessionModel.created_at.desc(), SessionModel.id.desc()).limit(limit).all()
+
+        if len(sessions) == limit:
+            last = sessions[-1]
+            response.headers["X-Next-Cursor"] = encode_cursor(last.created_at, str(last.id))
+
+        if summary:
+            return session_summaries(db, sessions)
+
+        return [
+            SessionResponse(
                 id=str(session.id),
                 userId=session.user_id,  # Map to camelCase
                 createdAt=session.created_at,  # Map to camelCase
                 lastActive=session.last_active,  # Map to camelCase
-                messages=session_messages
-            ))
-        
-        return result
+                messages=[
+                    MessageResponse(
+                        id=str(msg.id),
+                        sessionId=str(msg.session_id),  # Map to camelCase for API
+                        role=msg.role,
+                        content=msg.content,
+                        source=msg.source,
+                        createdAt=msg.created_at  # Map to camelCase
+                    )
+                    # Ordered by created_at via the relationship
+                    for msg in session.messages
+                ]
+            )
+            for session in sessions
+        ]
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch sessions: {str(e)}")
 
+
+def session_summaries(db: Session, sessions) -> List[SessionSummaryResponse]:
+    """Message counts and last message per session, in two grouped queries"""
+    ids = [s.id for s in sessions]
+    # No page message predates its oldest session: partitions before it are pruned at plan time
+    in_page = [MessageModel.session_id.in_(ids)]
+    oldest = min((s.created_at for s in sessions if s.created_at), default=None)
+    if oldest:
+        in_page.append(MessageModel.created_at >= oldest)
+    counts = dict(
+        db.query(MessageModel.session_id, func.count(MessageModel.id))
+        .filter(*in_page)
+        .group_by(MessageModel.session_id)
+        .all()
+    ) if ids else {}
+    # row_number() rather than DISTINCT ON, which only Postgres supports (SQLite silently ignores it)
+    ranked = (
+        select(
+            MessageModel.id, MessageModel.session_id, MessageModel.role, MessageModel.source, MessageModel.created_at,
+            func.row_number().over(
+                partition_by=MessageModel.session_id,
+                order_by=(MessageModel.created_at.desc(), MessageModel.id.desc()),
+            ).label("rank"),
+        )
+        .where(*in_page)
+        .subquery()
+    )
+    last_messages = {
+        m.session_id: m
+        for m in db.execute(select(ranked).where(ranked.c.rank == 1)).all()
+    } if ids else {}
+
+    result = []
+    for session in sessions:
+        last = last_messages.get(session.id)
+        result.append(SessionSummaryResponse(
+            id=str(session.id),
+            userId=session.user_id,
+            createdAt=session.created_at,
+            lastActive=session.last_active,
+            messageCount=counts.get(session.id, 0),
+            lastMessage=LastMessageSummary(
+                id=str(last.id), role=last.role, source=last.source, createdAt=last.created_at
+            ) if last else None,
+        ))
+    return result
+
 @app.get("/sessions/{session_id}/messages", response_model=List[MessageResponse])
 def get_session_messages(session_id: str, db: Session = Depends(get_db)):
     """Get all messages for a specific session"""
     try:
         messages = db.query(MessageModel).filter(
-            MessageModel.session_id == session_id
+            MessageModel.session_id == session_id, in_session_window(session_id)
         ).order_by(MessageModel.created_at.asc()).all()
         
         return [
@@ -122,6 +324,79 @@ def get_session_messages(session_id: str, db: Session = Depends(get_db)):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch messages: {str(e)}")
 
+EXPORT_COLUMNS = ["id", "sessionId", "role", "content", "source", "createdAt"]
+
+
+def export_rows(session_id: str = None, since: datetime = None, until: datetime = None):
+    """
+    Yield batches of message rows as plain tuples from a server-side cursor,
+    so memory stays constant regardless of how many messages are exported.
+    """
+    stmt = select(
+        MessageModel.id, MessageModel.session_id, MessageModel.role,
+        MessageModel.content, MessageModel.source, MessageModel.created_at,
+    )
+    if session_id:
+        stmt = stmt.where(MessageModel.session_id == session_id)
+    if since:
+        stmt = stmt.where(MessageModel.created_at >= since)
+    if until:
+        stmt = stmt.where(MessageModel.created_at < until)
+    stmt = stmt.order_by(MessageModel.session_id, MessageModel.created_at).execution_options(
+        stream_results=True, yield_per=EXPORT_BATCH_SIZE
+    )
+    with get_db_context() as db:
+        for batch in db.execute(stmt).partitions():
+            yield batch
+
+
+def ndjson_stream(batches):
+    for batch in batches:
+        yield "".join(
+            json.dumps({
+                "id": str(r[0]), "sessionId": str(r[1]), "role": r[2], "content": r[3],
+                "source": r[4], "createdAt": r[5].isoformat() if r[5] else None,
+            }) + "\n"
+            for r in batch
+        )
+
+
+def csv_stream(batches):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for batch in batches:
+        writer.writerows(
+            (str(r[0]), str(r[1]), r[2], r[3], r[4], r[5].isoformat() if r[5] else None) for r in batch
+        )
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+@app.get("/export/messages")
+def export_messages(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    session_id: str = None,
+    since: datetime = None,
+    until: datetime = None,
+):
+    """Stream message transcripts as NDJSON or CSV in constant memory"""
+    batches = export_rows(session_id, since, until)
+    if format == "csv":
+        return StreamingResponse(
+            csv_stream(batches),
+            media_type="text/csv",
+            headers={"Content-Disposition": 'attachment; filename="messages.csv"'},
+        )
+    return StreamingResponse(
+        ndjson_stream(batches),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": 'attachment; filename="messages.ndjson"'},
+    )
+
 @app.post("/sessions", response_model=SessionResponse)
 def create_or_get_session(req: SessionCreateRequest, db: Session = Depends(get_db)):
     """Create a new session or get existing one"""
@@ -166,14 +441,16 @@ def create_or_get_session(req: SessionCreateRequest, db: Session = Depends(get_d
 def delete_session(session_id: str, db: Session = Depends(get_db)):
     """Delete a session and all its messages"""
     try:
-        session = db.query(SessionModel).filter(SessionModel.id == session_id).first()
-        
-        if not session:
+        # Drop its messages still waiting in the write-behind queue, or the next flush would re-create it
+        message_writer.discard(session_id)
+        # Two bulk statements, no ORM loading. The explicit message delete keeps this working on
+        # databases whose foreign key predates ON DELETE CASCADE (see app/message_partitions.py migrate)
+        db.execute(delete(MessageModel).where(MessageModel.session_id == session_id))
+        deleted = db.execute(delete(SessionModel).where(SessionModel.id == session_id)).rowcount
+        if not deleted:
             raise HTTPException(status_code=404, detail="Session not found")
-        
-        # Delete session (messages will be cascade deleted due to relationship)
-        db.delete(session)
         db.commit()
+        conversation_memory.clear(session_id)
         
         return {"message": "Session deleted successfully", "session_id": session_id}
     except HTTPException:
@@ -0,0 +1,150 @@
+# memory.py
+"""
+Bounded conversation memory for the chat graph.
+
+Each session keeps its last MEMORY_TURNS messages in an in-process LRU cache
+(loaded from `messages` on a miss). Turns that fall out of the window are
+folded into a rolling extractive summary capped at MEMORY_SUMMARY_TOKENS, so
+the history added to prompts stays constant in size as conversations grow.
+Follow-up questions are condensed into a standalone query for retrieval.
+
+Environment variables:
+- MEMORY_ENABLED: "1" (default) or "0"
+- MEMORY_TURNS: recent messages kept verbatim (default 6)
+- MEMORY_TURN_TOKENS: per-message cap in the history text (default 150)
+- MEMORY_SUMMARY_TOKENS: cap of the rolling summary (default 200)
+- MEMORY_MAX_SESSIONS: sessions kept in the LRU cache (default 1000)
+"""
+import os
+import re
+import threading
+from collections import OrderedDict, deque
+
+MEMORY_ENABLED = os.getenv("MEMORY_ENABLED", "1") == "1"
+MEMORY_TURNS = int(os.getenv("MEMORY_TURNS", "6"))
+MEMORY_TURN_TOKENS = int(os.getenv("MEMORY_TURN_TOKENS", "150"))
+MEMORY_SUMMARY_TOKENS = int(os.getenv("MEMORY_SUMMARY_TOKENS", "200"))
+MEMORY_MAX_SESSIONS = int(os.getenv("MEMORY_MAX_SESSIONS", "1000"))
+
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+# Words that usually point back to an earlier turn ("there" is left out: "is there ..." rarely refers back)
+_REFERENCE_WORDS = {
+    "it", "its", "they", "them", "their", "this", "that", "these", "those",
+    "he", "she", "him", "her", "one", "ones", "same", "above", "else", "former", "latter",
+}
+_REFERENCE_PHRASES = ("what about", "how about")
+
+
+def truncate_tokens(text: str, limit: int) -> str:
+    words = text.split()
+    return text.strip() if len(words) <= limit else " ".join(words[:limit]) + " …"
+
+
+class ConversationMemory:
+    def __init__(self, turns: int = MEMORY_TURNS, summary_tokens: int = MEMORY_SUMMARY_TOKENS,
+                 max_sessions: int = MEMORY_MAX_SESSIONS):
+        self.turns = turns
+        self.summary_tokens = summary_tokens
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()  # session_id -> {"turns": deque, "summary": [lines]}
+        self._lock = threading.Lock()
+
+    def _load(self, session_id):
+        """
+        Last `turns` messages (cache miss): committed rows plus those still
+        waiting in the write-behind queue, merged by message id
+        """
+        from app.database import get_db_context
+        from app.models import Message, in_session_window
+        from app.persistence import message_writer
+
+        # Snapshot the queue first: a record flushed meanwhile then shows up in the DB read instead
+        messages = {r["id"]: (r["created_at"], r["role"], r["content"]) for r in message_writer.pending(session_id)}
+        with get_db_context() as db:
+            rows = (
+                db.query(Message.id, Message.created_at, Message.role, Message.content)
+                .filter(Message.session_id == session_id, in_session_window(session_id))
+                .order_by(Message.created_at.desc())
+                .limit(self.turns)
+                .all()
+            )
+        for r in rows:
+            messages.setdefault(r[0], (r[1], r[2], r[3]))
+        recent = sorted(messages.values(), key=lambda m: m[0])[-self.turns:]
+        return {"turns": deque(((role, content) for _, role, content in recent), maxlen=self.turns), "summary": []}
+
+    def _entry(self, session_id, load=True):
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is not None:
+                self._sessions.move_to_end(session_id)
+                return entry
+        if not load:
+            return None
+        entry = self._load(session_id)
+        with self._lock:
+            # Another request may have loaded it meanwhile
+            entry = self._sessions.setdefault(session_id, entry)
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        return entry
+
+    def append(self, session_id, role, content):
+        """Record a new message; the oldest turn is folded into the summary"""
+        entry = self._entry(session_id, load=False)
+        if entry is None:
+            # Not cached yet: the next read loads it (including this message) from the DB
+            return
+        with self._lock:
+            turns = entry["turns"]
+            if len(turns) == turns.maxlen:
+                self._fold(entry, *turns[0])
+            turns.append((role, content))
+
+    def _fold(self, entry, role, content):
+        first_sentence = _SENTENCE_RE.split(content.strip(), maxsplit=1)[0]
+        entry["summary"].append(f"{role}: {truncate_tokens(first_sentence, 40)}")
+        # Drop the oldest summary lines to stay within the token budget
+        while sum(len(line.split()) for line in entry["summary"]) > self.summary_tokens:
+            entry["summary"].pop(0)
+
+    def history(self, session_id, current_query: str = None):
+        """(summary, turns) before the current query"""
+        entry = self._entry(session_id)
+        with self._lock:
+            turns = list(entry["turns"])
+            summary = list(entry["summary"])
+        if turns and current_query is not None and turns[-1] == ("user", current_query):
+            turns = turns[:-1]
+        return summary, turns
+
+    def format_history(self, summary, turns) -> str:
+        parts = []
+        if summary:
+            parts.append("Earlier in the conversation:\n" + "\n".join(summary))
+        if turns:
+            parts.append("\n".join(f"{role}: {truncate_tokens(content, MEMORY_TURN_TOKENS)}" for role, content in turns))
+        return "\n\n".join(parts)
+
+    def condense(self, query: str, turns) -> str:
+        """
+        Standalone retrieval query: follow-ups that refer back (it, that, those,
+        the same, what about ...) are prefixed with the previous user question;
+        anything else, however short, passes through unchanged (and stays cacheable).
+        """
+        previous = next((content for role, content in reversed(turns) if role == "user"), None)
+        if not previous:
+            return query
+        lowered = query.lower()
+        words = re.findall(r"\w+", lowered)
+        if not _REFERENCE_WORDS.intersection(words) and not any(p in lowered for p in _REFERENCE_PHRASES):
+            return query
+        return f"{truncate_tokens(previous, MEMORY_TURN_TOKENS)} {query}"
+
+    def clear(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+
+conversation_memory = ConversationMemory()
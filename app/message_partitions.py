@@ -0,0 +1,313 @@
+# message_partitions.py
+"""
+Time-range partitions of the `messages` table, and the retention job that
+archives and drops old ones.
+
+messages is partitioned by created_at (one partition per month by default,
+named messages_pYYYYMMDD after the first day it covers) plus a DEFAULT
+partition that catches rows outside every range, so inserts never fail when
+maintenance lapses. Retention works on whole partitions: an expired
+partition is streamed to a gzip-compressed NDJSON file (same fields as
+GET /export/messages), then detached and dropped. No row-by-row DELETE and
+no table bloat. Sessions idle past the cutoff with no messages left are deleted
+afterwards.
+
+Session reads filter on the session's created_at (models.in_session_window),
+so they only touch partitions from the session's start onwards.
+
+Environment variables:
+- MESSAGES_PARTITION_INTERVAL: "month" (default), "week" or "day"
+- MESSAGES_PARTITIONS_AHEAD: future partitions kept created (default 3)
+- MESSAGES_RETENTION_DAYS: default retention for the `retention` command
+  (default 0, i.e. keep everything)
+- MESSAGES_ARCHIVE_DIR: where expired partitions are archived (default message_archive)
+
+Usage:
+    python -m app.message_partitions migrate           # convert an existing unpartitioned messages table
+    python -m app.message_partitions ensure --ahead 3  # create upcoming partitions (startup does this too)
+    python -m app.message_partitions retention --days 180 --dry-run
+    python -m app.message_partitions retention --days 180 --archive-dir /backups/messages
+    python -m app.message_partitions retention --days 30 --no-archive
+    python -m app.message_partitions show
+"""
+import argparse
+import gzip
+import json
+import os
+import re
+import sys
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+from app.database import engine
+from app.models import Message
+
+INTERVALS = ("day", "week", "month")
+MESSAGES_PARTITION_INTERVAL = os.getenv("MESSAGES_PARTITION_INTERVAL", "month").lower()
+if MESSAGES_PARTITION_INTERVAL not in INTERVALS:
+    raise ValueError(f"Unknown MESSAGES_PARTITION_INTERVAL: {MESSAGES_PARTITION_INTERVAL}")
+MESSAGES_PARTITIONS_AHEAD = int(os.getenv("MESSAGES_PARTITIONS_AHEAD", "3"))
+MESSAGES_RETENTION_DAYS = int(os.getenv("MESSAGES_RETENTION_DAYS", "0"))
+MESSAGES_ARCHIVE_DIR = os.getenv("MESSAGES_ARCHIVE_DIR", "message_archive")
+ARCHIVE_BATCH_SIZE = 5000
+
+DEFAULT_PARTITION = "messages_default"
+LEGACY_TABLE = "messages_legacy"
+COLUMNS = "id, session_id, role, content, source, created_at"
+
+# FOR VALUES FROM ('2026-10-01 00:00:00') TO ('2026-11-01 00:00:00')
+_BOUNDS = re.compile(r"FROM \('([^']+)'\) TO \('([^']+)'\)")
+
+
+# --- Ranges ---
+def period_start(ts: datetime, interval: str = MESSAGES_PARTITION_INTERVAL) -> datetime:
+    day = datetime(ts.year, ts.month, ts.day)
+    if interval == "day":
+        return day
+    if interval == "week":
+        return day - timedelta(days=day.weekday())
+    return datetime(ts.year, ts.month, 1)
+
+
+def next_period(start: datetime, interval: str = MESSAGES_PARTITION_INTERVAL) -> datetime:
+    if interval == "day":
+        return start + timedelta(days=1)
+    if interval == "week":
+        return start + timedelta(days=7)
+    return datetime(start.year + start.month // 12, start.month % 12 + 1, 1)
+
+
+def partition_name(start: datetime) -> str:
+    return f"messages_p{start:%Y%m%d}"
+
+
+# --- Catalog ---
+def is_partitioned(conn) -> bool:
+    return bool(conn.execute(text(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('messages'))"
+    )).scalar())
+
+
+def list_partitions(conn):
+    """[(name, start, end)] of the range partitions, oldest first (the DEFAULT partition excluded)"""
+    rows = conn.execute(text("""
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'messages'::regclass
+    """)).fetchall()
+    partitions = []
+    for name, bound in rows:
+        match = _BOUNDS.search(bound)
+        if match:
+            partitions.append((name, datetime.fromisoformat(match.group(1)), datetime.fromisoformat(match.group(2))))
+    return sorted(partitions, key=lambda p: p[1])
+
+
+# --- Partition maintenance ---
+def create_partition(conn, start: datetime, end: datetime):
+    """
+    Create the partition for [start, end). Rows already caught by the DEFAULT
+    partition for that range are moved into it first, since Postgres refuses
+    to add a range the DEFAULT partition holds rows for.
+    """
+    name = partition_name(start)
+    bounds = {"start": start, "end": end}
+    stray = conn.execute(
+        text(f"SELECT EXISTS (SELECT 1 FROM {DEFAULT_PARTITION} WHERE created_at >= :start AND created_at < :end)"),
+        bounds,
+    ).scalar()
+    if not stray:
+        conn.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF messages "
+            f"FOR VALUES FROM ('{start.isoformat(' ')}') TO ('{end.isoformat(' ')}')"
+        ))
+        return
+    conn.execute(text(f"CREATE TABLE {name} (LIKE messages INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+    conn.execute(text(f"""
+        WITH moved AS (
+            DELETE FROM {DEFAULT_PARTITION} WHERE created_at >= :start AND created_at < :end RETURNING {COLUMNS}
+        )
+        INSERT INTO {name} ({COLUMNS}) SELECT {COLUMNS} FROM moved
+    """), bounds)
+    conn.execute(text(
+        f"ALTER TABLE messages ATTACH PARTITION {name} "
+        f"FOR VALUES FROM ('{start.isoformat(' ')}') TO ('{end.isoformat(' ')}')"
+    ))
+
+
+def create_partitions(conn, since: datetime = None, ahead: int = MESSAGES_PARTITIONS_AHEAD) -> int:
+    """DEFAULT partition, plus one partition per period from `since` (default: now) through `ahead` periods"""
+    conn.execute(text(f"CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} PARTITION OF messages DEFAULT"))
+    existing = [(start, end) for _, start, end in list_partitions(conn)]
+    start = period_start(since or datetime.utcnow())
+    last = period_start(datetime.utcnow())
+    for _ in range(ahead):
+        last = next_period(last)
+    created = 0
+    while start <= last:
+        end = next_period(start)
+        # Ranges made under another MESSAGES_PARTITION_INTERVAL may cover part of this one
+        if not any(s < end and start < e for s, e in existing):
+            create_partition(conn, start, end)
+            created += 1
+        start = end
+    return created
+
+
+def ensure_partitions(since: datetime = None, ahead: int = MESSAGES_PARTITIONS_AHEAD) -> int:
+    """Create missing partitions up to `ahead` periods from now; no-op unless messages is partitioned"""
+    with engine.begin() as conn:
+        if not is_partitioned(conn):
+            print("messages is not partitioned; run: python -m app.message_partitions migrate")
+            return 0
+        created = create_partitions(conn, since, ahead)
+    if created:
+        print(f"✓ Created {created} messages partition(s) ({MESSAGES_PARTITION_INTERVAL})")
+    return created
+
+
+def migrate(keep_legacy: bool = False):
+    """
+    Convert an unpartitioned messages table in place, in one transaction:
+    rename it, create the partitioned table (with ON DELETE CASCADE to
+    sessions) and partitions covering all rows, copy the rows over and drop
+    the old table. Messages of sessions that no longer exist are not copied.
+    """
+    start_time = time.perf_counter()
+    with engine.begin() as conn:
+        if is_partitioned(conn):
+            print("messages is already partitioned")
+            return
+        conn.execute(text("LOCK TABLE messages IN ACCESS EXCLUSIVE MODE"))
+        conn.execute(text(f"ALTER TABLE messages RENAME TO {LEGACY_TABLE}"))
+        # Index and constraint names are schema-wide; free them for the new table
+        conn.execute(text(f"ALTER TABLE {LEGACY_TABLE} RENAME CONSTRAINT messages_pkey TO {LEGACY_TABLE}_pkey"))
+        conn.execute(text(f"ALTER INDEX IF EXISTS ix_messages_session_id_created_at RENAME TO ix_{LEGACY_TABLE}_session_id"))
+        Message.__table__.create(conn)
+        oldest = conn.execute(text(f"SELECT min(created_at) FROM {LEGACY_TABLE}")).scalar()
+        created = create_partitions(conn, since=oldest)
+        copied = conn.execute(text(f"""
+            INSERT INTO messages ({COLUMNS})
+            SELECT id, session_id, role, content, source, coalesce(created_at, now() AT TIME ZONE 'utc')
+            FROM {LEGACY_TABLE} m
+            WHERE m.session_id IS NULL OR EXISTS (SELECT 1 FROM sessions s WHERE s.id = m.session_id)
+        """)).rowcount
+        total = conn.execute(text(f"SELECT count(*) FROM {LEGACY_TABLE}")).scalar()
+        if not keep_legacy:
+            conn.execute(text(f"DROP TABLE {LEGACY_TABLE}"))
+    print(f"✓ Partitioned messages: {copied} rows copied into {created} partitions "
+          f"({total - copied} orphaned rows skipped) in {time.perf_counter() - start_time:.1f}s"
+          + (f"; old table kept as {LEGACY_TABLE}" if keep_legacy else ""))
+
+
+# --- Retention ---
+def archive_partition(name: str, archive_dir: str) -> dict:
+    """Stream one partition to <archive_dir>/<name>.ndjson.gz (written to a temp file, then renamed)"""
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.join(archive_dir, f"{name}.ndjson.gz")
+    tmp_path = path + ".tmp"
+    rows = 0
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=ARCHIVE_BATCH_SIZE).execute(
+            text(f"SELECT {COLUMNS} FROM {name} ORDER BY session_id, created_at")
+        )
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+            for batch in result.partitions():
+                f.write("".join(
+                    json.dumps({
+                        "id": str(r[0]), "sessionId": str(r[1]), "role": r[2], "content": r[3],
+                        "source": r[4], "createdAt": r[5].isoformat() if r[5] else None,
+                    }) + "\n"
+                    for r in batch
+                ))
+                rows += len(batch)
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return {"path": path, "rows": rows, "bytes": os.path.getsize(path)}
+
+
+def run_retention(days: int = MESSAGES_RETENTION_DAYS, archive_dir: str = MESSAGES_ARCHIVE_DIR,
+                  dry_run: bool = False) -> dict:
+    """
+    Archive (unless archive_dir is None) and drop every partition entirely older
+    than `days`, then delete sessions idle since before the cutoff that have no
+    messages left. Partitions straddling the cutoff are kept whole.
+    """
+    if days <= 0:
+        raise ValueError("retention needs days > 0")
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    with engine.connect() as conn:
+        if not is_partitioned(conn):
+            raise RuntimeError("messages is not partitioned; run: python -m app.message_partitions migrate")
+        expired = [(name, start, end) for name, start, end in list_partitions(conn) if end <= cutoff]
+    report = {"cutoff": cutoff.isoformat(), "partitions": [], "sessions_deleted": 0, "dry_run": dry_run}
+    for name, start, end in expired:
+        entry = {"partition": name, "from": start.isoformat(), "to": end.isoformat()}
+        report["partitions"].append(entry)
+        if dry_run:
+            continue
+        if archive_dir:
+            entry["archive"] = archive_partition(name, archive_dir)
+        # DETACH + DROP: no per-row delete work and nothing left for vacuum
+        with engine.begin() as conn:
+            conn.execute(text(f"ALTER TABLE messages DETACH PARTITION {name}"))
+            conn.execute(text(f"DROP TABLE {name}"))
+        print(f"Dropped {name} ({start:%Y-%m-%d} to {end:%Y-%m-%d})"
+              + (f", archived {entry['archive']['rows']} rows" if archive_dir else ""))
+    if not dry_run:
+        with engine.begin() as conn:
+            report["sessions_deleted"] = conn.execute(text("""
+                DELETE FROM sessions s
+                WHERE s.last_active < :cutoff
+                  AND NOT EXISTS (SELECT 1 FROM messages m WHERE m.session_id = s.id AND m.created_at >= s.created_at)
+            """), {"cutoff": cutoff}).rowcount
+    return report
+
+
+def show():
+    with engine.connect() as conn:
+        if not is_partitioned(conn):
+            print("messages is not partitioned; run: python -m app.message_partitions migrate")
+            return
+        partitions = list_partitions(conn)
+        counts = dict(conn.execute(text(
+            "SELECT tableoid::regclass::text, count(*) FROM messages GROUP BY 1"
+        )).fetchall())
+    print(f"MESSAGES_PARTITION_INTERVAL={MESSAGES_PARTITION_INTERVAL} ahead={MESSAGES_PARTITIONS_AHEAD}")
+    for name, start, end in partitions:
+        print(f"  {name}: {start:%Y-%m-%d} to {end:%Y-%m-%d}, {counts.get(name, 0)} rows")
+    print(f"  {DEFAULT_PARTITION}: {counts.get(DEFAULT_PARTITION, 0)} rows")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage messages partitions and retention")
+    sub = parser.add_subparsers(dest="command", required=True)
+    migrate_cmd = sub.add_parser("migrate", help="convert an unpartitioned messages table")
+    migrate_cmd.add_argument("--keep-legacy", action="store_true", help=f"keep the old table as {LEGACY_TABLE}")
+    ensure = sub.add_parser("ensure", help="create missing upcoming partitions")
+    ensure.add_argument("--ahead", type=int, default=MESSAGES_PARTITIONS_AHEAD)
+    retention = sub.add_parser("retention", help="archive and drop partitions older than --days")
+    retention.add_argument("--days", type=int, default=MESSAGES_RETENTION_DAYS)
+    retention.add_argument("--archive-dir", default=MESSAGES_ARCHIVE_DIR)
+    retention.add_argument("--no-archive", dest="archive_dir", action="store_const", const=None,
+                           help="drop without archiving")
+    retention.add_argument("--dry-run", action="store_true")
+    sub.add_parser("show")
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        migrate(args.keep_legacy)
+    elif args.command == "ensure":
+        ensure_partitions(ahead=args.ahead)
+    elif args.command == "retention":
+        print(json.dumps(run_retention(args.days, args.archive_dir, args.dry_run), indent=2))
+    else:
+        show()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+# metrics.py
+"""
+Request metrics.
+
+RouteMetrics counts chat requests per route (cache, extractive, kb_only,
+llm_augmented, fallback) and keeps a bounded window of recent latencies per
+route for percentiles, exposed at GET /routes/stats.
+
+Prometheus histograms (GET /metrics):
+- chatbot_chat_seconds{route}: end-to-end chat latency
+- chatbot_stage_seconds{stage}: graph nodes (history, retrieve, evaluate,
+  extractive, kb_only, llm_augmented) and their parts (embedding, search,
+  generation, first_token, persistence)
+
+Stage timings are also collected per request (see request_context) so slow
+requests can be logged with their breakdown.
+"""
+import asyncio
+import contextvars
+import functools
+import re
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+from prometheus_client import Histogram
+
+from app.profiling import slow_request_profiler
+
+LATENCY_WINDOW = 1000
+
+# 5 ms .. 30 s: covers cached answers as well as slow Gemini calls
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+CHAT_SECONDS = Histogram("chatbot_chat_seconds", "End-to-end chat latency", ["route"], buckets=LATENCY_BUCKETS)
+STAGE_SECONDS = Histogram("chatbot_stage_seconds", "Latency of chat pipeline stages", ["stage"], buckets=LATENCY_BUCKETS)
+
+# Request id and per-stage timings of the chat request running in this context
+request_id_var = contextvars.ContextVar("request_id", default=None)
+_stage_timings = contextvars.ContextVar("stage_timings", default=None)
+
+
+def percentile(sorted_values, q: float):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+class RouteMetrics:
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self.window = window
+        self._counts = defaultdict(int)
+        self._latencies = defaultdict(lambda: deque(maxlen=self.window))
+        self._lock = threading.Lock()
+
+    def record(self, route: str, seconds: float):
+        CHAT_SECONDS.labels(route=route).observe(seconds)
+        with self._lock:
+            self._counts[route] += 1
+            self._latencies[route].append(seconds * 1000)
+
+    def stats(self) -> dict:
+        with self._lock:
+            snapshot = {route: (count, sorted(self._latencies[route])) for route, count in self._counts.items()}
+        total = sum(count for count, _ in snapshot.values())
+        return {
+            route: {
+                "count": count,
+                "share": round(count / total, 4) if total else 0.0,
+                "p50_ms": round(percentile(latencies, 0.5), 2),
+                "p95_ms": round(percentile(latencies, 0.95), 2),
+            }
+            for route, (count, latencies) in snapshot.items()
+        }
+
+
+route_metrics = RouteMetrics()
+
+
+# Client-supplied X-Request-ID values end up in logs and profile file names
+REQUEST_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex
+
+
+def request_id_from_header(value: str = None) -> str:
+    """The client's X-Request-ID if it is a safe token, else a new id"""
+    if value and REQUEST_ID_PATTERN.match(value):
+        return value
+    return new_request_id()
+
+
+def observe_stage(stage: str, seconds: float):
+    STAGE_SECONDS.labels(stage=stage).observe(seconds)
+    timings = _stage_timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def timed(stage: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
+
+
+def instrument(stage: str, fn):
+    """Wrap a (sync or async) graph node or routing function with stage timing"""
+    if asyncio.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def async_wrapper(*args, **kwargs):
+            with timed(stage):
+                return await fn(*args, **kwargs)
+        return async_wrapper
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with timed(stage):
+            return fn(*args, **kwargs)
+    return wrapper
+
+
+@contextmanager
+def request_context(request_id: str = None):
+    """
+    Binds a request id and a fresh stage-timing dict to the current context
+    (copied into to_thread workers); yields the timings dict.
+    """
+    # Explicit id, else the one bound by the HTTP middleware, else a new one
+    request_id = request_id or request_id_var.get() or new_request_id()
+    id_token = request_id_var.set(request_id)
+    timings = {}
+    timings_token = _stage_timings.set(timings)
+    try:
+        with slow_request_profiler.profile(request_id, timings):
+            yield timings
+    finally:
+        _stage_timings.reset(timings_token)
+        request_id_var.reset(id_token)
@@ -1,7 +1,13 @@
 """
 SQLAlchemy database models for Session and Message tables.
+
+On Postgres, messages is range-partitioned by created_at (see
+app/message_partitions.py), so its primary key includes created_at, and
+its session_id foreign key has ON DELETE CASCADE (existing databases get it
+from `python -m app.message_partitions migrate`; create_all doesn't alter
+existing tables, so DELETE /sessions/{id} still removes messages explicitly).
 """
-from sqlalchemy import Column, String, DateTime, ForeignKey, Text
+from sqlalchemy import Column, String, DateTime, ForeignKey, Text, Index, func, select
 import uuid
 from sqlalchemy.orm import relationship, declarative_base
 from datetime import datetime
@@ -19,7 +25,12 @@ class Session(Base):
     last_active = Column(DateTime, default=datetime.utcnow)
 
     # Relationship: one session has many messages
-    messages = relationship("Message", back_populates="session", cascade="all, delete")
+    messages = relationship(
+        "Message", back_populates="session", cascade="all, delete", order_by="Message.created_at"
+    )
+
+    # Keyset pagination on GET /sessions: ORDER BY created_at DESC, id DESC
+    __table_args__ = (Index("ix_sessions_created_at_id", "created_at", "id"),)
 
     def __repr__(self):
         return f"<Session id={self.id} user_id={self.user_id}>"
@@ -29,14 +40,31 @@ class Message(Base):
     __tablename__ = "messages"
 
     id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
-    session_id = Column(String, ForeignKey("sessions.id"))
+    session_id = Column(String, ForeignKey("sessions.id", ondelete="CASCADE"))
     role = Column(String)        # 'user' or 'assistant'
     content = Column(Text)
     source = Column(String, nullable=True)  # e.g. "Internal Docs" or "LLM"
-    created_at = Column(DateTime, default=datetime.utcnow)
+    # Partition key, so part of the primary key
+    created_at = Column(DateTime, primary_key=True, default=datetime.utcnow)
 
     # Relationship: message belongs to a session
     session = relationship("Session", back_populates="messages")
 
+    # Per-session message listing, counts and "last message" lookups (one index per partition)
+    __table_args__ = (
+        Index("ix_messages_session_id_created_at", "session_id", "created_at"),
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
+
     def __repr__(self):
-        return f"<Message id={self.id} role={self.role} session={self.session_id}>"
\ No newline at end of file
+        return f"<Message id={self.id} role={self.role} session={self.session_id}>"
+
+
+def in_session_window(session_id):
+    """
+    Message filter `created_at >= the session's created_at`: always true (a
+    session is created no later than its first message), but it lets Postgres
+    skip the partitions older than the session instead of probing all of them
+    """
+    session_start = select(Session.created_at).where(Session.id == session_id).scalar_subquery()
+    return Message.created_at >= func.coalesce(session_start, datetime(1970, 1, 1))
\ No newline at end of file
@@ -0,0 +1,212 @@
+# numpy_index.py
+"""
+In-process NumPy vector index: an alternative retrieval engine for small to
+medium knowledge bases (RETRIEVAL_ENGINE=numpy).
+
+All docs embeddings live in one contiguous float32 matrix; queries are scored
+with a matrix-vector product and the top-k picked with argpartition. The
+index refreshes itself when ingestion bumps the KB version: new rows are
+appended incrementally, deletions trigger a full reload.
+
+Collection filters select rows through a per-collection position array built
+at load time; metadata filters are checked per row, and only the selected rows
+are scored.
+
+Environment variables:
+- NUMPY_INDEX_SNAPSHOT: optional path prefix; the matrix is saved as
+  <prefix>.npy and memory-mapped on startup instead of reloaded from Postgres
+"""
+import json
+import os
+import threading
+
+import numpy as np
+
+from app.answer_cache import get_kb_version
+from app.database import get_conn
+from app.vector_index import DEFAULT_COLLECTION, VECTOR_METRIC
+
+NUMPY_INDEX_SNAPSHOT = os.getenv("NUMPY_INDEX_SNAPSHOT", "")
+
+
+def parse_vector(text: str) -> np.ndarray:
+    """pgvector text format '[x1,x2,...]' -> float32 array"""
+    return np.array(text.strip("[]").split(","), dtype=np.float32)
+
+
+def doc_collection(doc) -> str:
+    """Same default as the generated docs.collection column"""
+    return (doc.get("metadata") or {}).get("collection") or DEFAULT_COLLECTION
+
+
+def metadata_matches(metadata, filters) -> bool:
+    """Top-level containment, like jsonb @> for scalar values"""
+    metadata = metadata or {}
+    return all(metadata.get(key) == value for key, value in filters.items())
+
+
+class NumpyVectorIndex:
+    def __init__(self, metric: str = VECTOR_METRIC, snapshot: str = NUMPY_INDEX_SNAPSHOT):
+        self.metric = metric
+        self.snapshot = snapshot
+        self.ids = np.empty(0, dtype=np.int64)
+        self.matrix = np.empty((0, 0), dtype=np.float32)
+        self.norms = np.empty(0, dtype=np.float32)
+        self.docs = []  # row position -> {"id", "title", "content", "metadata"}
+        self.collection_rows = {}  # collection -> row positions
+        self._state = (self.ids, self.matrix, self.norms, self.docs, self.collection_rows)
+        self.kb_version = None
+        self._lock = threading.Lock()
+
+    # --- Loading ---
+    def _fetch(self, after_id: int = None):
+        conn = get_conn()
+        try:
+            with conn.cursor() as cur:
+                if after_id is None:
+                    cur.execute("SELECT id, title, content, metadata, embedding::text FROM docs ORDER BY id")
+                else:
+                    cur.execute(
+                        "SELECT id, title, content, metadata, embedding::text FROM docs WHERE id > %s ORDER BY id",
+                        (after_id,),
+                    )
+                rows = cur.fetchall()
+                cur.execute("SELECT count(*) FROM docs")
+                total = cur.fetchone()[0]
+        finally:
+            conn.close()
+        docs = [{"id": r[0], "title": r[1], "content": r[2], "metadata": r[3]} for r in rows]
+        matrix = np.vstack([parse_vector(r[4]) for r in rows]) if rows else None
+        return docs, matrix, total
+
+    def _install(self, docs, matrix):
+        ids = np.array([d["id"] for d in docs], dtype=np.int64)
+        if matrix is None:
+            matrix = np.empty((0, self.matrix.shape[1] if self.matrix.size else 0), dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1).astype(np.float32) if len(matrix) else np.empty(0, dtype=np.float32)
+        matrix = np.ascontiguousarray(matrix)
+        positions = {}
+        for i, doc in enumerate(docs):
+            positions.setdefault(doc_collection(doc), []).append(i)
+        collection_rows = {name: np.array(rows, dtype=np.int64) for name, rows in positions.items()}
+        # Swap everything at once so concurrent searches see a consistent index
+        self._state = (ids, matrix, norms, docs, collection_rows)
+        self.ids, self.matrix, self.norms, self.docs, self.collection_rows = self._state
+
+    def load(self):
+        """Full load from Postgres (or the snapshot when it is current)"""
+        with self._lock:
+            version = get_kb_version()
+            if self.snapshot and self._load_snapshot(version):
+                return
+            docs, matrix, _ = self._fetch()
+            self._install(docs, matrix)
+            self.kb_version = version
+            if self.snapshot:
+                self.save_snapshot()
+
+    def refresh(self):
+        """Append rows added since the last load; reload fully if rows were deleted"""
+        if get_kb_version() == self.kb_version:
+            return
+        with self._lock:
+            version = get_kb_version()
+            if version == self.kb_version:
+                return
+            after_id = int(self.ids[-1]) if len(self.ids) else 0
+            new_docs, new_matrix, total = self._fetch(after_id)
+            if len(self.docs) + len(new_docs) != total:
+                # Rows were deleted (re-ingestion of changed sources): reload everything
+                docs, matrix, _ = self._fetch()
+            else:
+                docs = self.docs + new_docs
+                matrix = self.matrix if len(self.matrix) else None
+                if new_matrix is not None:
+                    matrix = new_matrix if matrix is None else np.vstack([matrix, new_matrix])
+            self._install(docs, matrix)
+            self.kb_version = version
+            if self.snapshot:
+                self.save_snapshot()
+
+    # --- Snapshots ---
+    def save_snapshot(self):
+        np.save(f"{self.snapshot}.npy", self.matrix)
+        with open(f"{self.snapshot}.json", "w", encoding="utf-8") as f:
+            json.dump({"kb_version": self.kb_version, "docs": self.docs}, f)
+
+    def _load_snapshot(self, version) -> bool:
+        try:
+            with open(f"{self.snapshot}.json", "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta["kb_version"] != version:
+                return False
+            matrix = np.load(f"{self.snapshot}.npy", mmap_mode="r")
+        except (FileNotFoundError, ValueError, KeyError):
+            return False
+        self._install(meta["docs"], matrix)
+        self.kb_version = version
+        return True
+
+    # --- Search ---
+    def _distances(self, queries: np.ndarray, matrix: np.ndarray, norms: np.ndarray) -> np.ndarray:
+        """(n_queries, n_docs) distances matching the pgvector operator for the metric"""
+        dots = queries @ matrix.T
+        if self.metric == "ip":
+            return -dots
+        q_norms = np.linalg.norm(queries, axis=1)[:, None]
+        if self.metric == "l2":
+            sq = q_norms ** 2 - 2 * dots + (norms ** 2)[None, :]
+            return np.sqrt(np.maximum(sq, 0))
+        denom = np.maximum(q_norms * norms[None, :], 1e-12)
+        return 1 - dots / denom
+
+    def _rows(self, docs, collection_rows, collections, filters):
+        """Row positions passing the filters, or None for all rows"""
+        if not collections and not filters:
+            return None
+        if collections:
+            parts = [collection_rows[c] for c in collections if c in collection_rows]
+            rows = np.sort(np.concatenate(parts)) if parts else np.empty(0, dtype=np.int64)
+        else:
+            rows = np.arange(len(docs))
+        if filters:
+            rows = np.array([i for i in rows if metadata_matches(docs[i].get("metadata"), filters)], dtype=np.int64)
+        return rows
+
+    def search_many(self, queries, top_k: int = 3, collections=None, filters=None):
+        """Batched top-k: one list of result dicts per query vector"""
+        self.refresh()
+        ids, matrix, norms, docs, collection_rows = self._state
+        rows = self._rows(docs, collection_rows, collections, filters)
+        if rows is not None:
+            matrix, norms = matrix[rows], norms[rows]
+        if not len(matrix):
+            return [[] for _ in queries]
+        q = np.asarray(queries, dtype=np.float32).reshape(len(queries), -1)
+        dist = self._distances(q, matrix, norms)
+        k = min(top_k, dist.shape[1])
+        top = np.argpartition(dist, k - 1, axis=1)[:, :k]
+        results = []
+        for row, cand in zip(dist, top):
+            order = cand[np.argsort(row[cand])]
+            positions = rows[order] if rows is not None else order
+            results.append([{**docs[p], "distance": float(row[i])} for p, i in zip(positions, order)])
+        return results
+
+    def search(self, q_emb, top_k: int = 3, collections=None, filters=None):
+        return self.search_many([q_emb], top_k, collections, filters)[0]
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_numpy_index() -> NumpyVectorIndex:
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                index = NumpyVectorIndex()
+                index.load()
+                _index = index
+    return _index
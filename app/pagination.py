@@ -0,0 +1,27 @@
+"""
+Opaque keyset cursors for paginated endpoints.
+
+A cursor encodes the (created_at, id) of the last row of a page; the next
+page continues strictly after it in (created_at DESC, id DESC) order.
+"""
+import base64
+import json
+from datetime import datetime
+from typing import Optional, Tuple
+
+
+def encode_cursor(created_at: datetime, row_id: str) -> str:
+    raw = json.dumps([created_at.isoformat(), row_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[Tuple[datetime, str]]:
+    """Returns (created_at, id), or raises ValueError for a malformed cursor"""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, row_id = json.loads(raw)
+        return datetime.fromisoformat(created_at), str(row_id)
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
@@ -0,0 +1,304 @@
+"""
+Write-behind persistence for chat messages.
+
+save_message() enqueues a message and returns immediately; a background
+thread flushes the queue in batches (on size or time thresholds), writing
+each batch in one transaction: one `INSERT ... ON CONFLICT` upsert for all
+touched sessions, then one multi-row INSERT for the messages. The queue is
+drained on shutdown.
+
+Transient failures (connection loss, timeouts, a locked SQLite file) are
+retried with capped backoff until they succeed; records stay queued, so an
+outage delays writes but loses nothing. Any other error splits the batch
+until the offending records are isolated; only those are set aside, as one
+JSON line each in PERSIST_DEAD_LETTER_PATH, and counted as dropped. On
+shutdown, records that still can't be written go to the same file.
+
+Deleting a session calls discard(), which drops its queued records and
+makes the writer skip any in-flight ones enqueued before the delete, so a
+later flush can't re-create the session.
+
+Environment variables:
+- PERSIST_MODE: "write_behind" (default) or "sync" (write before returning)
+- PERSIST_BATCH_SIZE: messages per flush (default 100)
+- PERSIST_FLUSH_INTERVAL_MS: max time a message waits in the queue (default 200)
+- PERSIST_QUEUE_MAX: queue capacity before save_message blocks (default 10000)
+- PERSIST_DEAD_LETTER_PATH: NDJSON file for records that could not be written
+  (default message_dead_letter.ndjson)
+"""
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from sqlalchemy import case, exc
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from app.database import engine, get_async_engine
+from app.models import Session, Message
+
+PERSIST_MODE = os.getenv("PERSIST_MODE", "write_behind").lower()
+PERSIST_BATCH_SIZE = int(os.getenv("PERSIST_BATCH_SIZE", "100"))
+PERSIST_FLUSH_INTERVAL_MS = int(os.getenv("PERSIST_FLUSH_INTERVAL_MS", "200"))
+PERSIST_QUEUE_MAX = int(os.getenv("PERSIST_QUEUE_MAX", "10000"))
+PERSIST_DEAD_LETTER_PATH = os.getenv("PERSIST_DEAD_LETTER_PATH", "message_dead_letter.ndjson")
+MAX_FLUSH_BACKOFF_SECONDS = 5.0
+# Failed flush attempts tolerated while shutting down before the rest goes to the dead-letter file
+MAX_SHUTDOWN_RETRIES = 3
+
+
+def is_transient(error: Exception) -> bool:
+    """Errors worth retrying as-is: the database was unreachable or busy, not the data"""
+    return (
+        isinstance(error, (exc.OperationalError, exc.InterfaceError, exc.TimeoutError))
+        or getattr(error, "connection_invalidated", False)
+    )
+
+
+def _statements(records):
+    """Coalesced session upsert + multi-row message insert for one batch"""
+    sessions = {}
+    for r in records:
+        ts = r["created_at"]
+        first, last = sessions.get(r["session_id"], (ts, ts))
+        sessions[r["session_id"]] = (min(first, ts), max(last, ts))
+
+    session_stmt = pg_insert(Session.__table__).values([
+        {"id": sid, "created_at": first, "last_active": last} for sid, (first, last) in sessions.items()
+    ])
+    table = Session.__table__
+    excluded = session_stmt.excluded
+    # created_at stays <= every message of the session even when batches commit out of order
+    # (models.in_session_window relies on it). CASE instead of least()/greatest(), which SQLite lacks
+    session_stmt = session_stmt.on_conflict_do_update(
+        index_elements=["id"],
+        set_={
+            "created_at": case(
+                (table.c.created_at.is_(None) | (excluded.created_at < table.c.created_at), excluded.created_at),
+                else_=table.c.created_at,
+            ),
+            "last_active": case(
+                (table.c.last_active.is_(None) | (excluded.last_active > table.c.last_active), excluded.last_active),
+                else_=table.c.last_active,
+            ),
+        },
+    )
+    return session_stmt, Message.__table__.insert().values(records)
+
+
+def write_messages(records):
+    """Persist message records (dicts) in one transaction with a coalesced session upsert"""
+    if not records:
+        return
+    session_stmt, message_stmt = _statements(records)
+    with engine.begin() as conn:
+        conn.execute(session_stmt)
+        conn.execute(message_stmt)
+
+
+async def awrite_messages(records):
+    """write_messages over the async engine"""
+    if not records:
+        return
+    session_stmt, message_stmt = _statements(records)
+    async with get_async_engine().begin() as conn:
+        await conn.execute(session_stmt)
+        await conn.execute(message_stmt)
+
+
+class MessageWriter:
+    def __init__(self, mode: str = PERSIST_MODE, batch_size: int = PERSIST_BATCH_SIZE,
+                 flush_interval_ms: int = PERSIST_FLUSH_INTERVAL_MS, queue_max: int = PERSIST_QUEUE_MAX):
+        self.mode = mode
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000.0
+        self._queue = queue.Queue(maxsize=queue_max)
+        self._thread = None
+        self._stopping = threading.Event()
+        self._inflight = []  # records taken off the queue by the writer thread, not yet committed
+        self._start_lock = threading.Lock()
+        self._write_lock = threading.Lock()  # held while a batch is written; discard() waits on it
+        self._deleted = {}  # session_id -> deletion time; earlier records of the session are skipped
+        self.dead_letter_path = PERSIST_DEAD_LETTER_PATH
+        self.flushed = 0
+        self.batches = 0
+        self.failures = 0
+        self.dropped = 0
+
+    @staticmethod
+    def make_record(session_id, role, content, source=None) -> dict:
+        return {
+            "id": str(uuid.uuid4()),
+            "session_id": session_id,
+            "role": role,
+            "content": content,
+            "source": source,
+            # Stamped at enqueue time so ordering survives batching
+            "created_at": datetime.utcnow(),
+        }
+
+    def save(self, session_id, role, content, source=None) -> str:
+        record = self.make_record(session_id, role, content, source)
+        if self.mode == "sync":
+            write_messages([record])
+        else:
+            self._ensure_started()
+            self._queue.put(record)
+        return record["id"]
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._stopping.clear()
+                    self._thread = threading.Thread(target=self._run, name="message-writer", daemon=True)
+                    self._thread.start()
+
+    def pending(self, session_id) -> list:
+        """Records of a session that are queued or being flushed, i.e. not yet readable from the DB"""
+        # Queue before in-flight: a record moving between them is seen twice (callers dedupe by id), never missed
+        with self._queue.mutex:
+            queued = [r for r in self._queue.queue if r["session_id"] == session_id]
+        inflight = list(self._inflight)
+        records = [r for r in inflight if r["session_id"] == session_id] + queued
+        return [r for r in records if not self._is_deleted(r)]
+
+    def discard(self, session_id):
+        """
+        Forget the records of a session that is being deleted: queued ones are
+        removed, in-flight ones enqueued before now are skipped. Waits for a
+        batch being written so none of them commit after the caller's DELETE.
+        """
+        with self._write_lock:
+            self._deleted[session_id] = datetime.utcnow()
+            with self._queue.mutex:
+                kept = [r for r in self._queue.queue if r["session_id"] != session_id]
+                if len(kept) < len(self._queue.queue):
+                    self._queue.queue.clear()
+                    self._queue.queue.extend(kept)
+                    self._queue.not_full.notify_all()
+
+    def _is_deleted(self, record) -> bool:
+        deleted_at = self._deleted.get(record["session_id"])
+        return deleted_at is not None and record["created_at"] <= deleted_at
+
+    def _forget_deletions(self, pending):
+        """Drop deletion marks older than every record still queued or in flight (call with _write_lock held)"""
+        with self._queue.mutex:
+            held = [r["created_at"] for r in pending] + [r["created_at"] for r in self._queue.queue]
+        if not held:
+            self._deleted.clear()
+            return
+        oldest = min(held)
+        self._deleted = {sid: at for sid, at in self._deleted.items() if at >= oldest}
+
+    def _run(self):
+        pending = self._inflight = []
+        retries = 0
+        while True:
+            deadline = time.monotonic() + self.flush_interval
+            while len(pending) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    pending.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            if pending:
+                settled = set()
+                try:
+                    with self._write_lock:
+                        live = [r for r in pending if not self._is_deleted(r)]
+                        settled.update(r["id"] for r in pending if self._is_deleted(r))
+                        if live:
+                            self._write(live, settled)
+                        if self._deleted:
+                            self._forget_deletions([r for r in pending if r["id"] not in settled])
+                    retries = 0
+                except Exception as e:
+                    self.failures += 1
+                    retries += 1
+                    print(f"Error flushing {len(pending) - len(settled)} messages (attempt {retries}): {str(e)}")
+                    if self._stopping.is_set() and retries >= MAX_SHUTDOWN_RETRIES:
+                        remaining = [r for r in pending if r["id"] not in settled]
+                        settled.update(r["id"] for r in remaining)
+                        self._dead_letter(remaining + self._drain_queue(), e)
+                    else:
+                        time.sleep(min(0.1 * 2 ** min(retries, 10), MAX_FLUSH_BACKOFF_SECONDS))
+                # In place: pending() reads this list from other threads
+                pending[:] = [r for r in pending if r["id"] not in settled]
+            if self._stopping.is_set() and not pending and self._queue.empty():
+                return
+
+    def _write(self, records, settled):
+        """
+        Write records, adding the ids of those written or set aside to `settled`.
+        A non-transient error splits the batch so only the offending records are
+        dead-lettered; transient errors propagate for the caller to retry.
+        """
+        try:
+            write_messages(records)
+        except Exception as e:
+            if is_transient(e):
+                raise
+            if len(records) == 1:
+                self._dead_letter(records, e)
+            else:
+                middle = len(records) // 2
+                self._write(records[:middle], settled)
+                self._write(records[middle:], settled)
+                return
+        else:
+            self.flushed += len(records)
+            self.batches += 1
+        settled.update(r["id"] for r in records)
+
+    def _drain_queue(self) -> list:
+        records = []
+        while True:
+            try:
+                records.append(self._queue.get_nowait())
+            except queue.Empty:
+                return records
+
+    def _dead_letter(self, records, error):
+        """Append records that could not be written to the dead-letter file (one JSON object per line)"""
+        if not records:
+            return
+        self.dropped += len(records)
+        print(f"Setting aside {len(records)} messages in {self.dead_letter_path}: {str(error)}")
+        try:
+            with open(self.dead_letter_path, "a", encoding="utf-8") as f:
+                for r in records:
+                    f.write(json.dumps({**r, "created_at": r["created_at"].isoformat(), "error": str(error)}) + "\n")
+        except OSError as e:
+            print(f"Could not write dead-letter file {self.dead_letter_path}, {len(records)} messages lost: {str(e)}")
+
+    def flush(self, timeout: float = 10.0):
+        """Stop the writer thread after draining everything queued so far"""
+        with self._start_lock:
+            thread = self._thread
+            if thread is None:
+                return
+            self._stopping.set()
+            thread.join(timeout)
+            self._thread = None
+
+    def stats(self) -> dict:
+        return {
+            "mode": self.mode,
+            "queued": self._queue.qsize(),
+            "flushed": self.flushed,
+            "batches": self.batches,
+            "failures": self.failures,
+            "dropped": self.dropped,
+        }
+
+
+message_writer = MessageWriter()
+atexit.register(message_writer.flush)
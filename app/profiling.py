@@ -0,0 +1,122 @@
+# profiling.py
+"""
+Opt-in sampling profiler for slow chat requests.
+
+With PROFILE_SLOW_MS > 0, a background thread samples the stack of every
+thread currently serving a chat request each PROFILE_SAMPLE_INTERVAL_MS.
+Requests that take longer than PROFILE_SLOW_MS are logged with their stage
+timings, and their samples are written in collapsed-stack format
+("frame;frame;frame count" lines, readable by flamegraph.pl / speedscope) to
+PROFILE_DIR/<request_id>.folded. Fast requests discard their samples.
+
+Samples are taken per thread: for async handlers the event loop thread is
+shared by concurrent requests, so their profiles include each other's work.
+
+Extra hooks can be registered with slow_request_profiler.add_hook(fn); each
+is called as fn(request_id, elapsed_seconds, stage_timings, stacks).
+"""
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "0"))
+PROFILE_SAMPLE_INTERVAL_MS = float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", "5"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+MAX_STACK_DEPTH = 64
+_UNSAFE_FILENAME_CHARS = re.compile(r"[^A-Za-z0-9_-]")
+
+
+def collapse_stack(frame) -> str:
+    names = []
+    while frame is not None and len(names) < MAX_STACK_DEPTH:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class SlowRequestProfiler:
+    def __init__(self, slow_ms: float = PROFILE_SLOW_MS, interval_ms: float = PROFILE_SAMPLE_INTERVAL_MS,
+                 output_dir: str = PROFILE_DIR):
+        self.slow_ms = slow_ms
+        self.interval = interval_ms / 1000.0
+        self.output_dir = output_dir
+        self.hooks = [self.write_profile]
+        # Keyed by a per-request token: request ids come from clients and need not be unique
+        self._active = {}  # token -> (thread id, Counter of collapsed stacks)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.slow_ms > 0
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._sample_loop, name="slow-request-profiler", daemon=True)
+                self._thread.start()
+
+    def _sample_loop(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                active = list(self._active.values())
+            if not active:
+                continue
+            frames = sys._current_frames()
+            for thread_id, stacks in active:
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    stacks[collapse_stack(frame)] += 1
+
+    def profile(self, request_id: str, timings: dict):
+        if not self.enabled:
+            return nullcontext()
+        return self._profile(request_id, timings)
+
+    @contextmanager
+    def _profile(self, request_id, timings):
+        self._ensure_started()
+        stacks = Counter()
+        token = object()
+        with self._lock:
+            self._active[token] = (threading.get_ident(), stacks)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self._active.pop(token, None)
+            if elapsed * 1000 >= self.slow_ms:
+                for hook in self.hooks:
+                    try:
+                        hook(request_id, elapsed, dict(timings), stacks)
+                    except Exception as e:
+                        print(f"Slow request hook failed: {str(e)}")
+
+    def write_profile(self, request_id, elapsed, timings, stacks):
+        breakdown = ", ".join(f"{stage}={seconds * 1000:.0f}ms" for stage, seconds in timings.items())
+        print(f"Slow request {request_id}: {elapsed * 1000:.0f}ms ({breakdown})")
+        if not stacks:
+            return
+        os.makedirs(self.output_dir, exist_ok=True)
+        name = _UNSAFE_FILENAME_CHARS.sub("_", str(request_id))[:64] or "request"
+        output_dir = os.path.realpath(self.output_dir)
+        path = os.path.realpath(os.path.join(output_dir, f"{name}.folded"))
+        if os.path.dirname(path) != output_dir:
+            raise ValueError(f"Profile path escapes {self.output_dir}: {path}")
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+slow_request_profiler = SlowRequestProfiler()
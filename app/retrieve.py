@@ -1,44 +1,361 @@
 # retrieve.py
-from app.db import get_conn
-import google.generativeai as genai
+import asyncio
+import json
 import os
-from dotenv import load_dotenv
+import re
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import text
+from app.database import get_conn, get_async_engine
+from app.embeddings import embed_text as _embed, embed_texts, QUERY_TASK
+from app.singleflight import SingleFlight
+from app.metrics import timed
+from app.vector_index import (
+    DISTANCE_OPERATOR, EMBEDDING_TYPE, INDEX_EXPRESSION, RERANK_CANDIDATES, TEXT_SEARCH_CONFIG, VECTOR_STORAGE,
+    apply_search_settings, search_settings, vector_literal,
+)
 
-load_dotenv()
-GOOGLE_GEN_AI_API_KEY = os.getenv("GOOGLE_GENERATIVE_AI_API_KEY") or os.getenv("GOOGLE_API_KEY")
-if not GOOGLE_GEN_AI_API_KEY:
-    raise RuntimeError("GOOGLE_GENERATIVE_AI_API_KEY or GOOGLE_API_KEY not set in .env")
+# "pgvector" (default) or "numpy" (in-process index, see app/numpy_index.py)
+RETRIEVAL_ENGINE = os.getenv("RETRIEVAL_ENGINE", "pgvector").lower()
+# "vector" (default) or "hybrid" (vector + Postgres full-text, fused with reciprocal rank fusion)
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "vector").lower()
+RRF_K = int(os.getenv("RRF_K", "60"))
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "20"))
+# Queries per embedding call / multi-query search round-trip in retrieve_many()
+BATCH_SEARCH_SIZE = int(os.getenv("BATCH_SEARCH_SIZE", "100"))
 
-genai.configure(api_key=GOOGLE_GEN_AI_API_KEY)
+# ORDER BY must use the same operator as the index's operator class.
+# {where} / {and_where} take the optional collection and metadata filters (see filter_clauses)
+SEARCH_SQL = f"""
+    SELECT id, title, content, metadata, embedding {DISTANCE_OPERATOR} %(q)s::{EMBEDDING_TYPE} AS distance
+    FROM docs
+    {{where}}
+    ORDER BY embedding {DISTANCE_OPERATOR} %(q)s::{EMBEDDING_TYPE}
+    LIMIT %(k)s
+"""
 
-def embed_text(text: str):
-    """Generate embedding using Google's text-embedding-004 model"""
-    result = genai.embed_content(
-        model="models/text-embedding-004",
-        content=text,
-        task_type="retrieval_query"  # Use "retrieval_document" for documents
-    )
-    return result["embedding"]
+# VECTOR_STORAGE=binary: the bit index orders %(candidates)s rows by Hamming distance,
+# which are then re-ranked by the exact distance against the float32 column
+RERANK_SEARCH_SQL = f"""
+    SELECT id, title, content, metadata, embedding {DISTANCE_OPERATOR} %(q)s::vector AS distance
+    FROM (
+        SELECT id, title, content, metadata, embedding
+        FROM docs
+        {{where}}
+        ORDER BY {INDEX_EXPRESSION} <~> binary_quantize(%(q)s::vector)
+        LIMIT %(candidates)s
+    ) candidates
+    ORDER BY distance
+    LIMIT %(k)s
+"""
 
-def retrieve(query: str, top_k: int = 3):
-    q_emb = embed_text(query)
-    conn = get_conn()
-    with conn.cursor() as cur:
-        cur.execute("""
-            SELECT id, title, content, metadata, embedding <-> %s::vector AS distance
+# Many queries in one round-trip: one LATERAL index scan per query vector (ord = 1-based position)
+MULTI_SEARCH_SQL = f"""
+    SELECT q.ord, d.id, d.title, d.content, d.metadata, d.distance
+    FROM unnest(CAST(%(qs)s AS {EMBEDDING_TYPE}[])) WITH ORDINALITY AS q(embedding, ord)
+    CROSS JOIN LATERAL (
+        SELECT id, title, content, metadata, docs.embedding {DISTANCE_OPERATOR} q.embedding AS distance
+        FROM docs
+        {{where}}
+        ORDER BY docs.embedding {DISTANCE_OPERATOR} q.embedding
+        LIMIT %(k)s
+    ) d
+    ORDER BY q.ord, d.distance
+"""
+
+MULTI_RERANK_SEARCH_SQL = f"""
+    SELECT q.ord, d.id, d.title, d.content, d.metadata, d.distance
+    FROM unnest(CAST(%(qs)s AS vector[])) WITH ORDINALITY AS q(embedding, ord)
+    CROSS JOIN LATERAL (
+        SELECT id, title, content, metadata, c.embedding {DISTANCE_OPERATOR} q.embedding AS distance
+        FROM (
+            SELECT id, title, content, metadata, docs.embedding
             FROM docs
-            ORDER BY embedding <-> %s::vector
-            LIMIT %s;
-        """, (q_emb, q_emb, top_k))
-        rows = cur.fetchall()
-    conn.close()
+            {{where}}
+            ORDER BY {INDEX_EXPRESSION} <~> binary_quantize(q.embedding)
+            LIMIT %(candidates)s
+        ) c
+        ORDER BY distance
+        LIMIT %(k)s
+    ) d
+    ORDER BY q.ord, d.distance
+"""
+
+# Candidates match ANY query term (GIN-assisted); all_terms flags docs matching every term,
+# which is what makes exact product names, error codes and SKUs trustworthy hits.
+LEXICAL_SQL = f"""
+    WITH tsq AS (
+        SELECT CAST(replace(CAST(plainto_tsquery(CAST(%(cfg)s AS regconfig), %(text)s) AS text), '&', '|') AS tsquery) AS any_terms,
+               websearch_to_tsquery(CAST(%(cfg)s AS regconfig), %(text)s) AS all_terms
+    )
+    SELECT id, title, content, metadata, embedding {DISTANCE_OPERATOR} %(q)s::{EMBEDDING_TYPE} AS distance,
+           content_tsv @@ tsq.all_terms AS all_terms
+    FROM docs, tsq
+    WHERE content_tsv @@ tsq.any_terms{{and_where}}
+    ORDER BY ts_rank_cd(content_tsv, tsq.any_terms) DESC
+    LIMIT %(k)s
+"""
+
+
+def filter_clauses(collections=None, filters=None):
+    """
+    SQL conditions and params restricting a search to collections and to docs whose
+    metadata contains `filters` (psycopg2 placeholders)
+    """
+    clauses, params = [], {}
+    if collections:
+        if len(collections) == 1:
+            # Plain equality, so a partial vector index for the collection can be used
+            clauses.append("collection = %(collection)s")
+            params["collection"] = collections[0]
+        else:
+            clauses.append("collection = ANY(%(collections)s)")
+            params["collections"] = list(collections)
+    if filters:
+        # jsonb containment is served by the GIN (jsonb_path_ops) index on metadata
+        clauses.append("metadata @> %(filters)s::jsonb")
+        params["filters"] = json.dumps(filters)
+    return clauses, params
+
+
+def search_sql(collections=None, filters=None, rerank: bool = VECTOR_STORAGE == "binary"):
+    """Vector search SQL; rerank=False orders by the distance directly (exact with index scans off)"""
+    clauses, params = filter_clauses(collections, filters)
+    sql = RERANK_SEARCH_SQL if rerank else SEARCH_SQL
+    return sql.format(where="WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+
+def multi_search_sql(collections=None, filters=None):
+    clauses, params = filter_clauses(collections, filters)
+    sql = MULTI_RERANK_SEARCH_SQL if VECTOR_STORAGE == "binary" else MULTI_SEARCH_SQL
+    return sql.format(where="WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+
+def rerank_candidates(top_k: int) -> int:
+    """Hamming-ordered rows fetched per query before exact re-ranking (binary storage)"""
+    return max(RERANK_CANDIDATES, top_k)
+
+
+def lexical_sql(collections=None, filters=None):
+    clauses, params = filter_clauses(collections, filters)
+    return LEXICAL_SQL.format(and_where="".join(" AND " + c for c in clauses)), params
+
+
+def async_sql(sql: str) -> str:
+    """psycopg2 placeholders -> SQLAlchemy text() binds (asyncpg): %(x)s::t -> CAST(:x AS t), %(x)s -> :x"""
+    sql = re.sub(r"%\((\w+)\)s::(\w+)", r"CAST(:\1 AS \2)", sql)
+    return re.sub(r"%\((\w+)\)s", r":\1", sql)
+
+
+def retrieval_scope(collections=None, filters=None):
+    """Hashable identity of the filters (None when unfiltered), for coalescing and answer caching"""
+    if not collections and not filters:
+        return None
+    return json.dumps({"collections": sorted(collections or []), "filters": filters or {}}, sort_keys=True)
+
+
+# Lexical queries run next to the vector query on a second pooled connection
+_lexical_pool = ThreadPoolExecutor(max_workers=int(os.getenv("HYBRID_WORKERS", "8")))
+# Identical concurrent searches run once; callers share the (read-only) result list
+_retrieval_flight = SingleFlight("retrieval")
+
+
+def embed_text(text: str):
+    """Embed a query with the configured provider (cached on disk)"""
+    return _embed(text, task_type=QUERY_TASK)
+
+
+async def aembed_text(text: str):
+    """Async variant: runs the (usually cached) embedding off the event loop"""
+    return await asyncio.to_thread(embed_text, text)
+
+
+def _to_results(rows):
     results = []
     for r in rows:
-        results.append({
+        metadata = r[3]
+        if isinstance(metadata, str):
+            # asyncpg returns jsonb as text
+            metadata = json.loads(metadata)
+        result = {
             "id": r[0],
             "title": r[1],
             "content": r[2],
-            "metadata": r[3],
+            "metadata": metadata,
             "distance": float(r[4])
-        })
+        }
+        if len(r) > 5:
+            result["all_terms"] = bool(r[5])
+        results.append(result)
     return results
+
+
+def search_vector(q_emb, top_k: int = 3, probes: int = None, ef_search: int = None,
+                  collections=None, filters=None):
+    """Top-k docs for an embedding, using the configured metric so the vector index applies"""
+    sql, params = search_sql(collections, filters)
+    conn = get_conn()
+    try:
+        with conn.cursor() as cur:
+            apply_search_settings(cur, probes, ef_search)
+            cur.execute(sql, {**params, "q": vector_literal(q_emb), "k": top_k,
+                              "candidates": rerank_candidates(top_k)})
+            rows = cur.fetchall()
+    finally:
+        # Returns the connection to the pool
+        conn.close()
+    return _to_results(rows)
+
+
+def search_numpy(q_emb, top_k: int = 3, collections=None, filters=None):
+    from app.numpy_index import get_numpy_index
+    return get_numpy_index().search(q_emb, top_k, collections, filters)
+
+
+def search_vector_many(q_embs, top_k: int = 3, probes: int = None, ef_search: int = None,
+                       collections=None, filters=None):
+    """search_vector() for many embeddings in one SQL round-trip; one result list per embedding"""
+    sql, params = multi_search_sql(collections, filters)
+    conn = get_conn()
+    try:
+        with conn.cursor() as cur:
+            apply_search_settings(cur, probes, ef_search)
+            cur.execute(sql, {**params, "qs": [vector_literal(q) for q in q_embs], "k": top_k,
+                              "candidates": rerank_candidates(top_k)})
+            rows = cur.fetchall()
+    finally:
+        conn.close()
+    results = [[] for _ in q_embs]
+    for row in rows:
+        results[row[0] - 1].extend(_to_results([row[1:]]))
+    return results
+
+
+def search_lexical(query: str, q_emb, top_k: int = HYBRID_CANDIDATES, collections=None, filters=None):
+    """Full-text candidates over docs.content_tsv (GIN), with their vector distance"""
+    sql, params = lexical_sql(collections, filters)
+    conn = get_conn()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(sql, {**params, "cfg": TEXT_SEARCH_CONFIG, "text": query, "q": vector_literal(q_emb), "k": top_k})
+            rows = cur.fetchall()
+    finally:
+        conn.close()
+    return _to_results(rows)
+
+
+def _search_vector_engine(q_emb, top_k, probes=None, ef_search=None, collections=None, filters=None):
+    if RETRIEVAL_ENGINE == "numpy":
+        return search_numpy(q_emb, top_k, collections, filters)
+    return search_vector(q_emb, top_k, probes, ef_search, collections, filters)
+
+
+def rrf_fuse(vector_results, lexical_results, top_k: int = 3, k: int = RRF_K):
+    """
+    Reciprocal rank fusion: score = sum(1 / (k + rank)) over both lists.
+    Each doc keeps its vector `distance`; `lexical_rank` is set for full-text hits.
+    """
+    fused = {}
+    for rank, doc in enumerate(vector_results, start=1):
+        fused[doc["id"]] = {**doc, "rrf_score": 1.0 / (k + rank), "lexical_rank": None}
+    for rank, doc in enumerate(lexical_results, start=1):
+        entry = fused.setdefault(doc["id"], {**doc, "rrf_score": 0.0})
+        entry["rrf_score"] += 1.0 / (k + rank)
+        entry["lexical_rank"] = rank
+        entry["all_terms"] = doc.get("all_terms", False)
+    return sorted(fused.values(), key=lambda d: d["rrf_score"], reverse=True)[:top_k]
+
+
+def hybrid_search(query: str, q_emb, top_k: int = 3, probes: int = None, ef_search: int = None,
+                  collections=None, filters=None):
+    candidates = max(HYBRID_CANDIDATES, top_k)
+    lexical = _lexical_pool.submit(search_lexical, query, q_emb, candidates, collections, filters)
+    vector_results = _search_vector_engine(q_emb, candidates, probes, ef_search, collections, filters)
+    return rrf_fuse(vector_results, lexical.result(), top_k)
+
+
+def retrieve(query: str, top_k: int = 3, probes: int = None, ef_search: int = None,
+             collections=None, filters=None):
+    """
+    Top-k docs for a query, optionally restricted to `collections` (docs.collection)
+    and to docs whose metadata contains every key/value of `filters`
+    """
+    key = (query, top_k, probes, ef_search, retrieval_scope(collections, filters))
+    return _retrieval_flight.do(key, _retrieve, query, top_k, probes, ef_search, collections, filters)
+
+
+def _retrieve(query, top_k, probes, ef_search, collections, filters):
+    with timed("embedding"):
+        q_emb = embed_text(query)
+    with timed("search"):
+        if RETRIEVAL_MODE == "hybrid":
+            return hybrid_search(query, q_emb, top_k, probes, ef_search, collections, filters)
+        return _search_vector_engine(q_emb, top_k, probes, ef_search, collections, filters)
+
+
+def retrieve_many(queries, top_k: int = 3, collections=None, filters=None, batch_size: int = BATCH_SEARCH_SIZE):
+    """
+    retrieve() for many queries: batched embedding calls, then one multi-query SQL
+    round-trip (or NumPy matrix top-k) per batch. Returns one result list per query.
+    """
+    results = []
+    for i in range(0, len(queries), batch_size):
+        batch = list(queries[i:i + batch_size])
+        with timed("embedding"):
+            q_embs = embed_texts(batch, QUERY_TASK)
+        with timed("search"):
+            candidates = max(HYBRID_CANDIDATES, top_k) if RETRIEVAL_MODE == "hybrid" else top_k
+            if RETRIEVAL_ENGINE == "numpy":
+                from app.numpy_index import get_numpy_index
+                vector_results = get_numpy_index().search_many(q_embs, candidates, collections, filters)
+            else:
+                vector_results = search_vector_many(q_embs, candidates, collections=collections, filters=filters)
+            if RETRIEVAL_MODE == "hybrid":
+                lexical = [_lexical_pool.submit(search_lexical, q, e, candidates, collections, filters)
+                           for q, e in zip(batch, q_embs)]
+                vector_results = [rrf_fuse(v, f.result(), top_k) for v, f in zip(vector_results, lexical)]
+        results.extend(vector_results)
+    return results
+
+
+async def _asearch_vector(q_emb, top_k, collections=None, filters=None):
+    if RETRIEVAL_ENGINE == "numpy":
+        return await asyncio.to_thread(search_numpy, q_emb, top_k, collections, filters)
+    sql, params = search_sql(collections, filters)
+    async with get_async_engine().connect() as conn:
+        for statement in search_settings():
+            await conn.execute(text(statement))
+        result = await conn.execute(text(async_sql(sql)), {**params, "q": vector_literal(q_emb), "k": top_k,
+                                                           "candidates": rerank_candidates(top_k)})
+        rows = result.fetchall()
+    return _to_results(rows)
+
+
+async def _asearch_lexical(query, q_emb, top_k, collections=None, filters=None):
+    sql, params = lexical_sql(collections, filters)
+    async with get_async_engine().connect() as conn:
+        result = await conn.execute(
+            text(async_sql(sql)),
+            {**params, "cfg": TEXT_SEARCH_CONFIG, "text": query, "q": vector_literal(q_emb), "k": top_k},
+        )
+        rows = result.fetchall()
+    return _to_results(rows)
+
+
+async def aretrieve(query: str, top_k: int = 3, collections=None, filters=None):
+    """Async retrieve() over the SQLAlchemy async engine (asyncpg)"""
+    key = (query, top_k, retrieval_scope(collections, filters))
+    return await _retrieval_flight.ado(key, _aretrieve, query, top_k, collections, filters)
+
+
+async def _aretrieve(query, top_k, collections, filters):
+    with timed("embedding"):
+        q_emb = await aembed_text(query)
+    with timed("search"):
+        if RETRIEVAL_MODE == "hybrid":
+            candidates = max(HYBRID_CANDIDATES, top_k)
+            vector_results, lexical_results = await asyncio.gather(
+                _asearch_vector(q_emb, candidates, collections, filters),
+                _asearch_lexical(query, q_emb, candidates, collections, filters),
+            )
+            return rrf_fuse(vector_results, lexical_results, top_k)
+        return await _asearch_vector(q_emb, top_k, collections, filters)
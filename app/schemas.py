@@ -3,7 +3,7 @@ Pydantic schemas for requests and responses.
 """
 
 from pydantic import BaseModel
-from typing import Optional, List
+from typing import Optional, List, Dict, Any
 from datetime import datetime
 
 # ---------- Chat ----------
@@ -11,6 +11,20 @@ class ChatRequest(BaseModel):
     session_id: Optional[str] = None
     message: str
     enable_llm: bool = False 
+    # Retrieval scope: only these collections, and only docs whose metadata contains every filters key/value
+    collections: Optional[List[str]] = None
+    filters: Optional[Dict[str, Any]] = None
+
+
+class BatchChatRequest(BaseModel):
+    questions: List[str]
+    enable_llm: bool = False
+    collections: Optional[List[str]] = None
+    filters: Optional[Dict[str, Any]] = None
+    # False skips saving questions and answers (evaluation runs)
+    persist: bool = True
+    session_id: Optional[str] = None
+    concurrency: Optional[int] = None
 
 
 class ChatResponse(BaseModel):
@@ -44,5 +58,21 @@ class SessionResponse(BaseModel):
         from_attributes = True
 
 
+class LastMessageSummary(BaseModel):
+    id: str
+    role: str
+    source: Optional[str]
+    createdAt: datetime
+
+
+class SessionSummaryResponse(BaseModel):
+    id: str
+    userId: Optional[str]
+    createdAt: datetime
+    lastActive: datetime
+    messageCount: int
+    lastMessage: Optional[LastMessageSummary] = None
+
+
 class SessionCreateRequest(BaseModel):
     sessionId: Optional[str] = None
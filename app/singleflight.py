@@ -0,0 +1,106 @@
+# singleflight.py
+"""
+Request coalescing: concurrent calls with the same key share one in-flight
+computation, and every caller receives its result (or its exception).
+
+Used at the embedding, retrieval and generation stages so a spike of
+identical questions costs one embedding, one vector search and one Gemini
+call. Results are shared objects; callers must treat them as read-only.
+Per-stage counters are exposed at GET /health.
+"""
+import asyncio
+import os
+import threading
+
+SINGLEFLIGHT_ENABLED = os.getenv("SINGLEFLIGHT_ENABLED", "1") == "1"
+
+_groups = {}
+
+
+class _Call:
+    __slots__ = ("event", "result", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self, name: str, enabled: bool = SINGLEFLIGHT_ENABLED):
+        self.name = name
+        self.enabled = enabled
+        self._calls = {}
+        self._futures = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.collapsed = 0
+        _groups[name] = self
+
+    def do(self, key, fn, *args, **kwargs):
+        """Run fn once per key among concurrent (threaded) callers"""
+        if not self.enabled:
+            return fn(*args, **kwargs)
+        with self._lock:
+            self.calls += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.collapsed += 1
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+    async def ado(self, key, fn, *args, **kwargs):
+        """do() for coroutine functions, shared within the event loop"""
+        if not self.enabled:
+            return await fn(*args, **kwargs)
+        self.calls += 1
+        future = self._futures.get(key)
+        if future is not None:
+            self.collapsed += 1
+            # shield: a cancelled follower must not cancel the leader's work
+            return await asyncio.shield(future)
+
+        future = self._futures[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await fn(*args, **kwargs)
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Mark retrieved so a leader without followers doesn't log "never retrieved"
+            future.exception()
+            raise
+        finally:
+            del self._futures[key]
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "collapsed": self.collapsed,
+            "in_flight": len(self._calls) + len(self._futures),
+        }
+
+
+def singleflight_stats() -> dict:
+    return {name: group.stats() for name, group in _groups.items()}
@@ -0,0 +1,378 @@
+# vector_index.py
+"""
+Distance metric and pgvector index management for the `docs` table.
+
+The same metric drives the SQL operator in retrieve(), the routing threshold
+in evaluate_node and the operator class of the index, so pgvector can always
+use the index for ORDER BY ... LIMIT queries.
+
+Environment variables:
+- VECTOR_METRIC: "cosine" (default), "l2" or "ip" (negative inner product)
+- DISTANCE_THRESHOLD: best_distance below which the KB is trusted
+  (default depends on the metric, 0.35 for cosine)
+- IVFFLAT_PROBES: lists probed per query on an ivfflat index (default 10)
+- HNSW_EF_SEARCH: candidate list size per query on an hnsw index (default 40)
+- TEXT_SEARCH_CONFIG: Postgres text search configuration for hybrid retrieval (default english)
+- VECTOR_ITERATIVE_SCAN: pgvector >= 0.8 iterative index scans ("relaxed_order"
+  or "strict_order", default off), so filtered queries keep scanning the
+  index until top_k matching rows are found
+- VECTOR_STORAGE: "vector" (default, float32), "halfvec" (docs.embedding stored
+  as float16: half the table and index size) or "binary" (float32 column, but
+  the index is over binary_quantize(embedding)::bit(dim), 32x smaller)
+- RERANK_CANDIDATES: binary mode only; rows pre-selected by Hamming distance per
+  query, then re-ranked by the exact metric distance (default 100)
+
+Storage: in binary mode the Hamming distance only picks candidates; every
+returned `distance` is still the exact metric distance against the float32
+column, so DISTANCE_THRESHOLD keeps its meaning. halfvec distances differ from
+float32 ones by about 1e-3. Existing rows are migrated in place with
+`set-storage`, which converts the column and rebuilds the index.
+
+Filtering: docs.collection is generated from metadata->>'collection' and
+btree-indexed, metadata has a GIN (jsonb_path_ops) index for containment
+filters, and a collection can get its own partial vector index so queries
+restricted to it never scan (or post-filter) other collections' vectors.
+
+Usage:
+    python -m app.vector_index show
+    python -m app.vector_index create --type hnsw --m 16 --ef-construction 64
+    python -m app.vector_index create --type ivfflat --lists 100
+    python -m app.vector_index rebuild
+    python -m app.vector_index drop
+    python -m app.vector_index create-fts    # tsvector column + GIN index for RETRIEVAL_MODE=hybrid
+    python -m app.vector_index create-filters                 # collection column + metadata GIN index
+    python -m app.vector_index create --collection billing    # partial vector index for one collection
+    python -m app.vector_index drop --collection billing
+    python -m app.vector_index set-storage halfvec            # convert existing rows, rebuild the index
+"""
+import argparse
+import hashlib
+import os
+import re
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+from app.database import get_conn
+from app.embeddings import EMBEDDING_DIM
+
+# metric -> (SQL operator, operator class, default routing threshold)
+METRICS = {
+    "cosine": ("<=>", "vector_cosine_ops", 0.35),
+    "l2": ("<->", "vector_l2_ops", 0.35),
+    # <#> returns the negative inner product; -0.65 matches cosine 0.35 on unit vectors
+    "ip": ("<#>", "vector_ip_ops", -0.65),
+}
+
+VECTOR_METRIC = os.getenv("VECTOR_METRIC", "cosine").lower()
+if VECTOR_METRIC not in METRICS:
+    raise ValueError(f"Unknown VECTOR_METRIC: {VECTOR_METRIC} (expected one of {', '.join(METRICS)})")
+
+DISTANCE_OPERATOR, OPERATOR_CLASS, _DEFAULT_THRESHOLD = METRICS[VECTOR_METRIC]
+DISTANCE_THRESHOLD = float(os.getenv("DISTANCE_THRESHOLD", str(_DEFAULT_THRESHOLD)))
+IVFFLAT_PROBES = int(os.getenv("IVFFLAT_PROBES", "10"))
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "40"))
+VECTOR_ITERATIVE_SCAN = os.getenv("VECTOR_ITERATIVE_SCAN", "off").lower()
+if VECTOR_ITERATIVE_SCAN not in ("off", "relaxed_order", "strict_order"):
+    raise ValueError(f"Invalid VECTOR_ITERATIVE_SCAN: {VECTOR_ITERATIVE_SCAN}")
+
+STORAGE_MODES = ("vector", "halfvec", "binary")
+VECTOR_STORAGE = os.getenv("VECTOR_STORAGE", "vector").lower()
+if VECTOR_STORAGE not in STORAGE_MODES:
+    raise ValueError(f"Unknown VECTOR_STORAGE: {VECTOR_STORAGE} (expected one of {', '.join(STORAGE_MODES)})")
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "100"))
+
+TEXT_SEARCH_CONFIG = os.getenv("TEXT_SEARCH_CONFIG", "english")
+if not re.fullmatch(r"[a-z_]+", TEXT_SEARCH_CONFIG):
+    raise ValueError(f"Invalid TEXT_SEARCH_CONFIG: {TEXT_SEARCH_CONFIG}")
+
+INDEX_NAME = "docs_embedding_idx"
+TEXT_INDEX_NAME = "docs_content_tsv_idx"
+METADATA_INDEX_NAME = "docs_metadata_idx"
+COLLECTION_INDEX_NAME = "docs_collection_idx"
+
+# Rows ingested without a collection
+DEFAULT_COLLECTION = "default"
+
+
+def column_type(storage: str = VECTOR_STORAGE) -> str:
+    """SQL type of docs.embedding (and of query vectors) for a storage mode"""
+    return "halfvec" if storage == "halfvec" else "vector"
+
+
+def index_definition(storage: str = VECTOR_STORAGE):
+    """(indexed expression, operator class) of the vector index for a storage mode"""
+    if storage == "binary":
+        return f"(binary_quantize(embedding)::bit({EMBEDDING_DIM}))", "bit_hamming_ops"
+    return "embedding", OPERATOR_CLASS.replace("vector_", f"{column_type(storage)}_")
+
+
+# Type of docs.embedding; query vectors are cast to it
+EMBEDDING_TYPE = column_type()
+INDEX_EXPRESSION, INDEX_OPERATOR_CLASS = index_definition()
+
+
+def index_name(collection: str = None) -> str:
+    """Name of the global vector index, or of a collection's partial one"""
+    if collection is None:
+        return INDEX_NAME
+    slug = re.sub(r"[^a-z0-9]+", "_", collection.lower()).strip("_")[:30]
+    # The hash keeps names unique when different collections share a slug
+    digest = hashlib.blake2b(collection.encode("utf-8"), digest_size=4).hexdigest()
+    return f"docs_embedding_{slug}_{digest}_idx"
+
+
+def vector_literal(embedding) -> str:
+    """pgvector text format: '[x1,x2,...]'"""
+    return "[" + ",".join(map(str, embedding)) + "]"
+
+
+def search_settings(probes: int = None, ef_search: int = None):
+    """SET LOCAL statements tuning the index scan for the current transaction"""
+    ef_search = int(ef_search or HNSW_EF_SEARCH)
+    if VECTOR_STORAGE == "binary":
+        # An hnsw scan returns at most ef_search rows, so it must cover the re-ranked candidates
+        ef_search = max(ef_search, RERANK_CANDIDATES)
+    statements = [
+        f"SET LOCAL ivfflat.probes = {int(probes or IVFFLAT_PROBES)}",
+        f"SET LOCAL hnsw.ef_search = {ef_search}",
+    ]
+    if VECTOR_ITERATIVE_SCAN != "off":
+        statements.append(f"SET LOCAL hnsw.iterative_scan = {VECTOR_ITERATIVE_SCAN}")
+        # ivfflat only supports relaxed ordering
+        statements.append("SET LOCAL ivfflat.iterative_scan = relaxed_order")
+    return statements
+
+
+def apply_search_settings(cur, probes: int = None, ef_search: int = None):
+    # One round-trip for all settings
+    cur.execute("; ".join(search_settings(probes, ef_search)))
+
+
+def default_lists(rows: int) -> int:
+    """pgvector guidance: rows / 1000 up to 1M rows, sqrt(rows) beyond"""
+    if rows > 1_000_000:
+        return int(rows ** 0.5)
+    return max(10, rows // 1000)
+
+
+def create_index(kind: str = "hnsw", lists: int = None, m: int = 16, ef_construction: int = 64,
+                 concurrently: bool = False, collection: str = None, storage: str = VECTOR_STORAGE):
+    """
+    (Re)create the docs embedding index for the configured metric and storage
+    mode; with `collection`, a partial index covering only that collection's rows
+    """
+    name = index_name(collection)
+    expression, operator_class = index_definition(storage)
+    conn = get_conn()
+    try:
+        if concurrently:
+            # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+            conn.driver_connection.autocommit = True
+        with conn.cursor() as cur:
+            # Same predicate text as retrieve()'s single-collection filter, so the planner can match it
+            where = cur.mogrify(" WHERE collection = %s", (collection,)).decode() if collection is not None else ""
+            if kind == "ivfflat":
+                if lists is None:
+                    cur.execute(f"SELECT count(*) FROM docs{where}")
+                    lists = default_lists(cur.fetchone()[0])
+                options = f"lists = {int(lists)}"
+            elif kind == "hnsw":
+                options = f"m = {int(m)}, ef_construction = {int(ef_construction)}"
+            else:
+                raise ValueError(f"Unknown index type: {kind}")
+            cur.execute(f"DROP INDEX {'CONCURRENTLY ' if concurrently else ''}IF EXISTS {name}")
+            cur.execute(
+                f"CREATE INDEX {'CONCURRENTLY ' if concurrently else ''}{name} "
+                f"ON docs USING {kind} ({expression} {operator_class}) WITH ({options}){where}"
+            )
+        if not concurrently:
+            conn.commit()
+    except Exception as e:
+        if not concurrently:
+            conn.rollback()
+        raise e
+    finally:
+        conn.driver_connection.autocommit = False
+        conn.close()
+    print(f"Created {kind} index {name} ({operator_class}, {options}){where}")
+
+
+def rebuild_index(concurrently: bool = False, collection: str = None):
+    name = index_name(collection)
+    conn = get_conn()
+    try:
+        conn.driver_connection.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute(f"REINDEX INDEX {'CONCURRENTLY ' if concurrently else ''}{name}")
+    finally:
+        conn.driver_connection.autocommit = False
+        conn.close()
+    print(f"Rebuilt {name}")
+
+
+def drop_index(collection: str = None):
+    name = index_name(collection)
+    conn = get_conn()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"DROP INDEX IF EXISTS {name}")
+        conn.commit()
+    finally:
+        conn.close()
+    print(f"Dropped {name}")
+
+
+def create_text_index():
+    """Generated tsvector column over title + content with a GIN index (hybrid retrieval)"""
+    conn = get_conn()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"""
+                ALTER TABLE docs ADD COLUMN IF NOT EXISTS content_tsv tsvector
+                GENERATED ALWAYS AS (
+                    to_tsvector('{TEXT_SEARCH_CONFIG}', coalesce(title, '') || ' ' || coalesce(content, ''))
+                ) STORED
+            """)
+            cur.execute(f"CREATE INDEX IF NOT EXISTS {TEXT_INDEX_NAME} ON docs USING gin (content_tsv)")
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        raise e
+    finally:
+        conn.close()
+    print(f"Created content_tsv ({TEXT_SEARCH_CONFIG}) and GIN index {TEXT_INDEX_NAME}")
+
+
+def create_filter_indexes():
+    """Generated collection column (btree) and a GIN index on metadata for filtered retrieval"""
+    conn = get_conn()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"""
+                ALTER TABLE docs ADD COLUMN IF NOT EXISTS collection TEXT
+                GENERATED ALWAYS AS (coalesce(metadata->>'collection', '{DEFAULT_COLLECTION}')) STORED
+            """)
+            cur.execute(f"CREATE INDEX IF NOT EXISTS {COLLECTION_INDEX_NAME} ON docs (collection)")
+            # jsonb_path_ops: smaller and faster than the default opclass, and supports @> (all retrieve() uses)
+            cur.execute(f"CREATE INDEX IF NOT EXISTS {METADATA_INDEX_NAME} ON docs USING gin (metadata jsonb_path_ops)")
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        raise e
+    finally:
+        conn.close()
+    print(f"Created docs.collection, {COLLECTION_INDEX_NAME} and GIN index {METADATA_INDEX_NAME}")
+
+
+def embedding_column_type(cur) -> str:
+    """Current SQL type of docs.embedding, e.g. 'vector(768)'"""
+    cur.execute(
+        "SELECT format_type(atttypid, atttypmod) FROM pg_attribute "
+        "WHERE attrelid = 'docs'::regclass AND attname = 'embedding'"
+    )
+    return cur.fetchone()[0]
+
+
+def set_storage(storage: str):
+    """
+    Migrate existing rows to a storage mode: convert docs.embedding to the mode's
+    column type and recreate every vector index (global and per-collection, same
+    type and options) over the mode's expression. Runs in one transaction and
+    holds an exclusive lock on docs while the table is rewritten.
+    """
+    target = f"{column_type(storage)}({EMBEDDING_DIM})"
+    expression, operator_class = index_definition(storage)
+    conn = get_conn()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT c.relname, am.amname, c.reloptions, pg_get_expr(i.indpred, i.indrelid)
+                FROM pg_index i
+                JOIN pg_class c ON c.oid = i.indexrelid
+                JOIN pg_am am ON am.oid = c.relam
+                WHERE i.indrelid = 'docs'::regclass AND am.amname IN ('hnsw', 'ivfflat')
+            """)
+            indexes = cur.fetchall()
+            # The old operator classes don't accept the new column type: drop first, rebuild after
+            for name, *_ in indexes:
+                cur.execute(f"DROP INDEX {name}")
+            current = embedding_column_type(cur)
+            if current != target:
+                cur.execute(f"ALTER TABLE docs ALTER COLUMN embedding TYPE {target} USING embedding::{target}")
+            for name, kind, options, predicate in indexes:
+                with_options = f" WITH ({', '.join(options)})" if options else ""
+                where = f" WHERE {predicate}" if predicate else ""
+                cur.execute(
+                    f"CREATE INDEX {name} ON docs USING {kind} ({expression} {operator_class}){with_options}{where}"
+                )
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        raise e
+    finally:
+        conn.close()
+    print(f"docs.embedding: {current} -> {target}; rebuilt {len(indexes)} index(es) on {expression} {operator_class}")
+    if storage != VECTOR_STORAGE:
+        print(f"Set VECTOR_STORAGE={storage} (currently {VECTOR_STORAGE}) so retrieve() queries match")
+
+
+def show_indexes():
+    """Print the vector indexes on docs and whether they match VECTOR_METRIC and VECTOR_STORAGE"""
+    conn = get_conn()
+    try:
+        with conn.cursor() as cur:
+            current = embedding_column_type(cur)
+            cur.execute("SELECT indexname, indexdef FROM pg_indexes WHERE tablename = 'docs'")
+            rows = cur.fetchall()
+    finally:
+        conn.close()
+    print(f"VECTOR_METRIC={VECTOR_METRIC} operator={DISTANCE_OPERATOR} threshold={DISTANCE_THRESHOLD}")
+    print(f"VECTOR_STORAGE={VECTOR_STORAGE} docs.embedding={current}")
+    if not current.startswith(EMBEDDING_TYPE + "("):
+        print(f"  column type does not match VECTOR_STORAGE; run: python -m app.vector_index set-storage {VECTOR_STORAGE}")
+    for name, definition in rows:
+        if "hnsw" in definition or "ivfflat" in definition:
+            matches = INDEX_OPERATOR_CLASS in definition
+            status = "matches" if matches else "UNUSED by retrieve() (metric or storage mismatch)"
+            print(f"  {name}: {definition} -> {status}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the docs vector index")
+    sub = parser.add_subparsers(dest="command", required=True)
+    create = sub.add_parser("create", help="drop and create the index")
+    create.add_argument("--type", choices=["hnsw", "ivfflat"], default="hnsw")
+    create.add_argument("--lists", type=int, default=None, help="ivfflat lists (default: rows/1000)")
+    create.add_argument("--m", type=int, default=16, help="hnsw max connections per node")
+    create.add_argument("--ef-construction", type=int, default=64, help="hnsw build candidate list size")
+    create.add_argument("--concurrently", action="store_true")
+    rebuild = sub.add_parser("rebuild", help="REINDEX the existing index")
+    rebuild.add_argument("--concurrently", action="store_true")
+    drop = sub.add_parser("drop")
+    for command in (create, rebuild, drop):
+        command.add_argument("--collection", help="the partial index of this collection (needs create-filters)")
+    sub.add_parser("show")
+    sub.add_parser("create-fts", help="add the tsvector column and GIN index used by hybrid retrieval")
+    sub.add_parser("create-filters", help="add the collection column and the metadata GIN index")
+    storage = sub.add_parser("set-storage", help="convert existing rows and indexes to a storage mode")
+    storage.add_argument("storage", choices=STORAGE_MODES)
+    args = parser.parse_args()
+
+    if args.command == "create":
+        create_index(args.type, args.lists, args.m, args.ef_construction, args.concurrently, args.collection)
+    elif args.command == "rebuild":
+        rebuild_index(args.concurrently, args.collection)
+    elif args.command == "drop":
+        drop_index(args.collection)
+    elif args.command == "create-fts":
+        create_text_index()
+    elif args.command == "create-filters":
+        create_filter_indexes()
+    elif args.command == "set-storage":
+        set_storage(args.storage)
+    else:
+        show_indexes()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Import-time budget for the FastAPI app.
+
+Imports app.main in fresh interpreters and reports the wall time, what it is
+made of (app.main's direct imports by cumulative time, from python -X
+importtime) and whether any module that startup is
+supposed to defer (langgraph, the Gemini SDK, NumPy) was imported anyway.
+It then runs the real lifecycle.startup() once in a fresh interpreter (SQLite
+database, real create_model with the installed Gemini SDK; building the model
+makes no network call), so a broken deferred import fails here instead of in
+the lifespan. Exits non-zero when the median import time exceeds --budget-ms,
+a deferred module was loaded or startup failed, so it can run as a CI check.
+
+Usage:
+    python -m benchmarks.bench_import_time --runs 5 --budget-ms 1500
+    python -m benchmarks.bench_import_time --skip-startup     # import time only (no Gemini SDK installed)
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFERRED_MODULES = ["langgraph", "google.generativeai", "numpy"]
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import app.main
+elapsed = time.perf_counter() - start
+print(json.dumps({"ms": elapsed * 1000, "loaded": [m for m in %r if m in sys.modules]}))
+""" % (DEFERRED_MODULES,)
+
+STARTUP_PROBE = """
+import json
+from app.lifecycle import app_state, startup
+from app.graph_logic import llm
+startup()
+print(json.dumps({"ready": app_state.ready, "model": type(llm.model).__module__ + "." + type(llm.model).__name__,
+                  "steps_ms": app_state.stats()["steps_ms"]}))
+"""
+
+
+def environment():
+    env = dict(os.environ)
+    # Import must not need a reachable database: create_engine does not connect
+    env.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.gettempdir(), 'import_time.sqlite3')}")
+    # create_model() only needs a key to be set; nothing is sent with it
+    env.setdefault("GOOGLE_API_KEY", "offline-startup-check")
+    env["PYTHONPATH"] = ROOT + os.pathsep + env.get("PYTHONPATH", "")
+    return env
+
+
+def measure(env) -> dict:
+    out = subprocess.run([sys.executable, "-c", PROBE], capture_output=True, text=True, cwd=ROOT, env=env, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def startup_check(env) -> dict:
+    """Run lifecycle.startup() in a fresh interpreter; {"ok": False, "error": ...} if it raises"""
+    out = subprocess.run([sys.executable, "-c", STARTUP_PROBE], capture_output=True, text=True, cwd=ROOT, env=env)
+    if out.returncode != 0:
+        return {"ok": False, "error": out.stderr.strip().splitlines()[-1] if out.stderr.strip() else "no output"}
+    return {"ok": True, **json.loads(out.stdout.strip().splitlines()[-1])}
+
+
+def slowest_modules(env, top: int):
+    """Direct imports of app.main by cumulative import time, from -X importtime"""
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app.main"],
+                         capture_output=True, text=True, cwd=ROOT, env=env, check=True)
+    rows, children = [], []
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # Each module is listed after its own imports, indented two spaces per nesting level
+        name = name[1:]
+        depth = (len(name) - len(name.lstrip(" "))) // 2
+        if depth == 1:
+            children.append((int(cumulative), name.strip()))
+        elif depth == 0:
+            if name == "app.main":
+                rows = children
+            children = []
+    return [{"module": name, "cumulative_ms": round(us / 1000, 1)} for us, name in sorted(rows, reverse=True)[:top]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=1500)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--skip-startup", action="store_true", help="don't run lifecycle.startup()")
+    args = parser.parse_args()
+
+    env = environment()
+    runs = [measure(env) for _ in range(args.runs)]
+    median_ms = statistics.median(run["ms"] for run in runs)
+    loaded = sorted({m for run in runs for m in run["loaded"]})
+    report = {
+        "median_ms": round(median_ms, 1),
+        "max_ms": round(max(run["ms"] for run in runs), 1),
+        "budget_ms": args.budget_ms,
+        "deferred_modules_loaded": loaded,
+        "slowest_modules": slowest_modules(env, args.top),
+    }
+    if not args.skip_startup:
+        report["startup"] = startup_check(env)
+    print(json.dumps(report, indent=2))
+
+    if median_ms > args.budget_ms:
+        print(f"Import time {median_ms:.0f}ms is over the {args.budget_ms:.0f}ms budget", file=sys.stderr)
+        sys.exit(1)
+    if loaded:
+        print(f"Imported at module load, should be deferred: {', '.join(loaded)}", file=sys.stderr)
+        sys.exit(1)
+    if not args.skip_startup and not report["startup"]["ok"]:
+        print(f"lifecycle.startup() failed: {report['startup']['error']}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
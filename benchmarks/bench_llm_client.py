@@ -0,0 +1,91 @@
+"""
+Exercise app/llm_client.py against the local fake Gemini server through the
+real SDK (REST transport): plain calls vs retries under errors, hedging under
+a slow tail, and the circuit breaker during an outage.
+
+Usage:
+    python -m benchmarks.bench_llm_client --requests 200 --concurrency 16
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import google.generativeai as genai  # noqa: E402
+
+from app.llm_client import LLMClient, CircuitBreaker, CircuitOpenError  # noqa: E402
+from benchmarks.fake_llm_server import CONFIG, STATS, serve  # noqa: E402
+
+
+def run(client, requests, concurrency):
+    latencies, outcomes = [], {"ok": 0, "error": 0, "short_circuited": 0}
+
+    def call(_):
+        start = time.perf_counter()
+        try:
+            client.generate("What does ImaginaryProduct cost?")
+            outcome = "ok"
+        except CircuitOpenError:
+            outcome = "short_circuited"
+        except Exception:
+            outcome = "error"
+        return outcome, (time.perf_counter() - start) * 1000
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for outcome, ms in pool.map(call, range(requests)):
+            outcomes[outcome] += 1
+            latencies.append(ms)
+    latencies.sort()
+    return {
+        **outcomes,
+        "p50_ms": round(latencies[len(latencies) // 2], 1),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1], 1),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99) - 1], 1),
+        "client": client.stats(),
+    }
+
+
+def scenario(model, requests, concurrency, server_config, **client_options):
+    CONFIG.update(server_config)
+    STATS.update({"requests": 0, "errors": 0})
+    result = run(LLMClient(model, **client_options), requests, concurrency)
+    result["server_requests"] = STATS["requests"]
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.1)
+    args = parser.parse_args()
+
+    server = serve()
+    genai.configure(api_key="offline-benchmark", transport="rest",
+                    client_options={"api_endpoint": f"http://127.0.0.1:{server.server_port}"})
+    model = genai.GenerativeModel("gemini-2.5-flash")
+    base = {"latency": args.latency, "slow_rate": 0.0, "error_rate": 0.0, "throttle_rate": 0.0}
+    n, c = args.requests, args.concurrency
+
+    results = {
+        "baseline": scenario(model, n, c, base, max_retries=0),
+        "errors_no_retry": scenario(model, n, c, {**base, "error_rate": 0.1, "throttle_rate": 0.1}, max_retries=0,
+                                    breaker=CircuitBreaker(failures=10 ** 6)),
+        "errors_retry": scenario(model, n, c, {**base, "error_rate": 0.1, "throttle_rate": 0.1}, max_retries=3,
+                                 breaker=CircuitBreaker(failures=10 ** 6)),
+        "slow_tail_no_hedge": scenario(model, n, c, {**base, "slow_rate": 0.05, "slow_latency": args.latency * 20}),
+        "slow_tail_hedge": scenario(model, n, c, {**base, "slow_rate": 0.05, "slow_latency": args.latency * 20},
+                                    hedge=True, hedge_delay_ms=args.latency * 3000),
+        "outage_breaker": scenario(model, n, c, {**base, "error_rate": 1.0}, max_retries=1,
+                                   breaker=CircuitBreaker(failures=5, reset_seconds=60)),
+    }
+    server.shutdown()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+pgvector vs in-process NumPy retrieval latency on the same query vectors.
+
+Usage:
+    python -m benchmarks.bench_retrieval_engines --queries 200 --top-k 3 --batch 32
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.numpy_index import NumpyVectorIndex  # noqa: E402
+from app.retrieve import search_vector  # noqa: E402
+from benchmarks.bench_vector_index import sample_queries  # noqa: E402
+
+
+def percentiles(latencies):
+    latencies = sorted(latencies)
+    return {
+        "p50_ms": round(latencies[len(latencies) // 2], 3),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1], 3),
+    }
+
+
+def timed(fn, queries):
+    latencies = []
+    for q in queries:
+        start = time.perf_counter()
+        fn(q)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return percentiles(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--batch", type=int, default=32, help="queries per search_many call")
+    args = parser.parse_args()
+
+    queries = sample_queries(args.queries, noise=0.01)
+    if not queries:
+        sys.exit("docs is empty; ingest documents first")
+
+    start = time.perf_counter()
+    index = NumpyVectorIndex(snapshot="")
+    index.load()
+    load_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i in range(0, len(queries), args.batch):
+        index.search_many(queries[i:i + args.batch], args.top_k)
+    batched_qps = len(queries) / (time.perf_counter() - start)
+
+    print(json.dumps({
+        "docs": len(index.ids),
+        "queries": len(queries),
+        "pgvector": timed(lambda q: search_vector(q, args.top_k), queries),
+        "numpy": {
+            **timed(lambda q: index.search(q, args.top_k), queries),
+            "load_seconds": round(load_seconds, 3),
+            "batched_qps": round(batched_qps, 1),
+        },
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
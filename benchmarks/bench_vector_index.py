@@ -0,0 +1,100 @@
+"""
+Recall-vs-latency benchmark for the docs vector index.
+
+Query vectors are sampled from existing docs embeddings (with a little noise
+so queries are not exact duplicates). Ground truth comes from an exact scan
+with index scans disabled; each ivfflat.probes / hnsw.ef_search value is then
+measured for recall@k and p50/p95 latency through retrieve.search_vector.
+With --collection, queries are restricted to that collection, which shows
+whether filtered searches keep their recall (partial index, VECTOR_ITERATIVE_SCAN).
+
+Usage:
+    python -m app.vector_index create --type hnsw
+    python -m benchmarks.bench_vector_index --queries 200 --top-k 10 --ef-search 10 20 40 80 160
+    python -m benchmarks.bench_vector_index --probes 1 5 10 20 50
+    python -m benchmarks.bench_vector_index --collection billing --ef-search 40 160
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.database import get_conn  # noqa: E402
+from app.retrieve import filter_clauses, search_sql, search_vector  # noqa: E402
+from app.vector_index import VECTOR_METRIC, vector_literal  # noqa: E402
+
+
+def sample_queries(n, noise, seed=0, collections=None):
+    clauses, params = filter_clauses(collections)
+    where = "WHERE " + " AND ".join(clauses) if clauses else ""
+    conn = get_conn()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT setseed(%s)", (seed / 1000.0,))
+            cur.execute(f"SELECT embedding::text FROM docs {where} ORDER BY random() LIMIT %(n)s", {**params, "n": n})
+            rows = cur.fetchall()
+    finally:
+        conn.close()
+    rng = random.Random(seed)
+    return [[float(x) + rng.gauss(0, noise) for x in r[0].strip("[]").split(",")] for r in rows]
+
+
+def exact_top_k(q_emb, top_k, collections=None):
+    sql, params = search_sql(collections, rerank=False)
+    conn = get_conn()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SET LOCAL enable_indexscan = off; SET LOCAL enable_bitmapscan = off")
+            cur.execute(sql, {**params, "q": vector_literal(q_emb), "k": top_k})
+            return [r[0] for r in cur.fetchall()]
+    finally:
+        conn.close()
+
+
+def measure(queries, truth, top_k, collections=None, **settings):
+    latencies, recalls = [], []
+    for q_emb, expected in zip(queries, truth):
+        start = time.perf_counter()
+        got = search_vector(q_emb, top_k, collections=collections, **settings)
+        latencies.append((time.perf_counter() - start) * 1000)
+        recalls.append(len({d["id"] for d in got} & set(expected)) / max(1, len(expected)))
+    latencies.sort()
+    return {
+        **settings,
+        "recall": round(statistics.mean(recalls), 4),
+        "p50_ms": round(latencies[len(latencies) // 2], 3),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1], 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--noise", type=float, default=0.01)
+    parser.add_argument("--probes", type=int, nargs="*", default=[])
+    parser.add_argument("--ef-search", type=int, nargs="*", default=[])
+    parser.add_argument("--collection", help="restrict queries to this collection")
+    args = parser.parse_args()
+    collections = [args.collection] if args.collection else None
+
+    queries = sample_queries(args.queries, args.noise, collections=collections)
+    if not queries:
+        sys.exit("no docs to sample; ingest documents first")
+    truth = [exact_top_k(q, args.top_k, collections) for q in queries]
+
+    results = [measure(queries, truth, args.top_k, collections, probes=p) for p in args.probes]
+    results += [measure(queries, truth, args.top_k, collections, ef_search=ef) for ef in args.ef_search]
+    if not results:
+        results.append(measure(queries, truth, args.top_k, collections))
+    print(json.dumps({"metric": VECTOR_METRIC, "collection": args.collection, "queries": len(queries),
+                      "top_k": args.top_k, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""
+Memory, latency and recall of the VECTOR_STORAGE modes on the current docs.
+
+Copies the embeddings (optionally a --rows sample) into one scratch table per
+mode (vector, halfvec, binary), builds the same hnsw index on each and
+reports table and index size, p50/p95 latency, recall@k against an exact
+float32 scan, and how far the top-1 distance (best_distance, what
+evaluate_node routes on) drifts from the exact one. Binary mode is measured
+at each --candidates value. The live docs table is not modified; scratch
+tables are dropped unless --keep is given.
+
+Usage:
+    python -m benchmarks.bench_vector_storage --queries 200 --top-k 10 --candidates 40 100 200
+    python -m benchmarks.bench_vector_storage --rows 100000 --ef-search 40 100
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.database import get_conn  # noqa: E402
+from app.embeddings import EMBEDDING_DIM  # noqa: E402
+from app.vector_index import (  # noqa: E402
+    DISTANCE_OPERATOR, STORAGE_MODES, VECTOR_METRIC, column_type, index_definition, vector_literal,
+)
+from benchmarks.bench_vector_index import sample_queries  # noqa: E402
+
+
+def table_name(storage: str) -> str:
+    return f"bench_storage_{storage}"
+
+
+def build_table(storage: str, rows: int = None, m: int = 16, ef_construction: int = 64) -> dict:
+    """Scratch copy of docs embeddings in the mode's column type, with its hnsw index; returns sizes"""
+    table = table_name(storage)
+    target = f"{column_type(storage)}({EMBEDDING_DIM})"
+    expression, operator_class = index_definition(storage)
+    limit = f" LIMIT {int(rows)}" if rows else ""
+    conn = get_conn()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"DROP TABLE IF EXISTS {table}")
+            cur.execute(f"CREATE UNLOGGED TABLE {table} (id INTEGER PRIMARY KEY, embedding {target})")
+            cur.execute(f"INSERT INTO {table} SELECT id, embedding::{target} FROM docs ORDER BY id{limit}")
+            start = time.perf_counter()
+            cur.execute(
+                f"CREATE INDEX {table}_idx ON {table} USING hnsw ({expression} {operator_class}) "
+                f"WITH (m = {int(m)}, ef_construction = {int(ef_construction)})"
+            )
+            build_s = time.perf_counter() - start
+            cur.execute(f"ANALYZE {table}")
+            cur.execute(f"SELECT count(*), pg_table_size('{table}'), pg_relation_size('{table}_idx') FROM {table}")
+            count, table_bytes, index_bytes = cur.fetchone()
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        raise e
+    finally:
+        conn.close()
+    return {"rows": count, "table_mb": round(table_bytes / 2 ** 20, 2), "index_mb": round(index_bytes / 2 ** 20, 2),
+            "index_build_s": round(build_s, 2)}
+
+
+def drop_tables():
+    conn = get_conn()
+    try:
+        with conn.cursor() as cur:
+            for storage in STORAGE_MODES:
+                cur.execute(f"DROP TABLE IF EXISTS {table_name(storage)}")
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def query_sql(storage: str) -> str:
+    """Same shape as retrieve.SEARCH_SQL / RERANK_SEARCH_SQL, against the mode's scratch table"""
+    table = table_name(storage)
+    if storage == "binary":
+        expression, _ = index_definition(storage)
+        return f"""
+            SELECT id, embedding {DISTANCE_OPERATOR} %(q)s::vector AS distance
+            FROM (
+                SELECT id, embedding FROM {table}
+                ORDER BY {expression} <~> binary_quantize(%(q)s::vector)
+                LIMIT %(candidates)s
+            ) candidates
+            ORDER BY distance
+            LIMIT %(k)s
+        """
+    cast = column_type(storage)
+    return f"""
+        SELECT id, embedding {DISTANCE_OPERATOR} %(q)s::{cast} AS distance
+        FROM {table}
+        ORDER BY embedding {DISTANCE_OPERATOR} %(q)s::{cast}
+        LIMIT %(k)s
+    """
+
+
+def run_queries(storage, queries, top_k, candidates=None, ef_search=40, exact=False):
+    """[(ids, distances, ms)] per query"""
+    sql = query_sql(storage)
+    results = []
+    conn = get_conn()
+    try:
+        with conn.cursor() as cur:
+            for q_emb in queries:
+                start = time.perf_counter()
+                if exact:
+                    cur.execute("SET LOCAL enable_indexscan = off; SET LOCAL enable_bitmapscan = off")
+                else:
+                    # Set directly: search_settings() raises ef_search when VECTOR_STORAGE=binary
+                    cur.execute(f"SET LOCAL hnsw.ef_search = {int(ef_search)}")
+                cur.execute(sql, {"q": vector_literal(q_emb), "k": top_k, "candidates": candidates or top_k})
+                rows = cur.fetchall()
+                results.append(([r[0] for r in rows], [float(r[1]) for r in rows],
+                                (time.perf_counter() - start) * 1000))
+                conn.rollback()  # ends the transaction, resetting the SET LOCALs
+    finally:
+        conn.close()
+    return results
+
+
+def measure(storage, queries, truth, top_k, **kwargs):
+    results = run_queries(storage, queries, top_k, **kwargs)
+    latencies = sorted(ms for _, _, ms in results)
+    recalls = [len(set(ids) & set(expected_ids)) / max(1, len(expected_ids))
+               for (ids, _, _), (expected_ids, _, _) in zip(results, truth)]
+    drift = [abs(distances[0] - expected[0]) for (_, distances, _), (_, expected, _) in zip(results, truth)
+             if distances and expected]
+    return {
+        "storage": storage,
+        **{k: v for k, v in kwargs.items() if v is not None},
+        "recall": round(statistics.mean(recalls), 4),
+        "best_distance_drift": round(max(drift), 6) if drift else None,
+        "p50_ms": round(latencies[len(latencies) // 2], 3),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1], 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--noise", type=float, default=0.01)
+    parser.add_argument("--rows", type=int, help="copy only the first N docs (default: all)")
+    parser.add_argument("--candidates", type=int, nargs="*", default=[40, 100, 200],
+                        help="binary mode: Hamming candidates re-ranked per query")
+    parser.add_argument("--ef-search", type=int, nargs="*", default=[40])
+    parser.add_argument("--keep", action="store_true", help="keep the scratch tables")
+    args = parser.parse_args()
+
+    queries = sample_queries(args.queries, args.noise)
+    if not queries:
+        sys.exit("no docs to sample; ingest documents first")
+    try:
+        sizes = {storage: build_table(storage, args.rows) for storage in STORAGE_MODES}
+        truth = run_queries("vector", queries, args.top_k, exact=True)
+        results = []
+        for ef in args.ef_search:
+            # The Hamming stage needs ef_search >= candidates to return them all
+            results.append(measure("vector", queries, truth, args.top_k, ef_search=ef))
+            results.append(measure("halfvec", queries, truth, args.top_k, ef_search=ef))
+            results += [measure("binary", queries, truth, args.top_k, candidates=c, ef_search=max(ef, c))
+                        for c in args.candidates]
+    finally:
+        if not args.keep:
+            drop_tables()
+    print(json.dumps({"metric": VECTOR_METRIC, "dim": EMBEDDING_DIM, "queries": len(queries), "top_k": args.top_k,
+                      "sizes": sizes, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Local fake of the Gemini REST API (generateContent / streamGenerateContent)
+with configurable latency, slow tail and error rates.
+
+Point the app at it with GEMINI_API_ENDPOINT=http://127.0.0.1:8089, or start
+it in-process with serve() as benchmarks/bench_llm_client.py does.
+
+Usage:
+    python -m benchmarks.fake_llm_server --port 8089 --latency 0.3 --error-rate 0.1
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Mutable so scenarios can be switched while the server runs
+CONFIG = {
+    "latency": 0.2,        # seconds per response
+    "slow_rate": 0.0,      # fraction of requests taking slow_latency instead
+    "slow_latency": 2.0,
+    "error_rate": 0.0,     # fraction answered with 503
+    "throttle_rate": 0.0,  # fraction answered with 429
+    "text": "Fake answer from the local model server.",
+}
+STATS = {"requests": 0, "errors": 0}
+_stats_lock = threading.Lock()
+
+
+def response_body(text: str) -> dict:
+    return {
+        "candidates": [{
+            "content": {"parts": [{"text": text}], "role": "model"},
+            "finishReason": "STOP",
+            "index": 0,
+        }],
+        "usageMetadata": {"promptTokenCount": 1, "candidatesTokenCount": len(text.split())},
+    }
+
+
+class FakeGeminiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status: int, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        self.rfile.read(length)
+        with _stats_lock:
+            STATS["requests"] += 1
+
+        roll = random.random()
+        if roll < CONFIG["error_rate"] + CONFIG["throttle_rate"]:
+            status = 503 if roll < CONFIG["error_rate"] else 429
+            with _stats_lock:
+                STATS["errors"] += 1
+            time.sleep(CONFIG["latency"] / 4)
+            self._send(status, {"error": {"code": status, "message": "fake failure", "status": "UNAVAILABLE"}})
+            return
+
+        slow = random.random() < CONFIG["slow_rate"]
+        time.sleep(CONFIG["slow_latency"] if slow else CONFIG["latency"])
+        if ":streamGenerateContent" in self.path:
+            # The REST transport reads the stream as one JSON array of responses
+            words = CONFIG["text"].split()
+            self._send(200, [response_body(w + " ") for w in words])
+        else:
+            self._send(200, response_body(CONFIG["text"]))
+
+
+def serve(port: int = 0) -> ThreadingHTTPServer:
+    """Start the server on a daemon thread; port 0 picks a free port"""
+    server = ThreadingHTTPServer(("127.0.0.1", port), FakeGeminiHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=CONFIG["latency"])
+    parser.add_argument("--slow-rate", type=float, default=CONFIG["slow_rate"])
+    parser.add_argument("--slow-latency", type=float, default=CONFIG["slow_latency"])
+    parser.add_argument("--error-rate", type=float, default=CONFIG["error_rate"])
+    parser.add_argument("--throttle-rate", type=float, default=CONFIG["throttle_rate"])
+    args = parser.parse_args()
+    CONFIG.update({k: v for k, v in vars(args).items() if k != "port"})
+
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), FakeGeminiHandler)
+    print(f"Fake Gemini API on http://127.0.0.1:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Offline stand-ins shared by the benchmarks.
+"""
+import asyncio
+import random
+import time
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeModel:
+    """Stands in for genai.GenerativeModel with a fixed generation latency."""
+
+    def __init__(self, latency, text="fake answer"):
+        self.latency = latency
+        self.text = text
+
+    def generate_content(self, prompt, **kwargs):
+        time.sleep(self.latency)
+        return FakeResponse(self.text)
+
+    async def generate_content_async(self, prompt, stream=False, **kwargs):
+        if stream:
+            return self._stream()
+        await asyncio.sleep(self.latency)
+        return FakeResponse(self.text)
+
+    async def _stream(self):
+        words = self.text.split()
+        for word in words:
+            await asyncio.sleep(self.latency / len(words))
+            yield FakeResponse(word + " ")
+
+
+_SYLLABLES = ["ka", "lo", "mi", "ne", "ru", "sa", "to", "vi", "zen", "dor", "pla", "qui", "bex", "fon", "gar"]
+
+
+def synthetic_vocabulary(size: int, seed: int = 0):
+    rng = random.Random(seed)
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(_SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+def synthetic_corpus(n_docs: int, seed: int = 0, vocabulary_size: int = 3000):
+    """Deterministic docs of 6-12 sentences over a Zipf-ish synthetic vocabulary"""
+    rng = random.Random(seed)
+    vocabulary = synthetic_vocabulary(vocabulary_size, seed)
+    weights = [1.0 / (rank + 1) for rank in range(len(vocabulary))]
+    docs = []
+    for i in range(n_docs):
+        sentences = []
+        for _ in range(rng.randint(6, 12)):
+            words = rng.choices(vocabulary, weights=weights, k=rng.randint(8, 16))
+            sentences.append(" ".join(words).capitalize() + ".")
+        docs.append({"id": i + 1, "title": f"Doc {i + 1}", "content": " ".join(sentences), "metadata": {}})
+    return docs
+
+
+def sample_questions(docs, n: int, seed: int = 0):
+    """Questions built from a sentence of a random doc, so most have a close match"""
+    rng = random.Random(seed + 1)
+    questions = []
+    for _ in range(n):
+        sentence = rng.choice(rng.choice(docs)["content"].split(". "))
+        words = sentence.rstrip(".").split()
+        start = rng.randint(0, max(0, len(words) - 6))
+        questions.append("What about " + " ".join(words[start:start + 6]).lower() + "?")
+    return questions
+
+
+def chat_questions(docs, n: int, seed: int = 0):
+    """
+    A mix that exercises every chat route with the hashing embedder: "What
+    about ..." fragments (weak match -> llm_augmented), 2-3 consecutive
+    sentences of a doc (close match -> mostly kb_only) and 4-6 sentences
+    (near-verbatim -> mostly extractive), in equal parts
+    """
+    rng = random.Random(seed + 2)
+    fragments = sample_questions(docs, n, seed)
+    questions = []
+    for i in range(n):
+        if i % 3 == 0:
+            questions.append(fragments[i])
+            continue
+        sentences = rng.choice(docs)["content"].split(". ")
+        length = rng.randint(2, 3) if i % 3 == 1 else rng.randint(4, 6)
+        start = rng.randint(0, max(0, len(sentences) - length))
+        questions.append(". ".join(sentences[start:start + length]))
+    return questions
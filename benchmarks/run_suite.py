@@ -0,0 +1,395 @@
+"""
+Offline benchmark suite for the chat pipeline. Emits one JSON document so
+runs can be compared across commits.
+
+Everything runs locally and deterministically (fixed seeds):
+- startup: the real lifecycle.startup() (tables, real create_model, graph
+  compilation) and one real SDK call. Only the network is faked: the Gemini
+  SDK talks REST to benchmarks/fake_llm_server.py via GEMINI_API_ENDPOINT.
+  A startup failure fails the suite.
+- chat: handle_chat under concurrency with the hashing embedder, the NumPy
+  engine over a synthetic corpus, a fake Gemini model and fake message writes
+  -> throughput, p50/p95/p99 and the route mix. Questions mix doc fragments
+  and passages so the extractive, kb_only and llm_augmented routes all run
+- retrieval: embedding and top-k search latency vs corpus size
+- ingestion: chunking + embedding throughput over synthetic files
+- sessions: GET /sessions latency (first and deep page, full and summary)
+  vs table size, on SQLite by default, plus a check that summaries report the
+  right message count and last message
+
+--database-url runs the sessions part on Postgres instead. It drops and
+recreates the sessions/messages tables, so only point it at a scratch database.
+SQLite timings are only comparable with other SQLite runs. They say nothing
+about Postgres plans, partition pruning or the production summary query
+performance; use --database-url for those.
+
+Usage:
+    python -m benchmarks.run_suite --output bench.json
+    python -m benchmarks.run_suite --quick --baseline bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fakes import FakeModel, chat_questions, synthetic_corpus, sample_questions  # noqa: E402
+
+SUITE_VERSION = 2
+
+
+def percentiles(latencies_ms) -> dict:
+    values = sorted(latencies_ms)
+    if not values:
+        return {}
+
+    def rank(q):
+        return round(values[min(len(values) - 1, int(q * len(values)))], 3)
+
+    return {"p50_ms": rank(0.5), "p95_ms": rank(0.95), "p99_ms": rank(0.99), "mean_ms": round(sum(values) / len(values), 3)}
+
+
+def timed_ms(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return (time.perf_counter() - start) * 1000, result
+
+
+def configure_environment(workdir: str, database_url: str = None, gemini_endpoint: str = None):
+    """Offline settings; must run before any app module is imported"""
+    os.environ.setdefault("GOOGLE_API_KEY", "offline-benchmark")
+    if gemini_endpoint:
+        os.environ["GEMINI_API_ENDPOINT"] = gemini_endpoint
+    os.environ["DATABASE_URL"] = database_url or f"sqlite:///{os.path.join(workdir, 'bench.sqlite3')}"
+    os.environ["EMBEDDING_PROVIDER"] = "hashing"
+    os.environ["EMBEDDING_CACHE_PATH"] = ""
+    os.environ["RETRIEVAL_ENGINE"] = "numpy"
+    os.environ["RETRIEVAL_MODE"] = "vector"
+    os.environ["NUMPY_INDEX_SNAPSHOT"] = ""
+    os.environ["KB_VERSION_PATH"] = os.path.join(workdir, ".kb_version")
+    os.environ["ANSWER_CACHE_ENABLED"] = "0"
+    os.environ["MEMORY_ENABLED"] = "0"
+
+
+def build_index(docs):
+    """NumPy index over `docs`, installed without Postgres"""
+    import numpy as np
+    from app.answer_cache import get_kb_version
+    from app.embeddings import embed_texts
+    from app.numpy_index import NumpyVectorIndex
+
+    vectors = embed_texts([d["content"] for d in docs])
+    index = NumpyVectorIndex(snapshot="")
+    index._install(docs, np.asarray(vectors, dtype=np.float32))
+    index.kb_version = get_kb_version()
+    return index
+
+
+# --- Startup ---
+def bench_startup():
+    """
+    lifecycle.startup() as the lifespan runs it, with the real create_model, then
+    one generate call through the SDK to the fake server. Runs before bench_chat,
+    which replaces the model with a FakeModel.
+    """
+    from app.graph_logic import llm
+    from app.lifecycle import app_state, startup
+
+    startup_ms, _ = timed_ms(startup)
+    generate_ms, response = timed_ms(llm.generate, "Reply with one word.")
+    return {
+        "ready": app_state.ready,
+        "model": f"{type(llm.model).__module__}.{type(llm.model).__name__}",
+        "startup_ms": round(startup_ms, 1),
+        "steps_ms": app_state.stats()["steps_ms"],
+        "first_generate_ms": round(generate_ms, 1),
+        "reply": response.text,
+    }
+
+
+# --- Chat ---
+def bench_chat(corpus_size, concurrency_levels, requests, llm_latency, db_latency, seed):
+    import app.numpy_index as numpy_index
+    import app.persistence as persistence
+    from app import graph_logic
+    from app.metrics import route_metrics
+
+    docs = synthetic_corpus(corpus_size, seed)
+    numpy_index._index = build_index(docs)
+    graph_logic.llm.model = FakeModel(llm_latency)
+    persistence.write_messages = lambda records: time.sleep(db_latency)
+    questions = chat_questions(docs, requests, seed)
+
+    results = []
+    for concurrency in concurrency_levels:
+        before = {route: s["count"] for route, s in route_metrics.stats().items()}
+
+        def call(i):
+            return timed_ms(graph_logic.handle_chat, f"bench-{concurrency}-{i}", questions[i], True)[0]
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            latencies = list(pool.map(call, range(requests)))
+        elapsed = time.perf_counter() - start
+        routes = {route: s["count"] - before.get(route, 0) for route, s in route_metrics.stats().items()}
+        results.append({
+            "concurrency": concurrency,
+            "requests": requests,
+            "throughput_rps": round(requests / elapsed, 2),
+            **percentiles(latencies),
+            "routes": {
+                route: {"count": count, "share": round(count / requests, 3)}
+                for route, count in sorted(routes.items()) if count
+            },
+        })
+    persistence.message_writer.flush()
+    return {"corpus_docs": corpus_size, "llm_latency_s": llm_latency, "db_latency_s": db_latency, "levels": results}
+
+
+# --- Retrieval ---
+def bench_retrieval(sizes, queries, top_k, seed):
+    from app.retrieve import embed_text
+
+    results = []
+    for size in sizes:
+        docs = synthetic_corpus(size, seed)
+        build_ms, index = timed_ms(build_index, docs)
+        questions = sample_questions(docs, queries, seed)
+        embed_latencies, search_latencies, vectors = [], [], []
+        for q in questions:
+            ms, vector = timed_ms(embed_text, q)
+            embed_latencies.append(ms)
+            vectors.append(vector)
+        for vector in vectors:
+            search_latencies.append(timed_ms(index.search, vector, top_k)[0])
+        batch_ms, _ = timed_ms(index.search_many, vectors, top_k)
+        results.append({
+            "docs": size,
+            "build_seconds": round(build_ms / 1000, 3),
+            "embedding": percentiles(embed_latencies),
+            "search": percentiles(search_latencies),
+            "batched_qps": round(len(vectors) / (batch_ms / 1000), 1),
+        })
+    return results
+
+
+# --- Ingestion ---
+def bench_ingestion(workdir, n_files, docs_per_file, seed):
+    from app.ingest_docs import CHUNK_OVERLAP, CHUNK_TOKENS, embed_plans, plan_file
+
+    source_dir = os.path.join(workdir, "ingest")
+    os.makedirs(source_dir, exist_ok=True)
+    docs = synthetic_corpus(n_files * docs_per_file, seed + 7)
+    paths = []
+    for i in range(n_files):
+        path = os.path.join(source_dir, f"doc_{i}.md")
+        with open(path, "w", encoding="utf-8") as f:
+            for doc in docs[i * docs_per_file:(i + 1) * docs_per_file]:
+                f.write(f"# {doc['title']}\n\n" + doc["content"].replace(". ", ".\n") + "\n\n")
+        paths.append(path)
+    total_bytes = sum(os.path.getsize(p) for p in paths)
+
+    start = time.perf_counter()
+    plans = [plan_file(p, os.path.basename(p), {}, CHUNK_TOKENS, CHUNK_OVERLAP, force=True) for p in paths]
+    plan_seconds = time.perf_counter() - start
+    chunks = sum(len(plan["records"]) for plan in embed_plans(plans))
+    total_seconds = time.perf_counter() - start
+    return {
+        "files": n_files,
+        "megabytes": round(total_bytes / 1e6, 3),
+        "chunks": chunks,
+        "chunking_seconds": round(plan_seconds, 3),
+        "total_seconds": round(total_seconds, 3),
+        "chunks_per_s": round(chunks / total_seconds, 1),
+        "mb_per_s": round(total_bytes / 1e6 / total_seconds, 3),
+        "note": "chunking + embedding only; no database writes",
+    }
+
+
+# --- /sessions ---
+def populate_sessions(n_sessions, messages_per_session):
+    from app.database import engine
+    from app.models import Base, Message, Session
+
+    Base.metadata.drop_all(bind=engine, tables=[Message.__table__, Session.__table__])
+    Base.metadata.create_all(bind=engine, tables=[Session.__table__, Message.__table__])
+    origin = datetime(2024, 1, 1)
+    if engine.dialect.name == "postgresql":
+        from app.message_partitions import ensure_partitions
+        ensure_partitions(since=origin)
+    batch = 5000
+    with engine.begin() as conn:
+        for offset in range(0, n_sessions, batch):
+            sessions, messages = [], []
+            for i in range(offset, min(offset + batch, n_sessions)):
+                created = origin + timedelta(seconds=i * 60)
+                sessions.append({"id": f"s{i:08d}", "created_at": created, "last_active": created})
+                for j in range(messages_per_session):
+                    messages.append({
+                        "id": f"m{i:08d}-{j}", "session_id": f"s{i:08d}", "role": "user" if j % 2 == 0 else "assistant",
+                        "content": f"message {j} of session {i}", "source": None,
+                        "created_at": created + timedelta(seconds=j),
+                    })
+            conn.execute(Session.__table__.insert(), sessions)
+            conn.execute(Message.__table__.insert(), messages)
+
+
+def bench_sessions(sizes, messages_per_session, page_size, reps):
+    from fastapi import Response
+    from app.database import SessionLocal
+    from app.main import get_all_sessions
+    from app.pagination import encode_cursor
+
+    results = []
+    for size in sizes:
+        populate_sessions(size, messages_per_session)
+        # Cursor halfway through the table: keyset pagination should cost the same as page 1
+        middle = datetime(2024, 1, 1) + timedelta(seconds=(size // 2) * 60)
+        deep_cursor = encode_cursor(middle, f"s{size // 2:08d}")
+        entry = {"sessions": size, "messages": size * messages_per_session}
+        for name, cursor, summary in (("first_page", None, False), ("first_page_summary", None, True),
+                                      ("deep_page", deep_cursor, False), ("deep_page_summary", deep_cursor, True)):
+            latencies = []
+            for _ in range(reps):
+                db = SessionLocal()
+                try:
+                    latencies.append(timed_ms(get_all_sessions, Response(), page_size, cursor, summary, db)[0])
+                finally:
+                    db.close()
+            entry[name] = percentiles(latencies)
+        entry["summary_correct"] = check_summaries(page_size, messages_per_session)
+        results.append(entry)
+    return results
+
+
+def check_summaries(page_size, messages_per_session) -> bool:
+    """First summary page: every session reports all its messages and its newest one as lastMessage"""
+    from fastapi import Response
+    from app.database import SessionLocal
+    from app.main import get_all_sessions
+
+    db = SessionLocal()
+    try:
+        page = get_all_sessions(Response(), page_size, None, True, db)
+    finally:
+        db.close()
+    return bool(page) and all(
+        s.messageCount == messages_per_session
+        and s.lastMessage is not None and s.lastMessage.id == f"m{s.id[1:]}-{messages_per_session - 1}"
+        for s in page
+    )
+
+
+# --- Output ---
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def flatten(value, prefix=""):
+    if isinstance(value, dict):
+        for key, item in value.items():
+            yield from flatten(item, f"{prefix}.{key}" if prefix else key)
+    elif isinstance(value, list):
+        for i, item in enumerate(value):
+            yield from flatten(item, f"{prefix}[{i}]")
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        yield prefix, value
+
+
+def compare(baseline: dict, current: dict):
+    """Print relative changes of latency and throughput figures to stderr"""
+    old = dict(flatten(baseline.get("results", {})))
+    print(f"Compared with {baseline.get('meta', {}).get('commit')}:", file=sys.stderr)
+    if baseline.get("meta", {}).get("suite_version") != SUITE_VERSION:
+        print(f"  (baseline from suite version {baseline.get('meta', {}).get('suite_version')}, "
+              f"now {SUITE_VERSION}: workloads differ)", file=sys.stderr)
+    for path, value in flatten(current["results"]):
+        if path in old and old[path] and path.endswith(("_ms", "_rps", "_per_s", "_qps", "qps")):
+            change = (value - old[path]) / old[path] * 100
+            print(f"  {path}: {old[path]} -> {value} ({change:+.1f}%)", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--only", nargs="+", choices=["startup", "chat", "retrieval", "ingestion", "sessions"])
+    parser.add_argument("--quick", action="store_true", help="small sizes for a fast smoke run")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the JSON here instead of stdout")
+    parser.add_argument("--baseline", help="earlier JSON output to compare against")
+    parser.add_argument("--database-url", help="scratch Postgres for the sessions benchmark (default: SQLite)")
+    parser.add_argument("--llm-latency", type=float, default=0.2)
+    parser.add_argument("--db-latency", type=float, default=0.002)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--chat-requests", type=int, default=200)
+    parser.add_argument("--corpus-sizes", type=int, nargs="+", default=[1000, 5000, 20000])
+    parser.add_argument("--session-sizes", type=int, nargs="+", default=[1000, 10000, 50000])
+    args = parser.parse_args()
+    if args.quick:
+        args.chat_requests, args.concurrency = 40, [1, 8]
+        args.corpus_sizes, args.session_sizes = [200, 1000], [200, 2000]
+    sections = args.only or ["startup", "chat", "retrieval", "ingestion", "sessions"]
+
+    workdir = tempfile.mkdtemp(prefix="chatbot-bench-")
+    server = None
+    if "startup" in sections:
+        from benchmarks.fake_llm_server import CONFIG, serve
+        CONFIG["latency"] = args.llm_latency
+        server = serve()
+    configure_environment(workdir, args.database_url,
+                          f"http://127.0.0.1:{server.server_port}" if server else None)
+
+    results = {}
+    if "startup" in sections:
+        try:
+            results["startup"] = bench_startup()
+        finally:
+            server.shutdown()
+    if "chat" in sections:
+        results["chat"] = bench_chat(args.corpus_sizes[0], args.concurrency, args.chat_requests,
+                                     args.llm_latency, args.db_latency, args.seed)
+    if "retrieval" in sections:
+        results["retrieval"] = bench_retrieval(args.corpus_sizes, 100, 3, args.seed)
+    if "ingestion" in sections:
+        results["ingestion"] = bench_ingestion(workdir, 20 if args.quick else 100, 20, args.seed)
+    if "sessions" in sections:
+        results["sessions"] = bench_sessions(args.session_sizes, 4, 50, 5 if args.quick else 20)
+
+    report = {
+        "meta": {
+            "suite_version": SUITE_VERSION,
+            "commit": git_commit(),
+            "timestamp": datetime.utcnow().isoformat() + "Z",
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "database": "postgres" if args.database_url else "sqlite",
+            # SQLite sessions timings don't reflect Postgres plans or partition pruning
+            "sessions_representative_of_postgres": bool(args.database_url),
+            "args": vars(args),
+        },
+        "results": results,
+    }
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            compare(json.load(f), report)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()